@@ -0,0 +1,556 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# ensemble.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""
+Ensembles of the GISTEMP analysis, for the uncertainty that comes from
+the sampling of the stations.
+
+Each member of an ensemble is the analysis of Steps 3 and 5 (gridding,
+then the boxes and the zones) for a resampling of the station records
+produced by Step 2.  A resampling is given by the *multiplicity* of
+each station: the number of times that it is drawn (see `sample`).  A
+station drawn more than once contributes to a subbox with its weight
+multiplied by that number; a station that is not drawn does not
+contribute.
+
+The members share everything that the sampling allows: the stations
+that contribute to each subbox, their weights, and the order in which
+they are combined, are worked out once (by `step3.prepare_stations`
+and `step3.subbox_contributors`), for all the stations.  The members
+are computed in batches, a batch at a time, with NumPy: the series of
+all the members of a batch are held in one array, and each step of
+combining is done for all of them at once.  The arithmetic is that of
+`series.numpy_combine_years` and `series.numpy_anomalize_years`, in the
+same order, so the member in which every station is drawn once is
+exactly the same as the analysis of `step3.iter_subbox_grid`,
+`step5.zonav`, and `step5.annzon` (when *parameters.stable_sort* is
+set, so is every member: the order of a subset of the stations is the
+order that they have among all the stations).  Where the order depends
+on the data of a member (the subboxes in a box, the boxes in a band,
+and the bands in a zone, which are combined in order of their number
+of valid data) each member has its own order.
+
+The regions (the 80 boxes) of each batch are independent, and can be
+computed in worker processes.
+
+NumPy is required.
+"""
+
+# Clear Climate Code
+import eqarea
+import giss_data
+import parameters
+import step3
+import step5
+from giss_data import MISSING
+
+# http://docs.python.org/release/2.4.4/lib/module-warnings.html
+import warnings
+try:
+    # Not available before Python 2.6.
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The methods of resampling the stations (see `sample`).
+METHODS = ['bootstrap', 'drop', 'region']
+
+def sample(method, records, members, seed, drop=None):
+    """The multiplicity of each station in each member of an ensemble,
+    as an array with one row for each of *members* members, and a
+    column for each of the station *records*.  *method* is one of:
+
+    'bootstrap'
+      The stations are drawn at random, with replacement, as many
+      times as there are stations.
+    'drop'
+      *drop* stations, chosen at random, are left out; the others are
+      drawn once.
+    'region'
+      The regions (the 80 boxes of the grid) that have stations are
+      drawn at random, with replacement, as many times as there are
+      such regions; each station is drawn as many times as its region
+      is.
+
+    The random numbers come from *seed*, so the same arguments always
+    give the same ensemble.
+    """
+
+    rnd = numpy.random.RandomState(seed)
+    n = len(records)
+    result = numpy.zeros((members, n), dtype=numpy.int32)
+    if method == 'bootstrap':
+        for m in range(members):
+            result[m] = numpy.bincount(rnd.randint(0, n, n), minlength=n)
+    elif method == 'drop':
+        if not 0 <= drop <= n:
+            raise ValueError("Can't drop %r of %d stations" % (drop, n))
+        result.fill(1)
+        for m in range(members):
+            result[m, rnd.permutation(n)[:drop]] = 0
+    elif method == 'region':
+        boxes = list(eqarea.grid())
+        region = numpy.array([station_region(boxes, record.station)
+          for record in records])
+        regions = numpy.unique(region)
+        for m in range(members):
+            drawn = regions[rnd.randint(0, len(regions), len(regions))]
+            counts = numpy.bincount(drawn, minlength=len(boxes))
+            result[m] = counts[region]
+    else:
+        raise ValueError("Unknown method %r" % method)
+    return result
+
+def station_region(boxes, station):
+    """The index, in *boxes*, of the box that contains *station*."""
+
+    lat = min(station.lat, 89.999)
+    for i,(s,n,w,e) in enumerate(boxes):
+        if s <= lat < n and w <= station.lon < e:
+            return i
+    raise ValueError("Station at %r,%r is in no box" % (station.lat,
+      station.lon))
+
+def combine(c, w, a, nw, min_overlap):
+    """As `series.numpy_combine_years`, for a batch of series: *c*
+    and *w* are arrays of (member, year, month), *a* is the new series
+    (for each member, or a single one, of shape (1, year, month)), and
+    *nw* is its weight (of the same shape as *a* or *c*, or one for
+    each member, of shape (member, 1, 1), or a constant).  Returns a
+    triple of fresh arrays (*composite*, *weight*, *data_combined*);
+    *data_combined* has a row for each member.
+    """
+
+    new_valid = a != MISSING
+    both = (c != MISSING) & new_valid
+    count = both.sum(axis=1)
+    zero = numpy.zeros((len(c), 1, 12))
+    sum = numpy.add.accumulate(
+      numpy.concatenate((zero, numpy.where(both, c, 0.0)), axis=1),
+      axis=1)[:,-1]
+    sum_new = numpy.add.accumulate(
+      numpy.concatenate((zero, numpy.where(both, a, 0.0)), axis=1),
+      axis=1)[:,-1]
+    months = count >= min_overlap
+    bias = (sum - sum_new) / numpy.maximum(count, 1)
+
+    update = new_valid & months[:,numpy.newaxis,:]
+    new_month_weight = w + nw
+    updated = ((w*c + nw*(a+bias[:,numpy.newaxis,:])) /
+      numpy.where(update, new_month_weight, 1.0))
+    c = numpy.where(update, updated, c)
+    w = numpy.where(update, new_month_weight, w)
+
+    data_combined = numpy.where(months, new_valid.sum(axis=1), 0)
+    return c, w, data_combined
+
+def anomalize(a, reference_period, base_year):
+    """As `series.numpy_anomalize_years`, for a batch of series: *a*
+    is an array of (member, year, month).  A fresh array is
+    returned."""
+
+    base = reference_period[0] - base_year
+    limit = reference_period[1] - base_year + 1
+    ok = a != MISSING
+
+    def means(a, ok):
+        """The mean of the valid data of each member and month (summed
+        in order, as `series.numpy_valid_mean` does), and their
+        number."""
+        total = numpy.add.accumulate(
+          numpy.where(ok, a, 0.0), axis=1)[:,-1]
+        count = ok.sum(axis=1)
+        return total / numpy.maximum(count, 1), count
+
+    mean, count = means(a, ok)
+    # Sliced as numpy_anomalize_years slices each month (so a *base*
+    # before the first year counts from the end).
+    if a[:,base:limit].shape[1]:
+        ref_mean, ref_count = means(a[:,base:limit], ok[:,base:limit])
+        mean = numpy.where(ref_count > 0, ref_mean, mean)
+    mean = mean[:,numpy.newaxis,:]
+    valid = ok & (count > 0)[:,numpy.newaxis,:]
+    return numpy.where(valid, a - mean, MISSING)
+
+def valid_counts(a):
+    """The number of valid data in each of the series of *a* (an array
+    whose last two axes are year and month)."""
+
+    return (a != MISSING).sum(axis=-1).sum(axis=-1)
+
+def sort_orders(good):
+    """For each row of *good* (an array of counts), the order (as
+    `step3.sort` puts them) of the indexes of the row, in descending
+    order of count.  Returns an array of the same shape."""
+
+    result = numpy.empty(good.shape, dtype=numpy.intp)
+    for i,row in enumerate(good.tolist()):
+        order = range(len(row))
+        step3.sort(order, lambda x,y: row[y] - row[x])
+        result[i] = order
+    return result
+
+class Ensemble(object):
+    """An ensemble of analyses of the station *records* (from Step 2),
+    for the resamplings *multiplicity* (see `sample`).
+
+    *meta* is the metadata of Step 3's output (its *yrbeg* and *monm*
+    are used).  *ocean* is a pair (*meta*, *cells*) of the ocean
+    subboxes used by Step 5 (their metadata, and an iterable of the
+    8000 subbox series, which is only iterated once), or None for the
+    land analysis only.  *mask* is a
+    list of the land weight of each subbox (as read from
+    *parameters.step5_mask*), or None to compute the weights, as Step 5
+    does.
+    """
+
+    def __init__(self, records, multiplicity, meta, ocean=None, mask=None,
+      radius=parameters.gridding_radius):
+        self.radius = radius
+        self.yrbeg = meta.yrbeg
+        self.years = meta.monm // 12
+        assert meta.monm % 12 == 0
+        given = list(records)
+        records, index, arc = step3.prepare_stations(given, radius)
+        # Every station record, padded to the years of the analysis.
+        self.data = numpy.empty((len(records), meta.monm))
+        self.data.fill(MISSING)
+        for i,record in enumerate(records):
+            aa, bb = record.rel_first_month, record.rel_last_month
+            self.data[i,aa-1:bb] = record.series
+        self.data = self.data.reshape(len(records), self.years, 12)
+        # The multiplicities, with their columns in the order of
+        # *records*, which is the order in which they are combined.
+        column = dict((id(r), i) for i,r in enumerate(given))
+        self.multiplicity = multiplicity[:,[column[id(r)] for r in records]]
+        position = dict((id(r), i) for i,r in enumerate(records))
+        # For each region, a (*box*, *subboxes*) pair, where
+        # *subboxes* is a list of the (*subbox*, *contributors*) pairs
+        # of the region, and *contributors* is a list of the (*index*,
+        # *weight*) pairs of the stations that contribute to the
+        # subbox (see `step3.grid_region`).
+        self.regions = []
+        for box, subboxes in eqarea.gridsub():
+            cells = []
+            for subbox in subboxes:
+                contributors = step3.subbox_contributors(records, index,
+                  arc, subbox)
+                cells.append((subbox, [(position[id(record)], weight)
+                  for record, weight in contributors]))
+            self.regions.append((box, cells))
+
+        self.mask = None
+        if mask is not None:
+            self.mask = numpy.array(mask).reshape(len(self.regions), -1)
+        self.ocean = None
+        if ocean is not None:
+            ocean_meta, cells = ocean
+            self.mixed_yrbeg = min(self.yrbeg, ocean_meta.yrbeg)
+            limit = max(self.yrbeg + self.years,
+              ocean_meta.yrbeg + ocean_meta.monm // 12)
+            self.mixed_years = limit - self.mixed_yrbeg
+            subboxes = sum([len(region[1]) for region in self.regions])
+            o = numpy.empty((subboxes, 12 * self.mixed_years))
+            o.fill(MISSING)
+            for i,cell in enumerate(cells):
+                offset = 12 * (cell.first_year - self.mixed_yrbeg)
+                o[i,offset:offset+len(cell)] = cell.series
+            o = o.reshape(len(self.regions), -1, self.mixed_years, 12)
+            self.ocean = o, valid_counts(o)
+
+    def members(self):
+        return len(self.multiplicity)
+
+    def analyses(self):
+        """The names of the analyses that are made."""
+
+        if self.ocean is None:
+            return ['land']
+        return ['land', 'mixed']
+
+    def grid_subbox(self, multiplicity, contributors):
+        """As `step3.grid_subbox`, for the members with
+        *multiplicity*.  Returns a pair (*series*, *d*): an array of
+        the anomaly series of the subbox for each member, and an array
+        of its *d* (the distance of its nearest contributing station
+        from the edge of the circle) for each member."""
+
+        members = len(multiplicity)
+        c = numpy.empty((members, self.years, 12))
+        c.fill(MISSING)
+        w = numpy.zeros(c.shape)
+        max_weight = numpy.zeros(members)
+        started = numpy.zeros(members, dtype=bool)
+        for i,wt in contributors:
+            k = multiplicity[:,i]
+            drawn = k > 0
+            if not drawn.any():
+                continue
+            a = self.data[i]
+            nw = (wt * k)[:,numpy.newaxis,numpy.newaxis]
+            # The first station drawn, for each member.
+            first = drawn & ~started
+            if first.any():
+                c[first] = a
+                w[first] = nw[first] * (a != MISSING)
+                max_weight[first] = wt
+                started |= first
+                drawn &= ~first
+            rows = numpy.nonzero(drawn)[0]
+            if not len(rows):
+                continue
+            c[rows], w[rows], data_combined = combine(c[rows], w[rows],
+              a[numpy.newaxis], nw[rows], parameters.gridding_min_overlap)
+            used = rows[data_combined.sum(axis=1) > 0]
+            max_weight[used] = numpy.maximum(max_weight[used], wt)
+        c = anomalize(c, parameters.gridding_reference_period, self.yrbeg)
+        d = numpy.where(started, self.radius * (1 - max_weight), MISSING)
+        return c, d
+
+    def grid_region(self, first, last, region):
+        """Compute the boxes of region number *region*, for the
+        members from *first* to *last* (not including *last*).  Returns
+        a list with one triple (*series*, *weight*, *ngood*) for each
+        analysis (see `combine_box`)."""
+
+        multiplicity = self.multiplicity[first:last]
+        members = len(multiplicity)
+        box, cells = self.regions[region]
+        land = numpy.empty((members, len(cells), self.years, 12))
+        d = numpy.empty((members, len(cells)))
+        for j,(subbox, contributors) in enumerate(cells):
+            land[:,j], d[:,j] = self.grid_subbox(multiplicity,
+              contributors)
+        good = valid_counts(land)
+        result = [combine_box(land, good, self.yrbeg)]
+        if self.ocean is None:
+            return result
+
+        # The mixed analysis: each subbox is either land or ocean (see
+        # step5.ensure_weight and step5.as_boxes).
+        ocean, ocean_good = [o[region] for o in self.ocean]
+        if self.mask is not None:
+            landmask = numpy.repeat(self.mask[region][numpy.newaxis] != 0,
+              members, axis=0)
+        else:
+            landmask = ((ocean_good < parameters.subbox_min_valid) |
+              (d < parameters.subbox_land_range))
+        offset = self.yrbeg - self.mixed_yrbeg
+        if offset or self.years != self.mixed_years:
+            padded = numpy.empty((members, len(cells), self.mixed_years, 12))
+            padded.fill(MISSING)
+            padded[:,:,offset:offset+self.years] = land
+            land = padded
+        mixed = numpy.where(landmask[:,:,numpy.newaxis,numpy.newaxis],
+          land, ocean[numpy.newaxis])
+        mixed_good = numpy.where(landmask, good, ocean_good[numpy.newaxis])
+        result.append(combine_box(mixed, mixed_good, self.mixed_yrbeg))
+        return result
+
+    def zones(self, boxes, analysis):
+        """The zones of *analysis*, from *boxes*, a list of the
+        results of `grid_region` for each region (for the same
+        members).  Returns a pair (*data*, *ann*), as `annzon_members`
+        does."""
+
+        a = ['land', 'mixed'].index(analysis)
+        series = numpy.array([box[a][0] for box in boxes]).swapaxes(0, 1)
+        weight = numpy.array([box[a][1] for box in boxes]).swapaxes(0, 1)
+        ngood = numpy.array([box[a][2] for box in boxes]).swapaxes(0, 1)
+        if analysis == 'land':
+            yrbeg = self.yrbeg
+        else:
+            yrbeg = self.mixed_yrbeg
+        return annzon_members(zonav_members(yrbeg, series, weight, ngood))
+
+    def run(self, batch=32, jobs=1):
+        """Compute the ensemble, *batch* members at a time, using
+        *jobs* worker processes.  For each batch (in order), yields a
+        dict that maps the name of each analysis to the pair (*data*,
+        *ann*) of its zones (see `annzon_members`), for the members of
+        the batch."""
+
+        members = self.members()
+        batches = [(first, min(first + batch, members))
+          for first in range(0, members, batch)]
+        regions = range(len(self.regions))
+        if jobs > 1 and multiprocessing:
+            # The workers are given the ensemble when they start; where
+            # processes are forked it is shared (copy-on-write) instead
+            # of being pickled.  map returns the results in the same
+            # order as the regions.
+            pool = multiprocessing.Pool(jobs, init_worker, (self,))
+        else:
+            pool = None
+        try:
+            for first, last in batches:
+                # The regions of a batch are given to the pool when the
+                # batch is wanted, so that a caller that stops early
+                # (closing the generator) only waits for one batch.
+                units = [(first, last, region) for region in regions]
+                if pool:
+                    boxes = pool.map(worker, units)
+                else:
+                    boxes = [self.grid_region(*unit) for unit in units]
+                yield dict((analysis, self.zones(boxes, analysis))
+                  for analysis in self.analyses())
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+# The ensemble used by worker, set by init_worker when a worker process
+# starts.
+_ensemble = None
+
+def init_worker(ensemble):
+    """Initialise a worker process (see `Ensemble.run`)."""
+
+    global _ensemble
+    _ensemble = ensemble
+
+def worker(unit):
+    """Compute a unit (a region, for a batch of members) in a worker
+    process."""
+
+    return _ensemble.grid_region(*unit)
+
+def combine_box(cells, good, yrbeg):
+    """As `step5.numpy_subbox_to_box`, for a batch: combine the
+    subboxes of a box.  *cells* is an array of (member, subbox, year,
+    month), and *good* has the number of valid data of each subbox of
+    each member.  Returns a triple (*series*, *weight*, *ngood*) of
+    arrays with a row for each member.
+    """
+
+    members = len(cells)
+    rows = numpy.arange(members)
+    order = sort_orders(good)
+    series = cells[rows, order[:,0]]
+    weight = (series != MISSING).astype(numpy.float64)
+    for k in range(1, cells.shape[1]):
+        i = order[:,k]
+        used = numpy.nonzero(good[rows, i] >= parameters.subbox_min_valid)[0]
+        if not len(used):
+            continue
+        series[used], weight[used], _ = combine(series[used], weight[used],
+          cells[used, i[used]], 1.0, parameters.box_min_overlap)
+    series = anomalize(series, parameters.subbox_reference_period, yrbeg)
+    return series, weight, valid_counts(series)
+
+def zonav_members(yrbeg, series, weight, ngood):
+    """As `step5.zonav`, for a batch: *series* and *weight* are
+    arrays of (member, box, year, month), and *ngood* has the number
+    of valid data of each box of each member.  Returns a pair
+    (*avg*, *wt*) of arrays of (member, zone, year, month).
+    """
+
+    boxes_in_band, band_in_zone = step5.zones()
+    members = len(series)
+    rows = numpy.arange(members)
+    bands = len(boxes_in_band)
+    shape = (members, bands + len(band_in_zone)) + series.shape[2:]
+    avg = numpy.empty(shape)
+    wt = numpy.empty(shape)
+    first = 0
+    for band in range(bands):
+        last = first + boxes_in_band[band]
+        length = ngood[:,first:last]
+        order = sort_orders(length) + first
+        a = series[rows, order[:,0]]
+        w = weight[rows, order[:,0]]
+        for n in range(1, boxes_in_band[band]):
+            # Once a box is empty, so are the rest of them.
+            used = numpy.nonzero(ngood[rows, order[:,n]] > 0)[0]
+            if not len(used):
+                break
+            i = order[used,n]
+            a[used], w[used], _ = combine(a[used], w[used], series[used, i],
+              weight[used, i], parameters.box_min_overlap)
+        empty = length.sum(axis=1) == 0
+        a[empty] = MISSING
+        w[empty] = 0.0
+        avg[:,band] = anomalize(a, parameters.box_reference_period, yrbeg)
+        wt[:,band] = w
+        first = last
+
+    lenz = valid_counts(avg[:,:bands])
+    iord = sort_orders(lenz)
+    for zone,in_zone in enumerate(band_in_zone):
+        member = numpy.array([[band in in_zone for band in row]
+          for row in iord.tolist()])
+        # The longest band in the zone, for each member.
+        j1 = member.argmax(axis=1)
+        a = avg[rows, iord[rows,j1]]
+        w = wt[rows, iord[rows,j1]]
+        for j in range(1, bands):
+            used = numpy.nonzero(member[:,j] & (j > j1))[0]
+            if not len(used):
+                continue
+            band = iord[used,j]
+            a[used], w[used], _ = combine(a[used], w[used], avg[used, band],
+              wt[used, band], parameters.box_min_overlap)
+        avg[:,bands+zone] = anomalize(a, parameters.box_reference_period,
+          yrbeg)
+        wt[:,bands+zone] = w
+    return avg, wt
+
+def annzon_members(zoned):
+    """As `step5.annzon` (with its default *alternate*), for a batch:
+    *zoned* is a pair (*avg*, *wt*) as returned by `zonav_members`.
+    Returns a pair (*data*, *ann*): the monthly data of each zone, an
+    array of (member, zone, year, month), and the annual means of each
+    zone, an array of (member, zone, year).
+    """
+
+    data = zoned[0].copy()
+    ok = data != MISSING
+    total = numpy.zeros(data.shape[:3])
+    for m in range(12):
+        total += numpy.where(ok[...,m], data[...,m], 0.0)
+    mon = ok.sum(axis=3)
+    ann = numpy.where(mon >= parameters.zone_annual_min_months,
+      total / numpy.maximum(mon, 1), MISSING)
+
+    # The alternate global mean.
+    for a in (ann, data):
+        glob = numpy.zeros(a[:,0].shape)
+        ok = numpy.ones(a[:,0].shape, dtype=bool)
+        for z,w in zip([8, 3, 4, 10], [3., 2., 2., 3.]):
+            ok &= a[:,z] != MISSING
+            glob += a[:,z]*w
+        a[:,-1] = numpy.where(ok, .1 * glob, MISSING)
+
+    # The alternate hemispheric means.
+    for a in (ann, data):
+        for ihem in range(2):
+            ok = (a[:,ihem+3] != MISSING) & (a[:,2*ihem+8] != MISSING)
+            a[:,ihem+11] = numpy.where(ok,
+              0.4*a[:,ihem+3] + 0.6*a[:,2*ihem+8], MISSING)
+    return data, ann
+
+def percentiles(values, q):
+    """The percentiles *q* (a list of numbers from 0 to 100) of
+    *values*, an array whose first axis is the member, ignoring missing
+    values.  Returns an array with a row for each percentile; where no
+    member has a valid value the result is MISSING."""
+
+    a = numpy.where(values == MISSING, numpy.nan, values)
+    # NumPy warns of each slice that is all missing.
+    filters = warnings.filters[:]
+    warnings.simplefilter('ignore', RuntimeWarning)
+    try:
+        result = numpy.nanpercentile(a, q, axis=0)
+    finally:
+        warnings.filters[:] = filters
+    return numpy.where(numpy.isnan(result), MISSING, result)
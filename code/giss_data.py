@@ -24,10 +24,13 @@ the `StationMetaData` and `SubboxMetaData` classes.
 """
 __docformat__ = "restructuredtext"
 
+# http://docs.python.org/release/2.4.4/lib/module-array.html
+import array
 import sys
 # http://docs.python.org/release/2.4.4/lib/warning-functions.html
 import warnings
 
+import parameters
 import read_config
 
 #: The base year for time series data. Data before this time is not
@@ -89,6 +92,18 @@ def v2_sources():
     return _v2_sources
 
 
+def new_storage(data=()):
+    """Return a fresh mutable sequence, holding the values in *data*,
+    to be used for the data of a `Series`.  According to
+    *parameters.series_storage* this is either a list or an array of
+    doubles (in which case MISSING is still used for missing data).
+    """
+
+    if parameters.series_storage == 'array':
+        return array.array('d', data)
+    return list(data)
+
+
 def clear_cache(func):
     """A decorator, for `Series` methods that change the data.
 
@@ -164,7 +179,9 @@ class Series(object):
     the data are average monthly temperature values in degrees
     Celsius), accessible via the `series` property.  This property
     should **always** be treated as read-only; the effect of modifying
-    elements is undefined.
+    elements is undefined.  Depending on *parameters.series_storage*
+    the `series` is either a list or an array (see `new_storage`);
+    code that wants a list should make one.
 
     The series coveres the months from `first_month` to `last_month` month
     inclusive. Months are counted from a non-existant year zero. So January,
@@ -227,7 +244,7 @@ class Series(object):
     """
     def __init__(self, **k):
         self._first_month = sys.maxint
-        self._series = []
+        self._series = new_storage()
         self._good_count = None
         self.ann_anoms = []
         series = None
@@ -318,10 +335,8 @@ class Series(object):
     def good_count(self):
         """The number of good values in the data."""
         if self._good_count is None:
-            bad_count = 0
-            for v in self._series:
-                bad_count += invalid(v)
-            self._good_count = len(self._series) - bad_count
+            self._good_count = len(self._series) - self._series.count(
+              MISSING)
         return self._good_count
 
     def asdict(self):
@@ -351,26 +366,33 @@ class Series(object):
         """The first month with any valid data.  Returned as a 1-based
         index (where January of year 0 is 1).
         """
-        index = (i for i,x in enumerate(self.series) if x != MISSING)
-        try:
-            first = index.next()
-        except StopIteration:
-            # No valid data.  Return a large number.
-            return 9999*12
-        return first + self.first_month
+        data = self._series
+        # Twelve months at a time, so that runs of missing years (the
+        # padding of a subbox series, for example) are skipped by
+        # *count*, without a loop over their months.
+        for i in range(0, len(data), 12):
+            year = data[i:i+12]
+            if year.count(MISSING) < len(year):
+                for j,x in enumerate(year):
+                    if x != MISSING:
+                        return i + j + self.first_month
+        # No valid data.  Return a large number.
+        return 9999*12
 
     def last_valid_month(self):
         """The last month with any valid data.  Returned as a 1-based
         index (where January of year 0 is 1).
         """
-        index = (i for i,x in reversed(list(enumerate(self.series)))
-          if x != MISSING)
-        try:
-            last = index.next()
-        except StopIteration:
-            # No valid data.  Return a small number.
-            return 1
-        return last + self.first_month
+        data = self._series
+        # As `first_valid_month`, from the end.
+        for i in range(len(data), 0, -12):
+            year = data[max(0, i-12):i]
+            if year.count(MISSING) < len(year):
+                for j in range(len(year)-1, -1, -1):
+                    if year[j] != MISSING:
+                        return i - len(year) + j + self.first_month
+        # No valid data.  Return a small number.
+        return 1
 
     def get_monthly_valid_counts(self):
         """Get number of good values for each month.
@@ -381,10 +403,22 @@ class Series(object):
 
         """
         monthly_valid = [0] * 12
-        for i, v in enumerate(self._series):
-            monthly_valid[(self.first_month + i - 1) % 12] += valid(v)
+        for i in range(12):
+            data = self._series[i::12]
+            monthly_valid[(self.first_month + i - 1) % 12] = (
+              len(data) - data.count(MISSING))
         return monthly_valid
 
+    def get_month_of_year(self, m):
+        """Get the data for a single month of the year, *m* (0 for
+        January, 11 for December), from each year of the series.  The
+        result is a fresh sequence of the same kind as `series`.  If
+        the series does not begin in January then the first value is
+        from the first year that has the month.
+        """
+
+        return self._series[(m - (self.first_month - 1)) % 12::12]
+
     # Year's worth of missing data
     missing_year = [MISSING]*12
 
@@ -454,7 +488,7 @@ class Series(object):
         January of (a hypothetical) 0 AD is 1."""
 
         self._first_month = first_month
-        self._series = list(series)
+        self._series = new_storage(series)
 
     def add_year(self, year, data):
         """Add a year's worth of data.  *data* should be a sequence of
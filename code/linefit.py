@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# linefit.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""Two-part linear (breakpoint) regression.
+
+Step 2 fits a line with a change in slope (a "knee") to the
+difference between an urban station and its rural neighbours, trying
+every candidate knee in turn.  `trend2` computes a single fit; it
+scans all the points, so trying each knee with `trend2` is O(n**2).
+
+`two_part_fits` instead computes running sums over the points once,
+and derives the fit for each knee from them.  Its results are very
+slightly different (in the last few bits) from those of `trend2`,
+because the arithmetic is done in a different order.
+`best_two_part_fit` uses `two_part_fits` to find the few knees that
+could possibly be the best, and then calls `trend2` on just those;
+so its result is exactly the same as trying every knee with `trend2`.
+
+A point is an (*x*, *v*) pair; *x* is usually a calendar year.  Points
+whose *v* is invalid are ignored.
+"""
+__docformat__ = "restructuredtext"
+
+import bisect
+
+from giss_data import MISSING, invalid
+
+
+def trend2(points, xmid, min):
+    """Finds a fit to the data *points[]*, using regression analysis,
+    by a line with a change in slope at *xmid*. Returned is a 4-tuple
+    (*sl1*, *sl2*, *rms*, *sl*): the left-hand slope, the right-hand
+    slope, the RMS error, and the slope of an overall linear fit.
+    """
+
+    count0 = count1 = 0
+    sx0 = sx1 = 0
+    sxx0 = sxx1 = 0
+    sxa0 = sxa1 = 0
+
+    sa = 0.0
+    saa = 0.0
+
+    for (x,v) in points:
+        if invalid(v):
+            continue
+        x -= xmid
+        sa += v
+        saa += v ** 2
+        if x > 0.0:
+            count1 += 1
+            sx1 += x
+            sxx1 += x ** 2
+            sxa1 += x * v
+        else:
+            count0 += 1
+            sx0 += x
+            sxx0 += x ** 2
+            sxa0 += x * v
+
+    if count0 < min or count1 < min:
+       return MISSING, MISSING, MISSING, MISSING
+
+    count = count0 + count1
+    denom = (count * sxx0 * sxx1
+             - sxx0 * sx1 ** 2
+             - sxx1 * sx0 ** 2)
+    sl1 = (sx0 * (sx1 * sxa1 - sxx1 * sa)
+           + sxa0 * (count * sxx1 - sx1 ** 2)) / denom
+    sl2 = (sx1 * (sx0 * sxa0 - sxx0 * sa)
+           + sxa1 * (count * sxx0 - sx0 ** 2)) / denom
+
+    ymid = (sa - sl1 * sx0 - sl2 * sx1) / count
+    rms = (count * ymid ** 2
+           + saa
+           - 2 * ymid * (sa - sl1 * sx0 - sl2 * sx1)
+           + sl1 * sl1 * sxx0
+           + sl2 * sl2 * sxx1
+           - 2 * sl1 * sxa0
+           - 2 * sl2 * sxa1)
+
+    # linear regression
+    sx = sx0 + sx1
+    sxx = sxx0 + sxx1
+    sxa = sxa0 + sxa1
+    sl = (count * sxa - sa * sx) / (count * sxx - sx ** 2)
+
+    return sl1, sl2, rms, sl
+
+
+def two_part_fits(points, knees, min):
+    """Fit *points* with a two-part line for each of the *knees* in
+    turn (an *xmid* for `trend2`).  A list is returned, with one
+    5-tuple (*sl1*, *sl2*, *rms*, *sl*, *error*) for each knee: the
+    first 4 items are as returned by `trend2`, *error* is a bound on
+    how much *rms* can differ from that computed by `trend2`.
+
+    The points need not be in order.  The time taken is proportional
+    to the number of points, plus the number of knees (times a
+    logarithmic factor for finding each knee amongst the points).
+    """
+
+    points = [(x,v) for x,v in points if not invalid(v)]
+    points.sort()
+    if not points:
+        return [(MISSING, MISSING, MISSING, MISSING, 0.0)] * len(knees)
+    # To keep the sums small, x is measured from the first point.
+    # For integer x (years) the sums of x and x**2 are exact.
+    x0 = points[0][0]
+    xs = [x for x,v in points]
+
+    # Running sums; *cx[i]* is the sum of x over the first *i*
+    # points, and so on.
+    cx = [0]
+    cxx = [0]
+    ca = [0.0]
+    cxa = [0.0]
+    saa = 0.0
+    for x,v in points:
+        x -= x0
+        cx.append(cx[-1] + x)
+        cxx.append(cxx[-1] + x ** 2)
+        ca.append(ca[-1] + v)
+        cxa.append(cxa[-1] + x * v)
+        saa += v ** 2
+    count = len(points)
+    sa = ca[-1]
+    sx = cx[-1]
+    sxx = cxx[-1]
+    sxa = cxa[-1]
+
+    result = []
+    for xmid in knees:
+        # The points at or to the left of the knee are the first *i*
+        # points.
+        i = bisect.bisect_right(xs, xmid)
+        count0 = i
+        count1 = count - i
+        if count0 < min or count1 < min:
+            result.append((MISSING, MISSING, MISSING, MISSING, 0.0))
+            continue
+        m = xmid - x0
+        # Sums over each part, with x measured from the knee.
+        sx0 = cx[i] - count0 * m
+        sxx0 = cxx[i] - 2 * m * cx[i] + count0 * m ** 2
+        sa0 = ca[i]
+        sxa0 = cxa[i] - m * sa0
+        sx1 = (sx - cx[i]) - count1 * m
+        sxx1 = (sxx - cxx[i]) - 2 * m * (sx - cx[i]) + count1 * m ** 2
+        sxa1 = (sxa - cxa[i]) - m * (sa - sa0)
+
+        denom = (count * sxx0 * sxx1
+                 - sxx0 * sx1 ** 2
+                 - sxx1 * sx0 ** 2)
+        sl1 = (sx0 * (sx1 * sxa1 - sxx1 * sa)
+               + sxa0 * (count * sxx1 - sx1 ** 2)) / denom
+        sl2 = (sx1 * (sx0 * sxa0 - sxx0 * sa)
+               + sxa1 * (count * sxx0 - sx0 ** 2)) / denom
+
+        ymid = (sa - sl1 * sx0 - sl2 * sx1) / count
+        terms = [count * ymid ** 2,
+                 saa,
+                 - 2 * ymid * (sa - sl1 * sx0 - sl2 * sx1),
+                 sl1 * sl1 * sxx0,
+                 sl2 * sl2 * sxx1,
+                 - 2 * sl1 * sxa0,
+                 - 2 * sl2 * sxa1]
+        rms = sum(terms)
+        # The rounding errors (ours and those of trend2) are tiny
+        # compared to the largest term; this bound is very generous.
+        error = 1e-8 * max(map(abs, terms))
+
+        # linear regression (x measured from the knee, as for trend2)
+        sxm = sx - count * m
+        sxxm = sxx - 2 * m * sx + count * m ** 2
+        sxam = sxa - m * sa
+        sl = (count * sxam - sa * sxm) / (count * sxxm - sxm ** 2)
+
+        result.append((sl1, sl2, rms, sl, error))
+    return result
+
+
+def best_two_part_fit(points, knees, min):
+    """Find the best two-part fit to *points*, amongst those with a
+    knee at one of *knees*.  Returns a 5-tuple (*knee*, *sl1*, *sl2*,
+    *rms*, *sl*), or None if there is no fit.
+
+    The result is exactly the same as calling `trend2` for each knee
+    and choosing the first with the smallest *rms*.
+    """
+
+    fits = two_part_fits(points, knees, min)
+    if not fits:
+        return None
+    # Any knee whose *rms* might be the smallest.
+    limit = sorted([rms + error for _,_,rms,_,error in fits])[0]
+    candidates = [knee for knee,(_,_,rms,_,error) in zip(knees, fits)
+      if rms - error <= limit]
+
+    best = None
+    rmsmin = 1.e20
+    for knee in candidates:
+        sl1, sl2, rms, sl = trend2(points, knee, min)
+        if rms < rmsmin:
+            rmsmin = rms
+            best = (knee, sl1, sl2, rms, sl)
+    return best
@@ -9,8 +9,18 @@
 import itertools
 from giss_data import valid, invalid, MISSING
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 """
 Shared series-processing code in the GISTEMP algorithm.
+
+Some of the functions (`combine`, `monthly_anomalies`, and
+`monthly_annual`) have two implementations: one in pure Python, and one
+using NumPy.  The NumPy implementation is used when NumPy is installed;
+see `use`.  Both produce exactly the same results.
 """
 
 
@@ -216,3 +226,215 @@ def monthly_annual(data):
                                       min = 3))
     return (annual_mean, annual_anom)
 
+
+
+# NumPy implementations.
+#
+# Each of these functions produces exactly the same result as the pure
+# Python function of the same name (the NumPy implementation is
+# chosen by `use`).  To achieve bit-for-bit identical results, sums
+# are accumulated in the same order as the Python code (from 0.0, in
+# increasing index order, skipping missing data), and each
+# arithmetic operation on an element is the same as in the Python
+# code.  Adding 0.0 in place of a missing datum does not change a
+# sum.
+
+def numpy_combine(composite, weight, new, new_weight, min_overlap):
+    """As `combine`, but using NumPy."""
+
+    n = len(new)
+    if len(composite) < n or len(weight) < n:
+        # *new* is longer than *composite*.  The Python code updates
+        # the part of *composite* that there is (or fails), so do
+        # exactly what it does.
+        return implementations['python']['combine'](composite, weight,
+          new, new_weight, min_overlap)
+    # Work on a whole number of years, padding with missing data
+    # (which is neither used, nor updated).
+    years = (n + 11) // 12
+    pad = 12*years - n
+
+    def as_array(a, fill):
+        a = numpy.asarray(a[:n], dtype=numpy.float64)
+        if pad:
+            a = numpy.concatenate((a, numpy.empty(pad)))
+            a[n:] = fill
+        return a.reshape(years, 12)
+
+    c = as_array(composite, MISSING)
+    w = as_array(weight, 0.0)
+    a = as_array(new, MISSING)
+    try:
+        new_weight[0]
+        nw = as_array(new_weight, 0.0)
+    except TypeError:
+        nw = new_weight
+
+    c, w, data_combined = numpy_combine_years(c, w, a, nw, min_overlap)
+    composite[:n] = c.ravel()[:n].tolist()
+    weight[:n] = w.ravel()[:n].tolist()
+    return data_combined.tolist()
+
+def numpy_combine_years(c, w, a, nw, min_overlap):
+    """The arithmetic of `numpy_combine`, on NumPy arrays with one row
+    for each year: *c* and *w* are the composite and its weights, *a*
+    is the new series, *nw* is its weight (an array of the same shape,
+    or a constant).  Returns a triple of fresh arrays (*composite*,
+    *weight*, *data_combined*).
+    """
+
+    new_valid = a != MISSING
+    both = (c != MISSING) & new_valid
+    count = both.sum(axis=0)
+    # Sums for each month, accumulated down the years.
+    zero = numpy.zeros((1, 12))
+    sum = numpy.add.accumulate(
+      numpy.concatenate((zero, numpy.where(both, c, 0.0))))[-1]
+    sum_new = numpy.add.accumulate(
+      numpy.concatenate((zero, numpy.where(both, a, 0.0))))[-1]
+    # Months for which there is enough overlap.
+    months = count >= min_overlap
+    bias = (sum - sum_new) / numpy.maximum(count, 1)
+
+    update = new_valid & months
+    new_month_weight = w + nw
+    updated = ((w*c + nw*(a+bias)) /
+      numpy.where(update, new_month_weight, 1.0))
+    c = numpy.where(update, updated, c)
+    w = numpy.where(update, new_month_weight, w)
+
+    data_combined = numpy.where(months, new_valid.sum(axis=0), 0)
+    return c, w, data_combined
+
+def numpy_monthly_anomalies(data, reference_period=None, base_year=-9999):
+    """As `monthly_anomalies`, but using NumPy."""
+
+    data = numpy.asarray(data, dtype=numpy.float64)
+    years = len(data) // 12
+    if reference_period:
+        base = reference_period[0] - base_year
+        limit = reference_period[1] - base_year + 1
+    else:
+        base = 0
+        limit = 0
+    monthly_mean = []
+    monthly_anom = []
+    for m in range(12):
+        row = data[m::12]
+        mean = numpy_valid_mean(row[base:limit])
+        if invalid(mean):
+            mean = numpy_valid_mean(row)
+        monthly_mean.append(mean)
+        if valid(mean):
+            monthly_anom.append(
+              numpy.where(row != MISSING, row - mean, MISSING).tolist())
+        else:
+            monthly_anom.append([MISSING]*years)
+    return monthly_mean, monthly_anom
+
+def numpy_anomalize_years(a, reference_period=None, base_year=-9999):
+    """As `anomalize`, but *a* is a NumPy array with one row for each
+    year.  A fresh array is returned."""
+
+    if reference_period:
+        base = reference_period[0] - base_year
+        limit = reference_period[1] - base_year + 1
+    else:
+        base = 0
+        limit = 0
+    result = numpy.empty(a.shape)
+    for m in range(12):
+        row = a[:,m]
+        mean = numpy_valid_mean(row[base:limit])
+        if invalid(mean):
+            mean = numpy_valid_mean(row)
+        if valid(mean):
+            result[:,m] = numpy.where(row != MISSING, row - mean, MISSING)
+        else:
+            result[:,m] = MISSING
+    return result
+
+def numpy_valid_mean(a):
+    """As `valid_mean` (with *min* of 1), but *a* is a NumPy
+    array."""
+
+    a = a[a != MISSING]
+    if len(a):
+        # Python's sum, because it adds in order.
+        return sum(a.tolist(), 0.0)/float(len(a))
+    return MISSING
+
+def numpy_valid_mean_rows(rows, min):
+    """Element-wise mean of the valid data in the equal length NumPy
+    arrays *rows*.  As if `valid_mean` (with *min*) were applied to
+    each "column" of data, one from each row.  Returned as a NumPy
+    array.
+    """
+
+    total = numpy.zeros(len(rows[0]))
+    count = numpy.zeros(len(rows[0]), dtype=int)
+    for row in rows:
+        ok = row != MISSING
+        total += numpy.where(ok, row, 0.0)
+        count += ok
+    return numpy.where(count >= min, total / numpy.maximum(count, 1),
+      MISSING)
+
+def numpy_monthly_annual(data):
+    """As `monthly_annual`, but using NumPy."""
+
+    years = len(data) // 12
+    monthly_mean, monthly_anom = monthly_anomalies(data)
+    anom = [numpy.array(row[:years], dtype=numpy.float64)
+      for row in monthly_anom]
+    # For December, we take the December of the previous year.
+    december = numpy.empty(years)
+    december[:1] = MISSING
+    december[1:] = anom[11][:-1]
+    anom[11] = december
+
+    seasonal_mean = []
+    seasonal_anom = []
+    for months in [[11, 0, 1],
+                   [2, 3, 4],
+                   [5, 6, 7],
+                   [8, 9, 10],]:
+        seasonal_mean.append(valid_mean((monthly_mean[m] for m in months),
+                                        min = 2))
+        seasonal_anom.append(
+          numpy_valid_mean_rows([anom[m] for m in months], min=2))
+
+    annual_mean = valid_mean(seasonal_mean, min = 3)
+    annual_anom = numpy_valid_mean_rows(seasonal_anom, min=3).tolist()
+    return (annual_mean, annual_anom)
+
+
+#: The available implementations of the functions that have more than
+#: one.  See `use`.
+implementations = dict(
+    python=dict(combine=combine,
+                monthly_anomalies=monthly_anomalies,
+                monthly_annual=monthly_annual),
+    numpy=dict(combine=numpy_combine,
+               monthly_anomalies=numpy_monthly_anomalies,
+               monthly_annual=numpy_monthly_annual),
+)
+
+#: The name of the implementation in use.
+implementation = 'python'
+
+def use(name):
+    """Use the implementation called *name* (either 'python' or
+    'numpy') for the functions that have more than one.  This is
+    chosen when this module is imported, but can be changed (for
+    example, to compare the implementations).
+    """
+
+    global implementation
+    if name == 'numpy' and numpy is None:
+        raise ImportError("NumPy is not installed.")
+    globals().update(implementations[name])
+    implementation = name
+
+if numpy is not None:
+    use('numpy')
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# spatial.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""Spatial index for points on a sphere.
+
+Both Step 2 (finding rural neighbours of an urban station) and Step 3
+(finding the stations that contribute to a subbox) need to find all
+the stations within a certain distance of some point.  Checking every
+station for every point is slow when there are many stations.  The
+`Index` class in this module buckets points so that only those near
+the point of interest need be checked.
+
+The index is a filter only; it returns candidates that *might* be
+within the distance.  Callers are expected to apply their own exact
+distance test to the candidates.  That way the results (and their
+order) are exactly the same as they would be without the index.
+"""
+__docformat__ = "restructuredtext"
+
+import math
+
+
+def unit_vector(lat, lon):
+    """Convert (*lat*, *lon*), in degrees, to an (x,y,z) triple on the
+    unit sphere.
+    """
+
+    lat = lat * math.pi / 180
+    lon = lon * math.pi / 180
+    return (math.cos(lat) * math.cos(lon),
+            math.cos(lat) * math.sin(lon),
+            math.sin(lat))
+
+
+class Index(object):
+    """An index of points on the unit sphere, each given as an (x,y,z)
+    triple.  Points are identified by their position in the sequence
+    used to create the index.
+
+    *arc* is the great circle distance (an angle in radians) that will
+    be used for queries.  Space is divided into cubes whose side is
+    (slightly more than) the chord corresponding to *arc*; any point
+    within *arc* of a query point must be in the same cube as the
+    query point, or in one of the 26 cubes that surround it.
+    """
+
+    def __init__(self, points, arc):
+        chord = 2 * math.sin(min(arc, math.pi) / 2)
+        # Make the cubes a little bigger than strictly necessary so
+        # that a point right on the edge of the circle is not lost
+        # due to rounding.
+        self.side = chord * 1.001 + 1e-9
+        self.cells = {}
+        for i, point in enumerate(points):
+            self.cells.setdefault(self.cell(point), []).append(i)
+
+    def cell(self, point):
+        """The cube that contains *point*, as a triple of integers."""
+
+        return tuple([int(math.floor(c / self.side)) for c in point])
+
+    def near(self, point):
+        """Return a list of the indexes of all the points that are
+        within *arc* of *point* (and possibly some that are a little
+        further away).  The list is in ascending order.
+        """
+
+        x, y, z = self.cell(point)
+        result = []
+        for i in (x-1, x, x+1):
+            for j in (y-1, y, y+1):
+                for k in (z-1, z, z+1):
+                    result.extend(self.cells.get((i, j, k), ()))
+        result.sort()
+        return result
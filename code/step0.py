@@ -16,8 +16,19 @@ Python code for the STEP0 part of the GISTEMP algorithm: combining
 diverse inputs into a single dataset.
 """
 
+# http://docs.python.org/release/2.4.4/lib/module-cPickle.html
+import cPickle
+# http://docs.python.org/release/2.4.4/lib/module-heapq.html
+import heapq
+# http://docs.python.org/release/2.4.4/lib/module-itertools.html
+import itertools
 # http://docs.python.org/release/2.4.4/lib/module-os.path.html
 import os
+# http://docs.python.org/release/2.4.4/lib/module-tempfile.html
+import tempfile
+
+# Clear Climate Code
+import parameters
 
 def correct_Hohenpeissenberg(ghcn_records, hohenpeissenberg_dict):
     """Replace Hohenpeissenberg data from 1880 to 2002 in the GHCN
@@ -28,29 +39,35 @@ def correct_Hohenpeissenberg(ghcn_records, hohenpeissenberg_dict):
     # The assignment will raise an exception if this assumption fails.
     (key,hohenpeissenberg), = hohenpeissenberg_dict.items()
     del hohenpeissenberg_dict[key]
-    cut = hohenpeissenberg.last_year + 1
 
     for record in ghcn_records.itervalues():
-        if record.station_uid == hohenpeissenberg.station_uid:
-            # Extract the data for the years more recent than the priv.
-            # comm. data.
-            new_data = []
-            for year in range(cut, record.last_year + 1):
-                new_data.extend(record.get_a_year(year))
-
-            if record.uid == hohenpeissenberg.uid:
-                # If the record has the same UID as Hohenpeissenberg then
-                # replace the data with Hohenpeissenberg plus the recent
-                # years.
-                last_year = record.last_year
-                record.set_series(hohenpeissenberg.first_month,
-                                  hohenpeissenberg.series)
-                for i, year in enumerate(range(cut, last_year + 1)):
-                    record.add_year(year, new_data[i * 12:(i + 1) * 12])
-            else:
-                # For other records, just replace the data with the later
-                # years.
-                record.set_series(cut * 12 + 1, new_data)
+        correct_Hohenpeissenberg_record(record, hohenpeissenberg)
+
+def correct_Hohenpeissenberg_record(record, hohenpeissenberg):
+    """Correct a single GHCN *record*, if it is from Hohenpeissenberg,
+    with the priv. comm. data in the record *hohenpeissenberg*."""
+
+    cut = hohenpeissenberg.last_year + 1
+    if record.station_uid == hohenpeissenberg.station_uid:
+        # Extract the data for the years more recent than the priv.
+        # comm. data.
+        new_data = []
+        for year in range(cut, record.last_year + 1):
+            new_data.extend(record.get_a_year(year))
+
+        if record.uid == hohenpeissenberg.uid:
+            # If the record has the same UID as Hohenpeissenberg then
+            # replace the data with Hohenpeissenberg plus the recent
+            # years.
+            last_year = record.last_year
+            record.set_series(hohenpeissenberg.first_month,
+                              hohenpeissenberg.series)
+            for i, year in enumerate(range(cut, last_year + 1)):
+                record.add_year(year, new_data[i * 12:(i + 1) * 12])
+        else:
+            # For other records, just replace the data with the later
+            # years.
+            record.set_series(cut * 12 + 1, new_data)
 
 def step0(input):
     """An iterator for Step 0.  Produces a stream of
@@ -58,8 +75,18 @@ def step0(input):
     has an open() method.  input.open(x) is called for each data source x.
     (typically, this input object is made by the tool.io.step0_input()
     function).
+
+    When *parameters.step0_stream* is True, the sources are merged as
+    streams (see `step0_stream`) instead of being read into memory.
     """
 
+    if parameters.step0_stream:
+        return step0_stream(input)
+    return step0_dicts(input)
+
+def step0_dicts(input):
+    """Step 0, reading every source into a dictionary."""
+
     # Read each data input into dictionary form.
     data = {}
     for source in input.sources:
@@ -82,3 +109,120 @@ def step0(input):
     for _, record in sorted(records.iteritems()):
         if record:
             yield record
+
+def step0_stream(input):
+    """Step 0, merging the sources as streams.  The result is the same
+    as that of `step0_dicts`: the records in order of uid, where a
+    record from a later source replaces one with the same uid from an
+    earlier source (and a later record replaces an earlier one from the
+    same source).
+
+    A source whose records are in order of uid (according to the
+    input's is_sorted method, if it has one) is read as it is merged,
+    so only a few of its records are in memory at once; the other
+    sources are sorted first (see `sorted_by_uid`).
+    """
+
+    sources = list(input.sources)
+    is_sorted = getattr(input, 'is_sorted', lambda source: False)
+    streams = []
+    for source in sources:
+        print "Load %s records" % source.upper()
+        records = input.open(source)
+        if not is_sorted(source):
+            records = sorted_by_uid(records)
+        streams.append(records)
+
+    # If we're using GHCN and Hohenpeissenberg then we correct one with
+    # the other.  The Hohenpeissenberg source is a single record.
+    if 'ghcn' in sources and 'hohenpeissenberg' in sources:
+        print "Correct the GHCN Hohenpeissenberg record."
+        i = sources.index('hohenpeissenberg')
+        (_,hohenpeissenberg), = dict(
+          (record.uid, record) for record in streams[i]).items()
+        streams[i] = iter([])
+        i = sources.index('ghcn')
+        streams[i] = correct_Hohenpeissenberg_stream(streams[i],
+          hohenpeissenberg)
+
+    for _, group in itertools.groupby(merge_by_uid(streams),
+      lambda (i,record): record.uid):
+        for _,record in group:
+            pass
+        # *record* is now the last record with this uid.
+        if record:
+            yield record
+
+def correct_Hohenpeissenberg_stream(ghcn_records, hohenpeissenberg):
+    """Apply `correct_Hohenpeissenberg_record` to each record of the
+    stream *ghcn_records*."""
+
+    for record in ghcn_records:
+        correct_Hohenpeissenberg_record(record, hohenpeissenberg)
+        yield record
+
+def merge_by_uid(streams):
+    """Merge *streams*, each an iterator of records in order of uid,
+    into a single stream in order of uid.  Yields an (*i*, *record*)
+    pair for each record, where *i* is the index of its stream in
+    *streams*.  Records with the same uid are in the order of their
+    *streams*, and then in the order they are in their stream.
+    """
+
+    heap = []
+    def push(i, stream, last):
+        """Push the next record of *stream* onto the heap."""
+        for record in stream:
+            if last is not None and record.uid < last:
+                raise ValueError("Records are not in order of uid:"
+                  " %s after %s." % (record.uid, last))
+            heapq.heappush(heap, (record.uid, i, record, stream))
+            return
+    for i,stream in enumerate(streams):
+        push(i, iter(stream), None)
+    while heap:
+        uid, i, record, stream = heapq.heappop(heap)
+        push(i, stream, uid)
+        yield i, record
+
+def sorted_by_uid(records, chunk=20000):
+    """Return an iterator of *records* in order of uid (records with
+    the same uid stay in the same order).  When there are more than
+    *chunk* records they are not all sorted in memory: each *chunk* is
+    sorted and written to a temporary file, and the sorted chunks are
+    merged.
+    """
+
+    runs = []
+    buffer = []
+    for record in records:
+        buffer.append(record)
+        if len(buffer) >= chunk:
+            runs.append(spill(buffer))
+            buffer = []
+    buffer.sort(key=lambda record: record.uid)
+    if not runs:
+        return iter(buffer)
+    runs.append(iter(buffer))
+    return (record for _,record in merge_by_uid(runs))
+
+def spill(records):
+    """Sort *records* by uid and write them to a temporary file;
+    returns an iterator that reads them back."""
+
+    records.sort(key=lambda record: record.uid)
+    f = tempfile.TemporaryFile()
+    pickler = cPickle.Pickler(f, 2)
+    for record in records:
+        pickler.dump(record)
+        pickler.clear_memo()
+    def read():
+        f.seek(0)
+        unpickler = cPickle.Unpickler(f)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                break
+        f.close()
+    return read()
@@ -32,7 +32,7 @@ def drop_strange(data):
     changes_dict = read_config.get_changes_dict()
     for record in data:
         changes = changes_dict.get(record.uid, [])
-        series = record.series
+        series = list(record.series)
         begin = record.first_year
         # :todo: Use record.last_year
         end = begin + (len(series)//12) - 1
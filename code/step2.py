@@ -22,19 +22,25 @@ __docformat__ = "restructuredtext"
 # Standard Python
 import math
 import itertools
-# http://docs.python.org/release/2.4.4/lib/module-os.path.html
-import os.path
+try:
+    # Not available before Python 2.6.
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
 
 # Clear Climate Code
 import earth
 import giss_data
+import linefit
 import parameters
+import spatial
+import steplog
 from giss_data import valid, invalid, MISSING
 
-log = open(os.path.join('log', 'step2.log'), 'w')
+log = steplog.Log('step2')
 
 
-def urban_adjustments(record_stream):
+def urban_adjustments(record_stream, jobs=1):
     """Takes an iterator of station records and applies an adjustment
     to urban stations to compensate for urban temperature effects.
     Returns an iterator of station records.  Rural stations are passed
@@ -62,44 +68,127 @@ def urban_adjustments(record_stream):
         record, try a second time for this urban station, with a
         larger radius.  If there is still not enough data, discard the
         urban station.
+
+    *jobs* is the number of worker processes to use.  When it is more
+    than 1 (and the multiprocessing module is available) the urban
+    stations are adjusted concurrently; the results, and the log, are
+    exactly the same as for a serial run.
     """
 
-    rural_stations, urban_stations, all = annotate_records(record_stream)
+    rural_stations, urban_stations, all, index = annotate_records(
+      record_stream)
+
+    # The position (in *all*) of each urban station.
+    urban = [i for i,record in enumerate(all) if record in urban_stations]
+
+    state = (rural_stations, urban_stations, all, index)
+    if jobs > 1 and multiprocessing:
+        # Any buffered output would otherwise be written once by each
+        # worker as well as by us.
+        log.flush()
+        # The workers are given *state* when they start.  Where
+        # processes are forked this shares the station records
+        # (copy-on-write) instead of pickling them.  imap returns the
+        # results in the same order as *urban*.
+        pool = multiprocessing.Pool(jobs, init_urban_worker, (state,))
+        adjustments = pool.imap(urban_worker, urban)
+    else:
+        # In a serial run adjust_urban writes to the log directly.
+        pool = None
+        adjustments = itertools.imap(
+          lambda i: ('', adjust_urban(state, i)), urban)
+
+    # Set when every record has been yielded.  If the caller stops
+    # early (closing the generator), or a worker fails, the pool is
+    # terminated, so that it does not go on adjusting the remaining
+    # urban stations.
+    finished = False
+    try:
+        # Combine time series for rural stations around each urban
+        # station.
+        for record in all:
+            if record not in urban_stations:
+                # Not an urban station.  Pass through unchanged.
+                log.info(record.uid, 'step2-action', 'rural')
+                yield record
+                continue
+
+            text, series = adjustments.next()
+            log.write(text)
+            if series is None:
+                log.info(record.uid, 'step2-action', 'dropped')
+                continue
 
-    # Combine time series for rural stations around each urban station
-    for record in all:
-        us = urban_stations.get(record, None)
-        if us is None:
-            # Not an urban station.  Pass through unchanged.
-            log.write('%s step2-action "rural"\n' % record.uid)
+            record.set_series(record.first_month, series)
             yield record
-            continue
+        finished = True
+    finally:
+        if pool:
+            if finished:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
 
-        points, quorate_count = rural_difference(us, rural_stations)
+# The state used by urban_worker, set by init_urban_worker when a
+# worker process starts.
+_urban_state = None
 
-        if not points:
-            log.write('%s step2-action "dropped"\n' % record.uid)
-            continue
+def init_urban_worker(state):
+    """Initialise a worker process (see `urban_adjustments`)."""
+
+    global _urban_state
+    _urban_state = state
 
-        fit = getfit(points)
+def urban_worker(i):
+    """Adjust an urban station in a worker process.  Returns a pair
+    (*text*, *series*): *text* is what would have been written to the
+    log; *series* is as for `adjust_urban`.
+    """
 
-        # The first and last years, in the urban series, that will be
-        # adjusted.
-        adjust_first, adjust_last = extend_range(
-          us.anomalies, quorate_count, fit.first, fit.last)
+    captured = log.capture()
+    series = adjust_urban(_urban_state, i)
+    return captured(), series
 
-        adjust_record(record, fit, adjust_first, adjust_last)
-        yield record
+def adjust_urban(state, i):
+    """Adjust the urban station at position *i* of the list of all
+    stations.  *state* is the tuple of (*rural*, *urban*, *all*,
+    *index*) returned by `annotate_records`.
+
+    Returns the adjusted data series, or None if the station cannot
+    be adjusted (and so should be discarded).
+    """
+
+    rural_stations, urban_stations, all, index = state
+    record = all[i]
+    us = urban_stations[record]
+
+    points, quorate_count = rural_difference(us, rural_stations, index)
+
+    if not points:
+        return None
+
+    fit = getfit(points)
+
+    # The first and last years, in the urban series, that will be
+    # adjusted.
+    adjust_first, adjust_last = extend_range(
+      us.anomalies, quorate_count, fit.first, fit.last)
+
+    adjust_record(record, fit, adjust_first, adjust_last)
+    return record.series
 
 def annotate_records(stream):
     """Take each of the records in *stream* and annotate them with
     computed data (critically, its annual anomaly series).  For each
     record an annotation object is created.
     
-    Returns a tuple of (*rural*, *urban*, *all*).  *rural* is a
-    list of annotation objects for rural stations (sorted); *urban* is a
-    dict that maps from an urban record to its annotation object; *all*
-    is a list that is a copy of the original stream of records.
+    Returns a tuple of (*rural*, *urban*, *all*, *index*).  *rural* is
+    a list of annotation objects for rural stations (sorted); *urban* is
+    a dict that maps from an urban record to its annotation object;
+    *all* is a list that is a copy of the original stream of records;
+    *index* is a `spatial.Index` of the locations of the stations in
+    *rural* (for use with `get_neighbours`).
 
     Note that *rural* and *urban* are disjoint, but not complete.  A
     station which has insufficient data to compute an annual anomaly
@@ -119,8 +208,8 @@ def annotate_records(stream):
             continue
         d = Struct()
         d.anomalies = anomalies
-        log.write("%s annual-anomaly %r\n" %
-          (record.uid, dict(year=giss_data.BASE_YEAR, series=anomalies)))
+        log.debug(record.uid, 'annual-anomaly',
+          lambda: dict(year=giss_data.BASE_YEAR, series=anomalies))
         station = record.station
         d.cslat = math.cos(station.lat * pi180)
         d.snlat = math.sin(station.lat * pi180)
@@ -142,7 +231,18 @@ def annotate_records(stream):
     rural_stations.sort(key=reclen)
     rural_stations.reverse()
 
-    return rural_stations, urban_stations, all
+    # Index the rural stations, so that we can find the neighbours of
+    # an urban station without considering every rural station.
+    index = spatial.Index([location(s) for s in rural_stations],
+      parameters.urban_adjustment_full_radius / earth.radius)
+
+    return rural_stations, urban_stations, all, index
+
+def location(s):
+    """The location of the annotated station *s* as an (x,y,z) triple
+    on the unit sphere."""
+
+    return (s.cslat * s.cslon, s.cslat * s.snlon, s.snlat)
 
 
 def annual_anomaly(record):
@@ -167,7 +267,7 @@ def annual_anomaly(record):
     series = record.series
     monthly_means = []
     for m in range(12):
-        month_data = series[m::12]
+        month_data = record.get_month_of_year(m)
         # Neglect December of final year, as we do not use its season.
         if m == 11:
             month_data = month_data[:-1]
@@ -268,17 +368,26 @@ class Struct(object):
     pass
 
 
-def get_neighbours(us, rural_stations, radius):
+def get_neighbours(us, rural_stations, radius, index=None):
     """Returns a list of the stations in *rural_stations* which are
     within distance *radius* of the urban station *us*.  Each rural
     station returned is given a 'weight' slot representing its
     distance fromn the urban station.
+
+    If *index* is supplied it should be a `spatial.Index` of
+    *rural_stations* (made for a radius at least as large as
+    *radius*); it is used to avoid considering distant stations.  The
+    result is the same, and in the same order, either way.
     """
     neighbours = []
 
     cos_crit = math.cos(radius / earth.radius)
     rbyrc = earth.radius / radius
 
+    if index is not None:
+        rural_stations = [rural_stations[i]
+          for i in index.near(location(us))]
+
     for rs in rural_stations:
         csdbyr = (rs.snlat * us.snlat + rs.cslat * us.cslat *
                      (rs.cslon * us.cslon  + rs.snlon * us.snlon))
@@ -433,9 +542,10 @@ def prepare_series(from_year, combined, urban_series, counts):
 # (only used in rural_differences function)
 MAX_YEARS = giss_data.get_last_year() - giss_data.BASE_YEAR + 1
 
-def rural_difference(urban, rural_stations):
+def rural_difference(urban, rural_stations, index=None):
     """For the urban station *urban*, generate a combined rural record
     from neighbouring stations and compute a set of differences.
+    *index* is passed to `get_neighbours`.
 
     Returns a pair (*points*, *quorate_count*) or (None, None) if a
     suitable combined rural record cannot be found.
@@ -444,7 +554,7 @@ def rural_difference(urban, rural_stations):
     dropStation = True
     R = parameters.urban_adjustment_full_radius
     for radius in [R/2, R]:
-        neighbours = get_neighbours(urban, rural_stations, radius)
+        neighbours = get_neighbours(urban, rural_stations, radius, index)
         if not neighbours:
             continue
         counts, combined = combine_neighbours(MAX_YEARS, neighbours)
@@ -465,12 +575,12 @@ def rural_difference(urban, rural_stations):
                                  * (last - first + 0.9)):
                 # Found a suitable combined record.
 
-                log.write('%s step2-action "adjusted"\n' % urban.uid)
-                log.write("%s neighbours %r\n" %
-                  (urban.uid, map(lambda r: r.uid, neighbours)))
-                log.write("%s adjustment %r\n" %
-                  (urban.uid, dict(series=combined, year=giss_data.BASE_YEAR,
-                    difference=points)))
+                log.info(urban.uid, 'step2-action', 'adjusted')
+                log.debug(urban.uid, 'neighbours',
+                  lambda: [r.uid for r in neighbours])
+                log.debug(urban.uid, 'adjustment',
+                  lambda: dict(series=combined, year=giss_data.BASE_YEAR,
+                    difference=points))
                 return points, quorate_count
 
             # Not enough good years for the given range.  Try to save
@@ -500,87 +610,18 @@ def getfit(points):
     fit.first = min(points)[0]
     fit.last = max(points)[0]
 
-    # Todo: incorporate trend2 into this.
-    rmsmin = 1.e20
-
-    for n in xrange(parameters.urban_adjustment_min_leg,
-                    len(points) - parameters.urban_adjustment_min_leg):
-        knee = points[n][0]
-        sl1, sl2, rms, sl = trend2(points, knee, 2)
-
-        if rms < rmsmin:
-             rmsmin = rms
-             fit.slope1 = sl1
-             fit.slope2 = sl2
-             fit.slope = sl
-             fit.knee = knee
+    # The candidate knees; the best fit is the one with the smallest
+    # RMS error (the first, if there is a tie).
+    knees = [points[n][0]
+      for n in xrange(parameters.urban_adjustment_min_leg,
+                      len(points) - parameters.urban_adjustment_min_leg)]
+    best = linefit.best_two_part_fit(points, knees, 2)
+    if best:
+        fit.knee, fit.slope1, fit.slope2, rms, fit.slope = best
 
     return fit
 
 
-def trend2(points, xmid, min):
-    """Finds a fit to the data *points[]*, using regression analysis,
-    by a line with a change in slope at *xmid*. Returned is a 4-tuple
-    (*sl1*, *sl2*, *rms*, *sl*): the left-hand slope, the right-hand
-    slope, the RMS error, and the slope of an overall linear fit.
-    """
-
-    # Todo: incorporate into getfit.
-    count0 = count1 = 0
-    sx0 = sx1 = 0
-    sxx0 = sxx1 = 0
-    sxa0 = sxa1 = 0
-
-    sa = 0.0
-    saa = 0.0
-
-    for (x,v) in points:
-        if invalid(v):
-            continue
-        x -= xmid
-        sa += v
-        saa += v ** 2
-        if x > 0.0:
-            count1 += 1
-            sx1 += x
-            sxx1 += x ** 2
-            sxa1 += x * v
-        else:
-            count0 += 1
-            sx0 += x
-            sxx0 += x ** 2
-            sxa0 += x * v
-
-    if count0 < min or count1 < min:
-       return MISSING, MISSING, MISSING, MISSING
-
-    count = count0 + count1
-    denom = (count * sxx0 * sxx1
-             - sxx0 * sx1 ** 2
-             - sxx1 * sx0 ** 2)
-    sl1 = (sx0 * (sx1 * sxa1 - sxx1 * sa)
-           + sxa0 * (count * sxx1 - sx1 ** 2)) / denom
-    sl2 = (sx1 * (sx0 * sxa0 - sxx0 * sa)
-           + sxa1 * (count * sxx0 - sx0 ** 2)) / denom
-
-    ymid = (sa - sl1 * sx0 - sl2 * sx1) / count
-    rms = (count * ymid ** 2
-           + saa
-           - 2 * ymid * (sa - sl1 * sx0 - sl2 * sx1)
-           + sl1 * sl1 * sxx0
-           + sl2 * sl2 * sxx1
-           - 2 * sl1 * sxa0
-           - 2 * sl2 * sxa1)
-
-    # linear regression
-    sx = sx0 + sx1
-    sxx = sxx0 + sxx1
-    sxa = sxa0 + sxa1
-    sl = (count * sxa - sa * sx) / (count * sxx - sx ** 2)
-
-    return sl1, sl2, rms, sl
-
-
 def extend_range(series, count, first, last):
     """Extend the range for adjusting, if possible.  *first* and *last*
     are the calendar years that define the range of quorate years.
@@ -723,10 +764,10 @@ def drop_short_records(record_source):
         if mmax >= parameters.station_drop_minimum_months:
             yield record
         else:
-            log.write('%s step2-action "short"\n' % record.uid)
+            log.info(record.uid, 'step2-action', 'short')
 
-def step2(record_source):
+def step2(record_source, jobs=1):
     data = drop_short_records(record_source)
-    adjusted = urban_adjustments(data)
+    adjusted = urban_adjustments(data, jobs=jobs)
     for record in adjusted:
         yield record
@@ -14,15 +14,28 @@ import eqarea
 import giss_data
 import parameters
 import series
+import spatial
+import steplog
 from giss_data import MISSING, valid, invalid
 
 import math
-# http://docs.python.org/release/2.4.4/lib/module-os.path.html
-import os.path
+# http://docs.python.org/release/2.4.4/lib/module-array.html
+import array
 import sys
 import itertools
+try:
+    # http://docs.python.org/release/2.5.4/lib/module-hashlib.html
+    from hashlib import sha1
+except ImportError:
+    # Python 2.4
+    from sha import new as sha1
+try:
+    # Not available before Python 2.6.
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
 
-log = open(os.path.join('log', 'step3.log'), 'w')
+log = steplog.Log('step3')
 
 
 def incircle(iterable, arc, lat, lon):
@@ -84,34 +97,146 @@ def sort(l, cmp):
     x > y.  The sort is ascending in the following sense:  For the sorted
     list: When i < j, cmp(l[i], l[j]) <= 0.
 
-    This sort is not stable.  In fact it is a deliberate emulation of
-    the O(n**2) sort implemented in the SORT subroutine of
+    This sort is not stable.  In fact it reproduces the order produced
+    by the O(n**2) sort implemented in the SORT subroutine of
     to.SBBXgrid.f.  This is necessary to achieve results that are as
-    close as possible to the GISS code.  We should switch to using
-    Python's built-in sort routine.
+    close as possible to the GISS code.  If
+    *parameters.stable_sort* is set then Python's built-in (stable)
+    sort is used instead.
     """
 
-    # See to.SBBXgrid.f lines 605 and following
-
-    for n in range(len(l)-1):
-        nlmax = n
-        for nn in range(n+1, len(l)):
-            if cmp(l[nn], l[nlmax]) < 0:
-                nlmax = nn
-        # swap items at n and nlmax
-        t = l[nlmax]
-        l[nlmax] = l[n]
-        l[n] = t
+    if parameters.stable_sort:
+        l.sort(cmp)
+        return
+
+    # See to.SBBXgrid.f lines 605 and following.  That is a selection
+    # sort: for each position *n* in turn, the first of the smallest
+    # items at or after *n* is swapped with the item at *n*.  So the
+    # smallest items are placed at the front, in the order in which
+    # they appear in the list; each displaced item moves to the
+    # position that the smallest item came from.  The same then
+    # happens for the next smallest items, and so on.  We emulate this
+    # by visiting the items in groups of equal items, in ascending
+    # order, and doing the swaps directly; this takes O(n log n) time
+    # instead of O(n**2).
+
+    # Items are identified by their original position in *l*.
+    # *order* is the (stably) sorted order.
+    order = range(len(l))
+    order.sort(lambda i,j: cmp(l[i], l[j]))
+    # at[p] is the item at position p; where[i] is the position of
+    # item i.
+    at = range(len(l))
+    where = range(len(l))
+    n = 0
+    while n < len(order):
+        # The group of equal items starting at order[n].
+        m = n + 1
+        while m < len(order) and cmp(l[order[m]], l[order[n]]) == 0:
+            m += 1
+        positions = [where[i] for i in order[n:m]]
+        positions.sort()
+        for p in positions:
+            # Swap the items at n and p.
+            i, j = at[n], at[p]
+            at[n], at[p] = j, i
+            where[j], where[i] = n, p
+            n += 1
+    l[:] = [l[i] for i in at]
     return
 
 
-def iter_subbox_grid(station_records, max_months, first_year, radius):
+def iter_subbox_grid(station_records, max_months, first_year, radius,
+  jobs=1, memo=None):
     """Convert the input *station_records*, into a gridded anomaly
     dataset which is returned as an iterator.
 
     *max_months* is the maximum number of months in any station
     record.  *first_year* is the first year in the dataset.  *radius*
     is the combining radius in kilometres.
+
+    *jobs* is the number of worker processes to use.  When it is more
+    than 1 (and the multiprocessing module is available) the regions
+    are gridded concurrently; the results, and the log, are exactly
+    the same as for a serial run.
+
+    *memo*, if not None, holds the subboxes computed by an earlier run
+    (see tool/corrections.py).  A subbox whose contributing stations,
+    their weights, and their data are all unchanged is taken from
+    *memo* instead of being computed again; every subbox computed is
+    given to *memo* (with its `put` method).
+    """
+
+    station_records, index, arc = prepare_stations(station_records, radius)
+
+    # A dribble of progress messages.
+    dribble = sys.stdout
+
+    # A digest of each station record, for the keys of *memo*.
+    digests = None
+    if memo:
+        digests = dict((record.uid, record_digest(record))
+          for record in station_records)
+
+    state = (station_records, index, arc, max_months, first_year, radius,
+      memo, digests)
+    regions = [(box, list(subboxes)) for box, subboxes in eqarea.gridsub()]
+    if jobs > 1 and multiprocessing:
+        # Any buffered output would otherwise be written once by each
+        # worker as well as by us.
+        dribble.flush()
+        log.flush()
+        # The workers are given *state* when they start.  Where
+        # processes are forked this shares the station records
+        # (copy-on-write) instead of pickling them.  imap returns the
+        # results in the same order as *regions*.
+        pool = multiprocessing.Pool(jobs, init_region_worker, (state,))
+        results = pool.imap(region_worker, regions)
+    else:
+        pool = None
+        results = itertools.imap(
+          lambda region: grid_region(state, region, dribble), regions)
+
+    # Set when every region has been gridded.  If the caller stops
+    # early (closing the generator), or a worker fails, the pool is
+    # terminated, so that it does not go on gridding the remaining
+    # regions.
+    finished = False
+    try:
+        for (box, subboxes), cells in itertools.izip(regions, results):
+            n_empty_cells = 0
+            for subbox, key, cell in cells:
+                if memo and key:
+                    memo.put(key, cell)
+                box_obj = cell_series(subbox, max_months, cell)
+                stations, contributed = cell[1], cell[-1]
+                if stations == 0:
+                    n_empty_cells += 1
+                elif contributed is not None:
+                    log.debug(box_obj.uid, 'stations', contributed)
+                yield box_obj
+            plural_suffix = 's'
+            if n_empty_cells == 1:
+                plural_suffix = ''
+            dribble.write(
+              '\rRegion (%+03.0f/%+03.0f S/N %+04.0f/%+04.0f W/E): %d empty cell%s.\n' %
+                (tuple(box) + (n_empty_cells,plural_suffix)))
+        dribble.write("\n")
+        finished = True
+    finally:
+        if pool:
+            if finished:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+
+def prepare_stations(station_records, radius):
+    """Prepare the *station_records* for gridding with the combining
+    *radius* (in kilometres).  Returns a triple (*station_records*,
+    *index*, *arc*): the records, as a list in the order in which they
+    are combined; a `spatial.Index` of their locations; and the radius
+    as an angle of arc (in radians).  See `subbox_contributors`.
     """
 
     # Clear Climate Code
@@ -120,122 +245,224 @@ def iter_subbox_grid(station_records, max_months, first_year, radius):
     # Convert to list because we re-use it for each box (region).
     station_records = list(station_records)
     # Descending sort by number of good records.
-    # TODO: Switch to using Python's sort method here, although it
-    # will change the results.
     sort(station_records, lambda x,y: y.good_count - x.good_count)
 
-    # A dribble of progress messages.
-    dribble = sys.stdout
-
     # Critical radius as an angle of arc
     arc = radius / earth.radius
-    arcdeg = arc * 180 / math.pi
 
-    regions = list(eqarea.gridsub())
-    for region in regions:
-        box, subboxes = region[0], list(region[1])
+    # An index of the station locations, so that for each subbox we
+    # only need to consider the stations that are nearby.
+    index = spatial.Index([spatial.unit_vector(r.station.lat, r.station.lon)
+      for r in station_records], arc)
+    return station_records, index, arc
+
+def subbox_contributors(station_records, index, arc, subbox):
+    """The stations that contribute to *subbox*, as a list of
+    (*record*, *weight*) pairs in the order in which they are combined.
+    *station_records*, *index*, and *arc* are as returned by
+    `prepare_stations`."""
+
+    # The index gives us the nearby stations, in the same order as
+    # *station_records*; incircle makes the final selection.
+    centre = eqarea.centre(subbox)
+    nearby = [station_records[i]
+      for i in index.near(spatial.unit_vector(*centre))]
+    return list(incircle(nearby, arc, *centre))
+
+# The state used by region_worker, set by init_region_worker when a
+# worker process starts.
+_region_state = None
+
+def init_region_worker(state):
+    """Initialise a worker process (see `iter_subbox_grid`)."""
+
+    global _region_state
+    _region_state = state
+
+def region_worker(region):
+    """Grid a region in a worker process."""
+
+    return grid_region(_region_state, region)
+
+def grid_region(state, region, dribble=None):
+    """Grid the subboxes of a single region.  *state* is a tuple of
+    (*station_records*, *index*, *arc*, *max_months*, *first_year*,
+    *radius*, *memo*, *digests*), see `iter_subbox_grid`; *region* is
+    a (*box*, *subboxes*) pair.
+
+    A list with one (*subbox*, *key*, *cell*) triple for each subbox
+    is returned.  *cell* is as returned by `grid_subbox`; *key* is its
+    key in *memo* (None if there is no *memo*, or the subbox is
+    empty).  If *dribble* is not None, progress messages are written
+    to it.
+    """
 
-        # Count how many cells are empty
-        n_empty_cells = 0
-        for subbox in subboxes:
-            # Select and weight stations
-            centre = eqarea.centre(subbox)
+    (station_records, index, arc, max_months, first_year, radius,
+      memo, digests) = state
+    box, subboxes = region
+
+    result = []
+    # Count how many cells are empty
+    n_empty_cells = 0
+    for subbox in subboxes:
+        # Select and weight stations
+        centre = eqarea.centre(subbox)
+        if dribble:
             dribble.write("\rsubbox at %+05.1f%+06.1f (%d empty)" % (
               centre + (n_empty_cells,)))
             dribble.flush()
-            # Determine the contributing stations to this grid cell.
-            contributors = list(incircle(station_records, arc, *centre))
-
-            # Combine data.
-            subbox_series = [MISSING] * max_months
+        # Determine the contributing stations to this grid cell.
+        contributors = subbox_contributors(station_records, index, arc,
+          subbox)
+
+        key = None
+        cell = None
+        if not contributors:
+            n_empty_cells += 1
+        elif memo:
+            key = subbox_key(subbox, contributors, digests, max_months,
+              first_year, radius)
+            cell = memo.get(key)
+        if cell is None:
+            cell = grid_subbox(contributors, max_months, first_year,
+              radius)
+        result.append((subbox, key, cell))
+    return result
+
+def grid_subbox(contributors, max_months, first_year, radius):
+    """Combine the *contributors*, a list of (*record*, *weight*)
+    pairs, into the series for a subbox.  Returns a tuple of
+    (*series*, *stations*, *station_months*, *d*, *contributed*):
+    the attributes of the subbox series (see `cell_series`), and the
+    list of stations that contributed to it (for the log).
+    *contributed* is None if the subbox is empty, or if the log does
+    not record it (it is made only when the log is at DEBUG level).
+    """
 
-            if not contributors:
-                box_obj = giss_data.Series(series=subbox_series,
-                    box=list(subbox), stations=0, station_months=0,
-                    d=MISSING)
-                n_empty_cells += 1
-                yield box_obj
-                continue
-
-            # Initialise series and weight arrays with first station.
-            record,wt = contributors[0]
-            total_good_months = record.good_count
-            total_stations = 1
-
-            offset = record.rel_first_month - 1
-            a = record.series # just a temporary
-            subbox_series[offset:offset + len(a)] = a
-            max_weight = wt
-            weight = [wt*valid(v) for v in subbox_series]
-
-            # For logging, keep a list of stations that contributed.
-            # Each item in this list is a triple (in list form, so that
-            # it can be converted to JSON easily) of [id12, weight,
-            # months].  *id12* is the 12 character station identifier;
-            # *weight* (a float) is the weight (computed based on
-            # distance) of the station's series; *months* is a 12 digit
-            # string that records whether each of the 12 months is used.
-            # '0' in position *i* indicates that the month was not used,
-            # a '1' indicates that is was used.  January is position 0.
-            l = [any(valid(v) for v in subbox_series[i::12])
-              for i in range(12)]
-            s = ''.join('01'[x] for x in l)
-            contributed = [[record.uid,wt,s]]
-
-            # Add in the remaining stations
-            for record,wt in contributors[1:]:
-                # TODO: A method to produce a padded data series
-                #       would be good here. Hence we could just do:
-                #           new = record.padded_series(max_months)
-                new = [MISSING] * max_months
-                aa, bb = record.rel_first_month, record.rel_last_month
-                new[aa - 1:bb] = record.series
-                station_months = series.combine(
-                    subbox_series, weight, new, wt,
-                    parameters.gridding_min_overlap)
-                n_good_months = sum(station_months)
-                total_good_months += n_good_months
-                if n_good_months == 0:
-                    contributed.append([record.uid, 0.0, '0'*12])
-                    continue
-                total_stations += 1
-                s = ''.join('01'[bool(x)] for x in station_months)
-                contributed.append([record.uid,wt,s])
-
-                max_weight = max(max_weight, wt)
-
-            series.anomalize(subbox_series,
-                             parameters.gridding_reference_period, first_year)
-            box_obj = giss_data.Series(series=subbox_series, n=max_months,
-                    box=list(subbox), stations=total_stations,
-                    station_months=total_good_months,
-                    d=radius*(1-max_weight))
-            log.write("%s stations %s\n" % (box_obj.uid,
-              asjson(contributed)))
-            yield box_obj
-        plural_suffix = 's'
-        if n_empty_cells == 1:
-            plural_suffix = ''
-        dribble.write(
-          '\rRegion (%+03.0f/%+03.0f S/N %+04.0f/%+04.0f W/E): %d empty cell%s.\n' %
-            (tuple(box) + (n_empty_cells,plural_suffix)))
-    dribble.write("\n")
-
-def asjson(obj):
-    """Return a string: The JSON representation of the object "obj".
-    This is a peasant's version, not intentended to be fully JSON
-    general."""
-
-    return repr(obj).replace("'", '"')
-
-
-def step3(records, radius=parameters.gridding_radius, year_begin=1880):
+    # Combine data.
+    subbox_series = [MISSING] * max_months
+
+    if not contributors:
+        return subbox_series, 0, 0, MISSING, None
+
+    # Initialise series and weight arrays with first station.
+    record,wt = contributors[0]
+    total_good_months = record.good_count
+    total_stations = 1
+
+    offset = record.rel_first_month - 1
+    a = record.series # just a temporary
+    subbox_series[offset:offset + len(a)] = a
+    max_weight = wt
+    weight = [wt*valid(v) for v in subbox_series]
+
+    # For logging, keep a list of stations that contributed.
+    # Each item in this list is a triple (in list form, so that
+    # it can be converted to JSON easily) of [id12, weight,
+    # months].  *id12* is the 12 character station identifier;
+    # *weight* (a float) is the weight (computed based on
+    # distance) of the station's series; *months* is a 12 digit
+    # string that records whether each of the 12 months is used.
+    # '0' in position *i* indicates that the month was not used,
+    # a '1' indicates that is was used.  January is position 0.
+    contributed = None
+    if log.enabled(steplog.DEBUG):
+        l = [any(valid(v) for v in subbox_series[i::12])
+          for i in range(12)]
+        s = ''.join('01'[x] for x in l)
+        contributed = [[record.uid,wt,s]]
+
+    # Add in the remaining stations
+    for record,wt in contributors[1:]:
+        # TODO: A method to produce a padded data series
+        #       would be good here. Hence we could just do:
+        #           new = record.padded_series(max_months)
+        new = [MISSING] * max_months
+        aa, bb = record.rel_first_month, record.rel_last_month
+        new[aa - 1:bb] = record.series
+        station_months = series.combine(
+            subbox_series, weight, new, wt,
+            parameters.gridding_min_overlap)
+        n_good_months = sum(station_months)
+        total_good_months += n_good_months
+        if n_good_months == 0:
+            if contributed is not None:
+                contributed.append([record.uid, 0.0, '0'*12])
+            continue
+        total_stations += 1
+        if contributed is not None:
+            s = ''.join('01'[bool(x)] for x in station_months)
+            contributed.append([record.uid,wt,s])
+
+        max_weight = max(max_weight, wt)
+
+    series.anomalize(subbox_series,
+                     parameters.gridding_reference_period, first_year)
+    return (subbox_series, total_stations, total_good_months,
+      radius*(1-max_weight), contributed)
+
+def cell_series(subbox, max_months, cell):
+    """The `giss_data.Series` for *subbox*, from *cell* (as returned
+    by `grid_subbox`)."""
+
+    data, stations, station_months, d, contributed = cell
+    if stations == 0:
+        return giss_data.Series(series=data,
+            box=list(subbox), stations=0, station_months=0,
+            d=MISSING)
+    return giss_data.Series(series=list(data), n=max_months,
+            box=list(subbox), stations=stations,
+            station_months=station_months, d=d)
+
+def record_digest(record):
+    """A digest of the data of the station *record*: everything about
+    it that `grid_subbox` uses."""
+
+    h = sha1()
+    h.update('%s %r %r %r\n' % (record.uid, record.rel_first_month,
+      record.good_count, len(record.series)))
+    h.update(array.array('d', record.series).tostring())
+    return h.digest()
+
+def subbox_key(subbox, contributors, digests, max_months, first_year,
+  radius):
+    """The key in the memo (see `iter_subbox_grid`) of the subbox
+    with the (*record*, *weight*) pairs *contributors*.  *digests*
+    maps the uid of each record to its `record_digest`.  Whether the
+    log is at DEBUG level is part of the key, because the subbox's list
+    of contributing stations is only kept when it is."""
+
+    h = sha1()
+    h.update('%r %r %r %r %r %r %r\n' % (list(subbox), max_months,
+      first_year, radius, parameters.gridding_min_overlap,
+      parameters.gridding_reference_period, log.enabled(steplog.DEBUG)))
+    for record,wt in contributors:
+        h.update('%s %r\n' % (digests[record.uid], wt))
+    return h.hexdigest()
+
+def step3(records, radius=parameters.gridding_radius, year_begin=1880,
+  jobs=1, memo=None):
     """Step 3 of the GISS processing.
 
-    *records* should be a generator that yields each station.
+    *records* should be a generator that yields each station.  *jobs*
+    is the number of worker processes to use for gridding.  *memo*
+    holds the results of an earlier run, for a re-run after corrections
+    (see `iter_subbox_grid`).
 
     """
 
+    meta = subbox_metadata(radius)
+    box_source = iter_subbox_grid(records, meta.monm, meta.yrbeg, radius,
+      jobs=jobs, memo=memo)
+
+    yield meta
+    for box in box_source:
+        yield box
+
+def subbox_metadata(radius):
+    """The metadata of the subbox series made by Step 3, for the
+    combining *radius*."""
+
     # Most of the metadata here used to be synthesized in step2.py and
     # copied from the first yielded record.  Now we synthesize here
     # instead.
@@ -255,9 +482,4 @@ def step3(records, radius=parameters.gridding_radius, year_begin=1880):
     meta.mo1 = 1
     meta.title = title.ljust(80)
     meta.gridding_radius = radius
-
-    box_source = iter_subbox_grid(records, monm, year_begin, radius)
-
-    yield meta
-    for box in box_source:
-        yield box
+    return meta
@@ -10,7 +10,12 @@ __docformat__ = "restructuredtext"
 
 import sys
 import itertools
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
+import eqarea
 from giss_data import MISSING, valid, invalid
 import parameters
 from tool import gio
@@ -26,7 +31,6 @@ def merge_ocean(ocean, sst, dates):
 
     clim = gio.step4_load_clim()
 
-    first_new_year = dates[0][0]
     last_new_year = dates[-1][0]
     last_new_month = dates[-1][1]
 
@@ -40,39 +44,129 @@ def merge_ocean(ocean, sst, dates):
     yield meta
 
     # Average into Sergej's subbox grid
+    if numpy:
+        anomalies = grid_anomalies(sst, clim, dates)
+    else:
+        anomalies = {}
     for box in reader:
         box.pad_with_missing(meta.monm)
 
-        # identify all the degree boxes which are included in this subbox
-        js = int(box.lat_S + 90.01)
-        jn = int(box.lat_N + 89.99)
-        iw = int(box.lon_W + 360.01)
-        ie = int(box.lon_E + 359.99)
-        if ie >= 360:
-            iw = iw - 360
-            ie = ie - 360
-
-        for y, m in dates:
-            mm = (y - first_new_year) * 12 + m
-            month = (m - 1) % 12
-            count = 0
-            sum = 0.0
-            for j in range(js, jn+1):
-                for i in range(iw, ie+1):
-                    if (sst[i][j][mm-1] < parameters.sea_surface_cutoff_temp
-                        or invalid(clim[i][j][month])):
-                        continue
-                    count += 1
-                    sum += sst[i][j][mm-1] - clim[i][j][month]
-
+        cells = degree_cells(box.lat_S, box.lat_N, box.lon_W, box.lon_E)
+        if cells in anomalies:
+            values = anomalies[cells]
+        else:
+            values = cell_anomalies(sst, clim, dates, cells)
+        for (y, m), v in zip(dates, values):
             index = (y - IYRBEG) * 12 + m - 1
-            box.set_value(index, MISSING)
-            if count > 0:
-                box.set_value(index, sum / count)
+            box.set_value(index, v)
 
         box.trim()
         yield box
 
+def degree_cells(lat_S, lat_N, lon_W, lon_E):
+    """Identify all the degree boxes which are included in the subbox
+    with the given bounds.  Returns a 4-tuple (*js*, *jn*, *iw*, *ie*)
+    of the (inclusive) ranges of the latitude and longitude indexes of
+    the degree boxes.  *iw* may be negative (and the index wraps
+    around).
+    """
+
+    js = int(lat_S + 90.01)
+    jn = int(lat_N + 89.99)
+    iw = int(lon_W + 360.01)
+    ie = int(lon_E + 359.99)
+    if ie >= 360:
+        iw = iw - 360
+        ie = ie - 360
+    return js, jn, iw, ie
+
+def cell_anomalies(sst, clim, dates, cells):
+    """Compute the sea-surface temperature anomaly of the subbox
+    covering the degree boxes *cells* (see `degree_cells`), for each
+    of the dates in *dates*.  The anomaly is the average, over the
+    degree boxes, of the difference between *sst* and the climatology
+    *clim*; degree boxes that are colder than
+    *parameters.sea_surface_cutoff_temp* (ice) or have no climatology
+    are not used.  A list is returned, with MISSING where no degree
+    box can be used.
+    """
+
+    js, jn, iw, ie = cells
+    first_new_year = dates[0][0]
+    result = []
+    for y, m in dates:
+        mm = (y - first_new_year) * 12 + m
+        month = (m - 1) % 12
+        count = 0
+        sum = 0.0
+        for j in range(js, jn+1):
+            for i in range(iw, ie+1):
+                if (sst[i][j][mm-1] < parameters.sea_surface_cutoff_temp
+                    or invalid(clim[i][j][month])):
+                    continue
+                count += 1
+                sum += sst[i][j][mm-1] - clim[i][j][month]
+        if count > 0:
+            result.append(float(sum / count))
+        else:
+            result.append(MISSING)
+    return result
+
+def grid_anomalies(sst, clim, dates):
+    """As `cell_anomalies`, but for every subbox of the standard 8000
+    subbox grid at once, using NumPy.  *sst* and *clim* should be
+    NumPy arrays.  A dict is returned that maps from the *cells* tuple
+    of each subbox to its list of anomalies.
+
+    The result is exactly the same as that of `cell_anomalies`; in
+    particular, the differences are added up in the same order.
+    """
+
+    # A sparse map from each subbox to its degree boxes.  Row *k* of
+    # *index* has the (flattened) indexes of the degree boxes of
+    # subbox *k*, in the order that cell_anomalies visits them; rows
+    # are padded (with *present* False) to the same length.
+    keys = []
+    rows = []
+    for subbox in eqarea.grid8k():
+        # As stored in a subbox file: in hundredths of a degree.
+        bounds = [int(round(x * 100)) / 100.0 for x in subbox]
+        cells = degree_cells(*bounds)
+        js, jn, iw, ie = cells
+        keys.append(cells)
+        rows.append([(i % 360) * 180 + j
+          for j in range(js, jn+1) for i in range(iw, ie+1)])
+    width = max(map(len, rows))
+    index = numpy.zeros((len(rows), width), dtype=int)
+    present = numpy.zeros((len(rows), width), dtype=bool)
+    for k,row in enumerate(rows):
+        index[k,:len(row)] = row
+        present[k,:len(row)] = True
+
+    sst = numpy.asarray(sst, dtype=float).reshape(360*180, -1)
+    clim = numpy.asarray(clim, dtype=float).reshape(360*180, -1)
+    first_new_year = dates[0][0]
+    columns = []
+    for y, m in dates:
+        mm = (y - first_new_year) * 12 + m
+        month = (m - 1) % 12
+        s = sst[:,mm-1][index]
+        c = clim[:,month][index]
+        use = (present & ~(s < parameters.sea_surface_cutoff_temp) &
+          (c != MISSING))
+        difference = numpy.where(use, s - c, 0.0)
+        # Add up each row in order (as cell_anomalies does), so that
+        # the sums are exactly the same.
+        sum = numpy.zeros(len(rows))
+        for k in range(width):
+            sum += difference[:,k]
+        count = use.sum(axis=1)
+        columns.append(numpy.where(count > 0,
+          sum / numpy.maximum(count, 1), MISSING))
+
+    values = numpy.array(columns).T.tolist()
+    return dict(zip(keys, values))
+
 
 def step4(data):
     """Step 4 of GISTEMP processing.  This is a little unusual
@@ -20,14 +20,30 @@ import eqarea
 import giss_data
 import parameters
 import series
+import steplog
 from tool import gio
 from giss_data import valid, invalid, MISSING
 
+# http://docs.python.org/release/2.4.4/lib/module-bisect.html
+import bisect
 # http://www.python.org/doc/2.3.5/lib/itertools-functions.html
 import itertools
-import os
-
-log = open(os.path.join('log', 'step5.log'), 'w')
+# http://docs.python.org/release/2.4.4/lib/module-StringIO.html
+import StringIO
+# http://docs.python.org/release/2.4.4/lib/module-sys.html
+import sys
+try:
+    # Not available before Python 2.6.
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = steplog.Log('step5')
 
 def as_boxes(data):
     """Wrapper for *land_ocean_boxes*."""
@@ -154,16 +170,27 @@ def subbox_to_box(meta, cells, celltype='BOX'):
     (number of cells contributing for each month), *ngood* is total
     number of valid data in the series, *box* is a 4-tuple that
     describes the regions bounds: (southern, northern, western, eastern).
+
+    When NumPy is in use (see `series.use`) the work is done by
+    `numpy_subbox_to_box`, with exactly the same results.
     """
 
+    if series.implementation == 'numpy':
+        return numpy_subbox_to_box(meta, cells, celltype)
+    return python_subbox_to_box(meta, cells, celltype)
+
+def python_subbox_to_box(meta, cells, celltype='BOX'):
+    """As `subbox_to_box`, in pure Python."""
+
     # The (80) large boxes.
     boxes = list(eqarea.grid())
+    find_box = box_finder(boxes)
     # For each box, make a list of contributors (cells that contribute
     # to the box time series); initially empty.
     contributordict = dict((box, []) for box in boxes)
     # Partition the cells into the boxes.
     for cell in cells:
-        box = whichbox(boxes, cell.box)
+        box = find_box(cell.box)
         contributordict[box].append(cell)
 
     def padded_series(s):
@@ -189,10 +216,14 @@ def subbox_to_box(meta, cells, celltype='BOX'):
         box_series = padded_series(best)
         box_weight = [float(valid(a)) for a in box_series]
 
-        # Start the *contributed* list with this cell.
-        l = [any(valid(v) for v in box_series[i::12]) for i in range(12)]
-        s = ''.join('01'[x] for x in l)
-        contributed = [[best.uid, 1.0, s]]
+        # Start the *contributed* list with this cell.  The list is
+        # only made when the log is at DEBUG level.
+        contributed = None
+        if log.enabled(steplog.DEBUG):
+            l = [any(valid(v) for v in box_series[i::12])
+              for i in range(12)]
+            s = ''.join('01'[x] for x in l)
+            contributed = [[best.uid, 1.0, s]]
 
         # Loop over the remaining contributors.
         for cell in contributors[1:]:
@@ -201,22 +232,93 @@ def subbox_to_box(meta, cells, celltype='BOX'):
                 weight = 1.0
                 station_months = series.combine(box_series, box_weight,
                     addend_series, weight, parameters.box_min_overlap)
-                s = ''.join('01'[bool(x)] for x in station_months)
-            else:
-                weight = 0.0
-                s = '0'*12
-            contributed.append([cell.uid, weight, s])
+                if contributed is not None:
+                    s = ''.join('01'[bool(x)] for x in station_months)
+                    contributed.append([cell.uid, weight, s])
+            elif contributed is not None:
+                contributed.append([cell.uid, 0.0, '0'*12])
 
         box_first_year = meta.yrbeg
         series.anomalize(box_series, parameters.subbox_reference_period,
                          box_first_year)
-        uid = giss_data.boxuid(box, celltype=celltype)
-        log.write("%s cells %s\n" % (uid, asjson(contributed)))
+        if contributed is not None:
+            uid = giss_data.boxuid(box, celltype=celltype)
+            log.debug(uid, 'cells', contributed)
         ngood = sum(valid(a) for a in box_series)
         yield (box_series, box_weight, ngood, box)
 
-# :todo: put somewhere sensible and import from there
-from step3 import asjson
+def numpy_subbox_to_box(meta, cells, celltype='BOX'):
+    """As `subbox_to_box`, using NumPy.  The cells are held as a
+    matrix, with one row of *meta.monm* months for each cell, and each
+    box is combined from the rows of its cells.  The cells are combined
+    in the same order, with the same arithmetic, as in
+    `python_subbox_to_box`.
+    """
+
+    cells = list(cells)
+    for cell in cells:
+        offset = 12 * (cell.first_year - meta.yrbeg)
+        if offset < 0 or offset + len(cell) > meta.monm or meta.monm % 12:
+            # Doesn't fit; python_subbox_to_box does whatever it does.
+            for item in python_subbox_to_box(meta, cells, celltype):
+                yield item
+            return
+    # The matrix of cells, and the number of valid data in each.  It
+    # is made when the first box is wanted, not when this function is
+    # called.
+    m = numpy.empty((len(cells), meta.monm))
+    m.fill(MISSING)
+    good = []
+    for i,cell in enumerate(cells):
+        offset = 12 * (cell.first_year - meta.yrbeg)
+        m[i,offset:offset+len(cell)] = cell.series
+        good.append(cell.good_count)
+    # Each row, as a (year, month) array.
+    m = m.reshape(len(cells), -1, 12)
+
+    boxes = list(eqarea.grid())
+    find_box = box_finder(boxes)
+    # For each box, a list of the indexes (in *cells*) of its cells.
+    contributordict = dict((box, []) for box in boxes)
+    for i,cell in enumerate(cells):
+        contributordict[find_box(cell.box)].append(i)
+
+    from step3 import sort
+    for box in boxes:
+        contributors = contributordict[box]
+        # Sorted as the cells are in python_subbox_to_box.
+        sort(contributors, lambda x,y: good[y] - good[x])
+
+        best = contributors[0]
+        box_series = m[best]
+        box_weight = (box_series != MISSING).astype(numpy.float64)
+
+        contributed = None
+        if log.enabled(steplog.DEBUG):
+            l = (box_series != MISSING).any(axis=0)
+            s = ''.join('01'[bool(x)] for x in l)
+            contributed = [[cells[best].uid, 1.0, s]]
+
+        for i in contributors[1:]:
+            if good[i] >= parameters.subbox_min_valid:
+                weight = 1.0
+                box_series, box_weight, station_months = (
+                  series.numpy_combine_years(box_series, box_weight,
+                    m[i], weight, parameters.box_min_overlap))
+                if contributed is not None:
+                    s = ''.join('01'[bool(x)] for x in station_months)
+                    contributed.append([cells[i].uid, weight, s])
+            elif contributed is not None:
+                contributed.append([cells[i].uid, 0.0, '0'*12])
+
+        box_series = series.numpy_anomalize_years(box_series,
+          parameters.subbox_reference_period, meta.yrbeg)
+        if contributed is not None:
+            uid = giss_data.boxuid(box, celltype=celltype)
+            log.debug(uid, 'cells', contributed)
+        ngood = int((box_series != MISSING).sum())
+        yield (box_series.ravel().tolist(), box_weight.ravel().tolist(),
+          ngood, box)
 
 def whichbox(boxes, cell):
     """Return the box in *boxes* that contains (the centre of the)
@@ -229,6 +331,37 @@ def whichbox(boxes, cell):
         if s <= lat < n and w <= lon < e:
             return box
 
+def box_finder(boxes):
+    """Return a function that, like `whichbox`, returns the box in
+    *boxes* that contains (the centre of the) cell given to it.  The
+    box is found by bisecting the bands of boxes, and then the boxes
+    in a band, instead of trying each box in turn.
+    """
+
+    # The boxes in each band of latitude, in order of longitude.
+    bands = {}
+    for box in boxes:
+        s,n,w,e = box
+        bands.setdefault((s,n), []).append((w,e,box))
+    bounds = sorted(bands)
+    souths = [s for s,n in bounds]
+    for row in bands.values():
+        row.sort()
+    wests = dict((band, [w for w,e,box in row])
+      for band,row in bands.items())
+
+    def find(cell):
+        lat,lon = eqarea.centre(cell)
+        i = bisect.bisect_right(souths, lat) - 1
+        if i < 0 or not lat < bounds[i][1]:
+            return None
+        row = bands[bounds[i]]
+        j = bisect.bisect_right(wests[bounds[i]], lon) - 1
+        if j < 0 or not lon < row[j][1]:
+            return None
+        return row[j][2]
+    return find
+
 def zonav(meta, boxed_data):
     """Zonal Averaging.
 
@@ -254,8 +387,18 @@ def zonav(meta, boxed_data):
      13 northern hemisphere (0 + 1 + 2 + 3)
      14 southern hemisphere (4 + 5 + 6 + 7)
      15 global (all belts 0 to 7)
+
+    When NumPy is in use (see `series.use`) the work is done by
+    `numpy_zonav`, with exactly the same results.
     """
 
+    if series.implementation == 'numpy' and meta.monm % 12 == 0:
+        return numpy_zonav(meta, boxed_data)
+    return python_zonav(meta, boxed_data)
+
+def python_zonav(meta, boxed_data):
+    """As `zonav`, in pure Python."""
+
     iyrbeg = meta.yrbeg
     monm = meta.monm
 
@@ -346,6 +489,82 @@ def zonav(meta, boxed_data):
         series.anomalize(avgg, parameters.box_reference_period, iyrbeg)
         yield(avgg, wtg)
 
+def numpy_zonav(meta, boxed_data):
+    """As `zonav`, using NumPy.  The series are combined in the same
+    order, with the same arithmetic, as in `python_zonav`."""
+
+    iyrbeg = meta.yrbeg
+    monm = meta.monm
+
+    boxes_in_band,band_in_zone = zones()
+
+    bands = len(boxes_in_band)
+
+    def years(a):
+        """*a* as a (year, month) array."""
+        return numpy.array(a, dtype=numpy.float64).reshape(-1, 12)
+
+    lenz = [None] * bands
+    wt = [None] * bands
+    avg = [None] * bands
+    for band in range(bands):
+        box_series = [None] * boxes_in_band[band]
+        box_weights = [None] * boxes_in_band[band]
+        box_length = [None] * boxes_in_band[band]
+        for box in range(boxes_in_band[band]):
+            box_series[box], box_weights[box], box_length[box], _ = (
+              boxed_data.next())
+        total_length = sum(box_length)
+        if total_length == 0:
+            wt[band] = numpy.zeros((monm//12, 12))
+            avg[band] = numpy.empty((monm//12, 12))
+            avg[band].fill(MISSING)
+        else:
+            box_length,IORD = sort_perm(box_length)
+            nr = IORD[0]
+            wt[band] = years(box_weights[nr])
+            avg[band] = years(box_series[nr])
+            for n in range(1,boxes_in_band[band]):
+                nr = IORD[n]
+                if box_length[n] == 0:
+                    break
+                avg[band], wt[band], _ = series.numpy_combine_years(
+                  avg[band], wt[band],
+                  years(box_series[nr]), years(box_weights[nr]),
+                  parameters.box_min_overlap)
+        avg[band] = series.numpy_anomalize_years(avg[band],
+          parameters.box_reference_period, iyrbeg)
+        lenz[band] = int((avg[band] != MISSING).sum())
+        yield (avg[band].ravel().tolist(), wt[band].ravel().tolist())
+
+    try:
+        boxed_data.next()
+        assert 0, "Too many boxes found"
+    except StopIteration:
+        pass
+
+    lenz, iord = sort_perm(lenz)
+    for zone in range(len(band_in_zone)):
+        for j1 in range(bands):
+            if iord[j1] in band_in_zone[zone]:
+                break
+        else:
+            raise Exception('No band in compound zone %d.' % zone)
+        band = iord[j1]
+        if lenz[band] == 0:
+            print('**** NO DATA FOR ZONE %d' % band)
+        wtg = wt[band]
+        avgg = avg[band]
+        for j in range(j1+1,bands):
+            band = iord[j]
+            if band not in band_in_zone[zone]:
+                continue
+            avgg, wtg, _ = series.numpy_combine_years(avgg, wtg,
+              avg[band], wt[band], parameters.box_min_overlap)
+        avgg = series.numpy_anomalize_years(avgg,
+          parameters.box_reference_period, iyrbeg)
+        yield (avgg.ravel().tolist(), wtg.ravel().tolist())
+
 def sort_perm(a):
     """The array *a* is sorted into descending order.  The fresh sorted
     array and the permutation array are returned as a pair (*sorted*,
@@ -428,17 +647,20 @@ def annzon(meta, zoned_averages, alternate={'global':2, 'hemi':True}):
         wt[zone] = zip(*[iter(twt)]*12)
 
     # Find (compute) the annual means.
-    for zone in range(zones):
-        for iy in range(iyrs):
-            anniy = 0.
-            mon = 0
-            for m in range(12):
-                if data[zone][iy][m] == MISSING:
-                    continue
-                mon += 1
-                anniy += data[zone][iy][m]
-            if mon >= parameters.zone_annual_min_months:
-                ann[zone][iy] = float(anniy)/mon
+    if series.implementation == 'numpy':
+        ann = numpy_annual_means(data, iyrs)
+    else:
+        for zone in range(zones):
+            for iy in range(iyrs):
+                anniy = 0.
+                mon = 0
+                for m in range(12):
+                    if data[zone][iy][m] == MISSING:
+                        continue
+                    mon += 1
+                    anniy += data[zone][iy][m]
+                if mon >= parameters.zone_annual_min_months:
+                    ann[zone][iy] = float(anniy)/mon
 
     # Alternate global mean.
     if alternate['global']:
@@ -495,6 +717,25 @@ def annzon(meta, zoned_averages, alternate={'global':2, 'hemi':True}):
     return (meta, data, wt, ann, parameters.zone_annual_min_months)
 
 
+def numpy_annual_means(data, iyrs):
+    """The annual means computed by `annzon`, for all the zones at
+    once, using NumPy.  *data* is a list of the monthly data for each
+    zone, each a list of *iyrs* years of 12 months.  Returns a list of
+    the annual means for each zone.
+    """
+
+    a = numpy.array([zone[:iyrs] for zone in data], dtype=numpy.float64)
+    a = a.reshape(len(data), iyrs, 12)
+    ok = a != MISSING
+    # Summed month by month, in the same order as annzon.
+    total = numpy.zeros(a.shape[:2])
+    for m in range(12):
+        total += numpy.where(ok[:,:,m], a[:,:,m], 0.0)
+    mon = ok.sum(axis=2)
+    ann = numpy.where(mon >= parameters.zone_annual_min_months,
+      total / numpy.maximum(mon, 1), MISSING)
+    return ann.tolist()
+
 def ensure_weight(data):
     """Take a stream of (weight,land,ocean) record triples, if the
     weight stream is None (the usual case in fact), then generate a
@@ -523,7 +764,7 @@ def ensure_weight(data):
                 landmask = 0.0
             yield landmask, land, ocean
 
-def step5(data):
+def step5(data, jobs=1):
     """Step 5 of GISTEMP.
 
     This step takes input provided by steps 3 and 4 (zipped together).
@@ -536,16 +777,75 @@ def step5(data):
         *data* should be an iterable of (weight, land, ocean) triples.  The
         first triple is metadata (and this is a hack).  Subsequently
         there is one triple per subbox (of which, 8000).
+    :Param jobs:
+        The number of worker processes to use.  When it is more than 1
+        (and the multiprocessing module is available) the 3 analyses
+        are run concurrently; the results, the output files, and the
+        log, are exactly the same as for a serial run.
 
     """
     subboxes = ensure_weight(data)
     subboxes = gio.step5_mask_output(subboxes)
     # The result of `as_boxes` is a stream of boxes for each of 3
     # separate analyses: land only, ocean only, land and ocean combined.
-    land,ocean,mixed = as_boxes(subboxes)
+    analyses = as_boxes(subboxes)
+    if jobs > 1 and multiprocessing:
+        # Any buffered output would otherwise be written once by each
+        # worker as well as by us.
+        sys.stdout.flush()
+        log.flush()
+        # The workers are given *analyses* when they start.  Where
+        # processes are forked this shares the cells (copy-on-write)
+        # instead of pickling them; the cells of the mixed analysis
+        # are the same objects as those of the land and ocean
+        # analyses.  imap returns the results in the same order as
+        # *analyses*.
+        pool = multiprocessing.Pool(min(jobs, len(analyses)),
+          init_analysis_worker, (analyses,))
+        result = []
+        for text, printed, item in pool.imap(analysis_worker,
+          range(len(analyses))):
+            log.write(text)
+            sys.stdout.write(printed)
+            result.append(item)
+        pool.close()
+        pool.join()
+        return result
     result = []
-    for meta, boxes in [land,ocean,mixed]:
-        boxes = gio.step5_bx_output(meta, boxes)
-        zoned_averages = zonav(meta, boxes)
-        result.append(annzon(meta, zoned_averages))
+    for meta, boxes in analyses:
+        result.append(analysis(meta, boxes))
     return result
+
+def analysis(meta, boxes):
+    """Complete a single analysis (see `step5`): write the *boxes*,
+    and compute the zonal and annual means from them."""
+
+    boxes = gio.step5_bx_output(meta, boxes)
+    zoned_averages = zonav(meta, boxes)
+    return annzon(meta, zoned_averages)
+
+# The analyses used by analysis_worker, set by init_analysis_worker
+# when a worker process starts.
+_analyses = None
+
+def init_analysis_worker(analyses):
+    """Initialise a worker process (see `step5`)."""
+
+    global _analyses
+    _analyses = analyses
+
+def analysis_worker(i):
+    """Run analysis *i* in a worker process.  Returns a triple (*text*,
+    *printed*, *result*): *text* is what would have been written to the
+    log, *printed* what would have been printed, and *result* is as
+    for `analysis`.
+    """
+
+    captured = log.capture()
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        result = analysis(*_analyses[i])
+        return captured(), sys.stdout.getvalue(), result
+    finally:
+        sys.stdout = stdout
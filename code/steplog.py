@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# steplog.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""The logs of the steps (``log/step0.log`` and so on).
+
+Each entry in a log is about one station record or box, identified by
+its uid: a *key* saying what the entry is, and a *value* (anything that
+can be written as JSON).  An entry has a level: `INFO` for a short
+account of what was done to the record (for example, Step 2's
+"step2-action" entries), or `DEBUG` for the data behind it (series,
+and lists of contributing stations), which are much bigger.  Entries
+above the level of the log (see *parameters.log_level* and
+*parameters.step_log_levels*) are not written; their value is not even
+formatted, and it can be given as a function, which is called only
+when the entry is written.  With the level "off" nothing is written,
+and there is no log file (an old one is removed).
+
+A log is written in one of these formats (see *parameters.log_format*):
+
+'text'
+  One line for each entry: the uid, the key, and the value (written by
+  `asjson`), separated by spaces.  This has always been the format of
+  the logs.
+'jsonl'
+  JSON Lines: one JSON object for each entry, with the members "uid",
+  "key", and "value".
+'binary'
+  A pickle of the (*uid*, *key*, *value*) triple for each entry.  This
+  is the quickest to write and the most compact.
+
+`read` reads a log in any of the formats.
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.4.4/lib/module-cPickle.html
+import cPickle
+# http://docs.python.org/release/2.6.8/library/json.html
+import json
+# http://docs.python.org/release/2.4.4/lib/module-os.html
+import os
+# http://docs.python.org/release/2.4.4/lib/module-StringIO.html
+import StringIO
+
+import parameters
+
+# The levels, in increasing order of detail.
+OFF = 0
+INFO = 1
+DEBUG = 2
+LEVELS = dict(off=OFF, info=INFO, debug=DEBUG)
+
+# The size of the buffer of a log file.
+BUFFER_SIZE = 1 << 16
+
+# The directory of the log files.  A tool that uses the step modules
+# without running the steps sets this to None, before it imports them,
+# so that the logs of the last run are left alone (and nothing is
+# logged).
+directory = 'log'
+
+def asjson(obj):
+    """Return a string: The JSON representation of the object "obj".
+    This is a peasant's version, not intentended to be fully JSON
+    general."""
+
+    return repr(obj).replace("'", '"')
+
+def encode_text(uid, key, value):
+    return "%s %s %s\n" % (uid, key, asjson(value))
+
+def encode_jsonl(uid, key, value):
+    return json.dumps(dict(uid=uid, key=key, value=value),
+      sort_keys=True) + '\n'
+
+def encode_binary(uid, key, value):
+    return cPickle.dumps((uid, key, value), 2)
+
+ENCODERS = dict(text=encode_text, jsonl=encode_jsonl, binary=encode_binary)
+
+def level(name):
+    """The level of the log called *name* (for example, "step2"),
+    according to *parameters.log_level* and
+    *parameters.step_log_levels*."""
+
+    result = parameters.log_level
+    for item in parameters.step_log_levels.split():
+        step, value = item.split('=', 1)
+        if step == name:
+            result = value
+    if result not in LEVELS:
+        raise ValueError("Unknown log level %r for %s" % (result, name))
+    return LEVELS[result]
+
+# All the logs that have been made, so that they can be flushed (see
+# `flush_all`).
+_logs = []
+
+class Log(object):
+    """The log called *name*, which is written to the file
+    ``log/name.log``.  The level and format are those in the parameters
+    when the log is made (which is when the step module that has the
+    log is imported; `run.py` sets the parameters before that).  If
+    `directory` is None then, the log is off, and has no file.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.encode = ENCODERS[parameters.log_format]
+        self.f = None
+        self.path = None
+        self.level = OFF
+        if directory is not None:
+            self.path = os.path.join(directory, name + '.log')
+            self.level = level(name)
+            if self.level > OFF:
+                self.f = open(self.path, 'wb', BUFFER_SIZE)
+            elif os.path.exists(self.path):
+                os.remove(self.path)
+        _logs.append(self)
+
+    def enabled(self, level):
+        """True if entries of level *level* are written."""
+
+        return level <= self.level
+
+    def entry(self, level, uid, key, value):
+        """Write an entry, of level *level*, to the log (if its level
+        is enabled).  *value* can be a function, which is called (with
+        no arguments) to get the value."""
+
+        if not self.enabled(level):
+            return
+        if callable(value):
+            value = value()
+        self.write(self.encode(uid, key, value))
+
+    def info(self, uid, key, value):
+        self.entry(INFO, uid, key, value)
+
+    def debug(self, uid, key, value):
+        self.entry(DEBUG, uid, key, value)
+
+    def write(self, data):
+        """Write *data*, already encoded, to the log."""
+
+        if self.f is not None:
+            self.f.write(data)
+
+    def flush(self):
+        if self.f is not None:
+            self.f.flush()
+
+    def capture(self):
+        """Write the log to memory, instead of to its file, from now on
+        (for a worker process, which returns what it writes to the
+        parent process).  Returns a function that returns what has been
+        written."""
+
+        self.f = StringIO.StringIO()
+        return self.f.getvalue
+
+def flush_all():
+    """Flush all the logs."""
+
+    for log in _logs:
+        log.flush()
+
+def read(path):
+    """Read the log file *path*, in any of the formats; yield each entry
+    as a (*uid*, *key*, *value*) triple.  In the 'text' format, a value
+    that is not JSON is returned as a string (`asjson` writes tuples,
+    such as the points in Step 2's "adjustment" entries, as Python
+    does).
+    """
+
+    f = open(path, 'rb')
+    first = f.read(1)
+    f.seek(0)
+    if first == '\x80':
+        unpickler = cPickle.Unpickler(f)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                break
+    elif first == '{':
+        for line in f:
+            d = json.loads(line)
+            yield d['uid'], d['key'], d['value']
+    else:
+        for line in f:
+            uid, key, value = line.rstrip('\n').split(' ', 2)
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+            yield uid, key, value
+    f.close()
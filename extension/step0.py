@@ -16,13 +16,14 @@ algorithm.  This includes functionality to combine the USHCN and GHCN
 datasets, which were used by GISTEMP before they were both
 superceded in 2011-12 by GHCN-M version 3.
 """
-import os
+import itertools
 
 import parameters
 from code import step0
+from code import steplog
 from code.giss_data import valid
 
-log = open(os.path.join('log', 'step0.log'), 'w')
+log = steplog.Log('step0')
 
 def calc_monthly_USHCN_offsets(u_record, g_record):
     """Given a USHCN record `u_record` and a GHCN record `g_record`,
@@ -59,11 +60,6 @@ def adjust_USHCN(ushcn_records, ghcn_records):
     are no such records, but may be if subsets are created by hand).
     """
 
-    def adj(t, d):
-        if valid(t):
-            return t - d
-        return t
-
     # Count of USHCN records that have no GHCN counterpart.
     count_ushcn_only = 0
     # For each USHCN record look for a corresponding GHCN record.
@@ -71,27 +67,71 @@ def adjust_USHCN(ushcn_records, ghcn_records):
         g_record = ghcn_records.get(key, None)
         if g_record is None:
             count_ushcn_only += 1
-            log.write("""%s action "ushcn only"\n""" % key)
+            log.info(key, 'action', 'ushcn only')
             continue
-        diffs = calc_monthly_USHCN_offsets(u_record, g_record)
-
-        # Now apply the USHCN-GHCN offsets to every year for
-        # this station in which there is GHCN data.  Note that
-        # years in USHCN but not in GHCN are just copied, not
-        # adjusted.  This may be a bug.
-        new_data = []
-        for year in range(u_record.first_year, u_record.last_year + 1):
-            temps = u_record.get_a_year(year)
-            if g_record.has_data_for_year(year):
-                new_data.extend([adj(t, d) for t, d in zip(temps, diffs)])
-            else:
-                new_data.extend(temps)
-        u_record.set_series(u_record.first_year * 12 + 1, new_data)
+        adjust_USHCN_record(u_record, g_record)
         del ghcn_records[key]
 
     if count_ushcn_only:
         print count_ushcn_only, "USHCN records had no GHCN counterpart."
 
+def adjust_USHCN_record(u_record, g_record):
+    """Adjust the USHCN record *u_record* for differences in monthly
+    means between it and the GHCN record *g_record*."""
+
+    def adj(t, d):
+        if valid(t):
+            return t - d
+        return t
+
+    diffs = calc_monthly_USHCN_offsets(u_record, g_record)
+
+    # Now apply the USHCN-GHCN offsets to every year for
+    # this station in which there is GHCN data.  Note that
+    # years in USHCN but not in GHCN are just copied, not
+    # adjusted.  This may be a bug.
+    new_data = []
+    for year in range(u_record.first_year, u_record.last_year + 1):
+        temps = u_record.get_a_year(year)
+        if g_record.has_data_for_year(year):
+            new_data.extend([adj(t, d) for t, d in zip(temps, diffs)])
+        else:
+            new_data.extend(temps)
+    u_record.set_series(u_record.first_year * 12 + 1, new_data)
+
+def join_USHCN(ghcn_records, ushcn_records):
+    """The streaming equivalent of `adjust_USHCN` followed by (unless
+    *parameters.retain_contiguous_US*) `discard_contig_us`.
+    *ghcn_records* and *ushcn_records* are iterators of records in
+    order of uid.  Yields a ('ghcn', record) or ('ushcn', record) pair
+    for each record that remains, in order of uid.
+    """
+
+    # Count of USHCN records that have no GHCN counterpart.
+    count_ushcn_only = 0
+    for key, group in itertools.groupby(
+      step0.merge_by_uid([ghcn_records, ushcn_records]),
+      lambda (i,record): record.uid):
+        # As for a dict, the last record from each source is kept.
+        records = [None, None]
+        for i,record in group:
+            records[i] = record
+        g_record, u_record = records
+        if u_record is None:
+            if (parameters.retain_contiguous_US or
+              not '425710000000' <= key < '425900000000'):
+                yield 'ghcn', g_record
+            continue
+        if g_record is None:
+            count_ushcn_only += 1
+            log.info(key, 'action', 'ushcn only')
+        else:
+            adjust_USHCN_record(u_record, g_record)
+        yield 'ushcn', u_record
+
+    if count_ushcn_only:
+        print count_ushcn_only, "USHCN records had no GHCN counterpart."
+
 def discard_contig_us(records):
     """Discard stations in the contiguous US.  The stations are
     discarded on the basis of their 11-digit GHCN ID: stations from
@@ -127,7 +167,36 @@ def pre_step0(input):
         ghcn_key = 'ghcn'
 
     real_open = input.open
-    if 'ghcn' in input.sources and 'ushcn' in input.sources:
+    if ('ghcn' in input.sources and 'ushcn' in input.sources and
+      parameters.step0_stream):
+        print "Extension: merge USHCN and GHCN records."
+        if parameters.retain_contiguous_US:
+            print "Extension: retain US data in GHCN."
+        # Join the two sources (sorted by uid) as streams; the joined
+        # stream is split into GHCN and USHCN records again (tee
+        # only buffers the records between those that Step 0 has read
+        # from each).
+        real_is_sorted = getattr(input, 'is_sorted', lambda source: False)
+        ghcn_records = real_open(ghcn_key)
+        if not real_is_sorted(ghcn_key):
+            ghcn_records = step0.sorted_by_uid(ghcn_records)
+        ushcn_records = real_open('ushcn')
+        if not real_is_sorted('ushcn'):
+            ushcn_records = step0.sorted_by_uid(ushcn_records)
+        joined = itertools.tee(join_USHCN(ghcn_records, ushcn_records))
+        def fake_open(source):
+            if source == 'ghcn':
+                return (record for tag,record in joined[0] if tag == 'ghcn')
+            elif source == 'ushcn':
+                return (record for tag,record in joined[1]
+                  if tag == 'ushcn')
+            else:
+                return real_open(source)
+        def is_sorted(source):
+            return source in ('ghcn', 'ushcn') or real_is_sorted(source)
+        input.is_sorted = is_sorted
+
+    elif 'ghcn' in input.sources and 'ushcn' in input.sources:
         print "Extension: merge USHCN and GHCN records."
         # Read GHCN and USHCN datasets into big temporary lists
         ghcn_records = list(input.open(ghcn_key))
@@ -161,17 +230,12 @@ def pre_step0(input):
             discard_contig_us(ghcn_data)
 
         # build a fake open method
-        # that gives back these modified datasets
-        # (and nukes the temporaries).
+        # that gives back these modified datasets.
         def fake_open(source):
             if source == 'ghcn':
                 return data(ghcn_ids, ghcn_data)
-                ghcn_ids = None
-                ghcn_data = None
             elif source == 'ushcn':
                 return data(ushcn_ids, ushcn_data)
-                ushcn_ids = None
-                ushcn_data = None
             else:
                 return real_open(source)
 
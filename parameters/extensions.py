@@ -42,5 +42,63 @@ associated with the station.
 
 work_file_format = "v2"
 """The format of the intermediate files written to the 'work' directory:
-'v2' for GHCN v2, 'v3' for GHCN v3.
+'v2' for GHCN v2, 'v3' for GHCN v3, 'bin' for a compact binary format
+that is much quicker to read (see BinaryWriter in tool/gio.py).  With
+'bin', Steps 1, 2, and 3 also read their input from the binary files.
+"""
+
+step5_mask = "input/step5mask"
+"""The mask file for Step 5 (one row for each of the 8000 subboxes; see
+tool/rectmask.py): when it exists, the weight of each subbox's land
+series is taken from it, instead of being computed from the land and
+ocean series.  Empty for no mask, even if the file exists.
+"""
+
+series_storage = "list"
+"""How the monthly data of each station record and subbox series are
+stored in memory: 'list' for a Python list of floats; 'array' for an
+array of doubles (using the standard 'array' module), which takes
+about a quarter of the memory.  The results are the same either way.
+Neither needs NumPy, which stays optional: where it is installed the
+series functions convert the data to NumPy arrays as they need to (see
+`series.use`).
+"""
+
+stable_sort = False
+"""When True, station records (in Step 3), subboxes (in Step 5), and
+bands (in Step 5) are put in order of the number of valid data using
+Python's stable sort.  When False, the order is the one produced by the
+(unstable) sort in the GISTEMP Fortran code.  Setting this to True
+changes the results very slightly, because items with the same number
+of valid data are combined in a different order.
+"""
+
+step0_stream = False
+"""When True, Step 0 merges its data sources as streams of records in
+order of uid (the GHCN-M files are already in that order; the other
+sources are sorted, using temporary files when they are large), so that
+only a few records of each source are in memory at once.  When False,
+every source is read into memory and then combined.  The results are
+the same either way.
+"""
+
+log_level = "debug"
+"""How much is written to the logs of the steps (``log/step0.log`` and
+so on): 'debug' for everything, including the series and the lists of
+contributing stations, which take a lot of time to write; 'info' for
+just a short account of what was done to each record; or 'off' for
+nothing.  See code/steplog.py.
+"""
+
+step_log_levels = ""
+"""Levels for the logs of particular steps, overriding *log_level*.  A
+space separated list of name=level items; for example, "step3=off
+step5=info".
+"""
+
+log_format = "text"
+"""The format of the logs of the steps: 'text' (the traditional one
+line for each entry, of uid, key, and value), 'jsonl' (JSON Lines), or
+'binary' (pickled, which is the most compact).  tool/multi.py, and
+steplog.read, read all of them.
 """
@@ -0,0 +1,23 @@
+"""This module extends sys.path to include the parent directory of this
+module's directory, and the tool directory.
+
+It is imported by the tests for its deliberate side effect, so that
+they can import code in the ``code`` package, and the modules in the
+``tool`` directory, for example::
+
+    import extend_path
+    from code import series
+
+"""
+__docformat__ = "restructuredtext"
+
+import sys
+import os
+
+my_path = os.path.abspath(__file__)
+parent = os.path.dirname(os.path.dirname(my_path))
+for path in [os.path.join(parent, 'tool'), parent]:
+    if path not in sys.path:
+        sys.path[0:0] = [path]
+
+del my_path, parent, path
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# test_ensemble.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""Tests of ensemble.py: the member that has every station once is
+exactly the analysis of Steps 3 and 5, for the land and the mixed
+analyses.
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.4.4/lib/module-random.html
+import random
+# http://docs.python.org/release/2.4.4/lib/module-StringIO.html
+import StringIO
+# http://docs.python.org/release/2.4.4/lib/module-sys.html
+import sys
+# http://docs.python.org/release/2.4.4/lib/module-unittest.html
+import unittest
+
+# Clear Climate Code
+import extend_path
+from code import steplog
+# Leave the logs of the last run alone.
+steplog.directory = None
+from code import ensemble
+from code import eqarea
+from code import giss_data
+from code import series
+from code import step3
+from code import step5
+from code.giss_data import MISSING
+
+RADIUS = 1200
+
+def metadata(yrbeg, years):
+    meta = giss_data.SubboxMetaData(mo1=1, kq=1, mavg=6, monm=12*years,
+      monm4=12*years + 7, yrbeg=yrbeg, missing_flag=9999,
+      precipitation_flag=9999, title='Test'.ljust(80))
+    meta.gridding_radius = RADIUS
+    return meta
+
+def monthly(rnd, months):
+    """*months* months of synthetic temperatures, with some missing."""
+
+    data = []
+    for m in range(months):
+        if rnd.random() < 0.1:
+            data.append(MISSING)
+        else:
+            data.append(round(10 * rnd.random() + 0.01 * m / 12, 1))
+    return data
+
+def stations(rnd, n, meta):
+    """*n* synthetic station records, in a few clusters (so that many
+    subboxes have several contributors, and others have none)."""
+
+    centres = [(rnd.uniform(-80, 80), rnd.uniform(-180, 180))
+      for i in range(4)]
+    records = []
+    for i in range(n):
+        lat, lon = rnd.choice(centres)
+        lat = max(-90, min(90, lat + rnd.gauss(0, 8)))
+        lon = (lon + rnd.gauss(0, 12) + 180) % 360 - 180
+        first = meta.yrbeg + rnd.randint(0, meta.monm // 12 - 30)
+        last = rnd.randint(first + 10, meta.yrbeg + meta.monm // 12 - 1)
+        record = giss_data.Series(uid='%011d0' % i)
+        record.set_series(first*12 + 1, monthly(rnd, 12 * (last-first+1)))
+        record.station = giss_data.Station(uid=record.uid, lat=lat,
+          lon=lon)
+        records.append(record)
+    return records
+
+def ocean_cells(rnd, meta):
+    """Synthetic ocean subboxes: most with no data, some with too few
+    data to be used, and some with enough."""
+
+    cells = []
+    for box, subboxes in eqarea.gridsub():
+        for subbox in subboxes:
+            r = rnd.random()
+            if r < 0.8:
+                data = [MISSING] * 12
+                first = meta.yrbeg
+            else:
+                first = meta.yrbeg + rnd.randint(0, 10)
+                years = rnd.randint(10, meta.monm // 12 - (first-meta.yrbeg))
+                data = monthly(rnd, 12 * years)
+            cell = giss_data.Series(box=list(subbox))
+            cell.set_series(first*12 + 1, data)
+            cells.append(cell)
+    return cells
+
+def analyses(records, meta, ocean_meta, ocean):
+    """The land and mixed analyses of Steps 3 and 5: for each, a pair
+    (*data*, *ann*) of its monthly zonal means (as an array of
+    (zone, year, month)) and its annual zonal means."""
+
+    land = list(step3.iter_subbox_grid(records, meta.monm, meta.yrbeg,
+      RADIUS))
+
+    def stream():
+        yield (None, meta, ocean_meta)
+        for l,o in zip(land, ocean):
+            yield None, l, o
+    result = {}
+    boxes = step5.as_boxes(step5.ensure_weight(stream()))
+    for name, (m, b) in zip(['land', 'ocean', 'mixed'], boxes):
+        if name == 'ocean':
+            continue
+        _, data, wt, ann, _ = step5.annzon(m, step5.zonav(m, b))
+        result[name] = (ensemble.numpy.array(data).reshape(16, -1, 12),
+          ensemble.numpy.array(ann))
+    return result
+
+@unittest.skipIf(series.numpy is None, "NumPy is not installed.")
+class SameAsSteps(unittest.TestCase):
+    def setUp(self):
+        self.saved = series.implementation
+        self.rnd = random.Random(6)
+        # The steps write their progress to stdout.
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        series.use(self.saved)
+        sys.stdout = self.stdout
+
+    def check(self, records, meta, ocean_meta, ocean):
+        numpy = ensemble.numpy
+        multiplicity = numpy.ones((1, len(records)), dtype=numpy.int32)
+        e = ensemble.Ensemble(records, multiplicity, meta,
+          ocean=(ocean_meta, iter(ocean)), radius=RADIUS)
+        out = list(e.run())[0]
+        self.assertEqual(sorted(out), ['land', 'mixed'])
+        for implementation in ['python', 'numpy']:
+            series.use(implementation)
+            expected = analyses(records, meta, ocean_meta, ocean)
+            for name in out:
+                data, ann = out[name]
+                self.assertTrue(numpy.array_equal(data[0],
+                  expected[name][0]), (implementation, name))
+                self.assertTrue(numpy.array_equal(ann[0],
+                  expected[name][1]), (implementation, name))
+
+    def test_reference_periods(self):
+        # The reference periods (from 1951) are within the years.
+        meta = metadata(giss_data.BASE_YEAR, 130)
+        ocean_meta = metadata(1890, 125)
+        self.check(stations(self.rnd, 30, meta), meta, ocean_meta,
+          ocean_cells(self.rnd, ocean_meta))
+
+    def test_early(self):
+        # The reference periods are after the last year.
+        meta = metadata(giss_data.BASE_YEAR, 60)
+        self.check(stations(self.rnd, 30, meta), meta, meta,
+          ocean_cells(self.rnd, meta))
+
+@unittest.skipIf(series.numpy is None, "NumPy is not installed.")
+class Anomalize(unittest.TestCase):
+    def test_anomalize(self):
+        # As series.numpy_anomalize_years, for each member, including
+        # reference periods that start before the first year or after
+        # the last.
+        numpy = ensemble.numpy
+        rnd = random.Random(7)
+        for years in [1, 5, 40]:
+            a = numpy.array([monthly(rnd, 12 * years) for i in range(4)])
+            a = a.reshape(4, years, 12)
+            a[1,:,3] = MISSING
+            a[2,:years//2] = MISSING
+            for period in [(1951, 1980), (1930, 1945), (1960, 1970),
+              (1900, 1950), (1940, 1940), (1990, 2000), (1955, 1950)]:
+                result = ensemble.anomalize(a, period, 1950)
+                for i in range(len(a)):
+                    expected = series.numpy_anomalize_years(a[i], period,
+                      1950)
+                    self.assertTrue(numpy.array_equal(result[i],
+                      expected), (years, period, i))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# test_linefit.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""Tests of linefit.py: `best_two_part_fit` finds exactly the fit that
+trying every knee with `trend2` (as Step 2 used to) finds.
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.4.4/lib/module-random.html
+import random
+# http://docs.python.org/release/2.4.4/lib/module-unittest.html
+import unittest
+
+# Clear Climate Code
+import extend_path
+from code import linefit
+from code.giss_data import MISSING
+
+def knee_by_knee(points, knees, min):
+    """The original search of Step 2's getfit: `trend2` for each knee,
+    keeping the first with the smallest RMS error."""
+
+    best = None
+    rmsmin = 1.e20
+    for knee in knees:
+        sl1, sl2, rms, sl = linefit.trend2(points, knee, min)
+        if rms < rmsmin:
+            rmsmin = rms
+            best = (knee, sl1, sl2, rms, sl)
+    return best
+
+def knees_of(points, min_leg):
+    """The candidate knees, as Step 2's getfit chooses them."""
+
+    return [points[n][0] for n in xrange(min_leg, len(points) - min_leg)]
+
+def annual_points(rnd, kind):
+    """A list of (year, anomaly) points, like those that Step 2 fits:
+    in order of year, with some years missing.  *kind* chooses the
+    shape of the data: 'noise' for a two-part trend with noise;
+    'line' for points exactly on a line (so that the fits for many
+    knees are equally good, to within rounding); 'flat' for a
+    constant; 'steps' for data in a few steps, rounded to 0.1 (as
+    Step 2's data often are)."""
+
+    first = rnd.randint(1880, 1990)
+    n = rnd.randint(2, 120)
+    years = [first + i for i in range(n) if rnd.random() < 0.9]
+    knee = rnd.choice(years or [first])
+    a = rnd.uniform(-0.05, 0.05)
+    b = rnd.uniform(-0.05, 0.05)
+    points = []
+    for year in years:
+        if kind == 'noise':
+            v = a * min(year - knee, 0) + b * max(year - knee, 0)
+            v += rnd.gauss(0, 0.3)
+        elif kind == 'line':
+            # Not exactly representable, so that the fits for the
+            # knees differ only by rounding, differently in trend2
+            # and in two_part_fits.
+            v = 0.3 + 0.1 * (year - first)
+        elif kind == 'flat':
+            v = 0.5
+        else:
+            v = round(0.3 * ((year - first) // 10), 1)
+        points.append((year, v))
+    if points and rnd.random() < 0.2:
+        # An invalid point, which the fits ignore.
+        i = rnd.randrange(len(points))
+        points[i] = (points[i][0], MISSING)
+    return points
+
+class BestTwoPartFit(unittest.TestCase):
+    def check(self, rnd, kind):
+        points = annual_points(rnd, kind)
+        min_leg = rnd.choice([2, 5, 10])
+        knees = knees_of(points, min_leg)
+        min = rnd.choice([2, 3])
+        self.assertEqual(linefit.best_two_part_fit(points, knees, min),
+          knee_by_knee(points, knees, min))
+        # The rms of each fit is within the bound of that of trend2.
+        for knee,(sl1,sl2,rms,sl,error) in zip(knees,
+          linefit.two_part_fits(points, knees, min)):
+            expected = linefit.trend2(points, knee, min)
+            self.assertTrue(abs(rms - expected[2]) <= error,
+              (knee, rms, expected[2], error))
+
+    def test_noise(self):
+        rnd = random.Random(7)
+        for i in range(1000):
+            self.check(rnd, 'noise')
+
+    def test_near_ties(self):
+        rnd = random.Random(8)
+        for kind in ['line', 'flat', 'steps']:
+            for i in range(300):
+                self.check(rnd, kind)
+
+    def test_no_knees(self):
+        self.assertEqual(linefit.best_two_part_fit([(1900, 0.1)], [], 2),
+          None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# test_series.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""Tests of series.py: the NumPy implementations of the series
+functions give exactly the same results as the pure Python ones.
+
+Run from the root directory of the project:
+
+    python -m unittest discover -s test
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.4.4/lib/module-random.html
+import random
+# http://docs.python.org/release/2.4.4/lib/module-unittest.html
+import unittest
+
+# Clear Climate Code
+import extend_path
+from code import series
+from code.giss_data import MISSING
+
+def monthly_series(rnd, years, missing):
+    """A list of *years* years of synthetic monthly data (in tenths of
+    a degree, as station data are), each datum missing with
+    probability *missing*.  Some months of the year are missing in
+    every year, and a run of years is missing."""
+
+    data = []
+    for year in range(years):
+        level = rnd.uniform(-2, 2)
+        for m in range(12):
+            if rnd.random() < missing:
+                data.append(MISSING)
+            else:
+                data.append(round(level + 10 * rnd.random(), 1))
+    for m in rnd.sample(range(12), rnd.randint(0, 3)):
+        data[m::12] = [MISSING] * years
+    if years > 4:
+        first = rnd.randint(0, years - 3)
+        last = rnd.randint(first, years)
+        data[12*first:12*last] = [MISSING] * (12 * (last - first))
+    return data
+
+@unittest.skipIf(series.numpy is None, "NumPy is not installed.")
+class NumPyEquivalence(unittest.TestCase):
+    """Each function of *series.implementations* gives the same result
+    with NumPy as without."""
+
+    def setUp(self):
+        self.saved = series.implementation
+        self.rnd = random.Random(4)
+
+    def tearDown(self):
+        series.use(self.saved)
+
+    def both(self, name, *args):
+        """Call the function *name* with each implementation, on
+        fresh copies of the lists in *args*.  Returns a pair of pairs,
+        (*result*, *args*), one for each implementation."""
+
+        results = []
+        for implementation in ['python', 'numpy']:
+            series.use(implementation)
+            copies = [isinstance(a, list) and list(a) or a for a in args]
+            result = getattr(series, name)(*copies)
+            results.append((result, copies))
+        return results
+
+    def test_combine(self):
+        rnd = self.rnd
+        for i in range(300):
+            years = rnd.randint(1, 40)
+            composite = monthly_series(rnd, years, rnd.random())
+            # Trim to a length that is not always a whole number of
+            # years.
+            n = 12 * years - rnd.randint(0, 11)
+            composite = composite[:n]
+            weight = [float(v != MISSING) * rnd.choice([1, 0.5, 0.25])
+              for v in composite]
+            new = monthly_series(rnd, years, rnd.random())[:n]
+            if rnd.random() < 0.5:
+                new_weight = rnd.random()
+            else:
+                new_weight = [rnd.random() for v in new]
+            # Overlaps shorter than, equal to, and longer than the
+            # minimum.
+            min_overlap = rnd.randint(1, 6)
+            python, numpy = self.both('combine', composite, weight, new,
+              new_weight, min_overlap)
+            self.assertEqual(python[0], numpy[0])
+            # The mutated *composite* and *weight*.
+            self.assertEqual(python[1][0], numpy[1][0])
+            self.assertEqual(python[1][1], numpy[1][1])
+            self.assertEqual(type(numpy[1][0][0]), float)
+
+    def test_combine_longer(self):
+        # *new* longer than *composite*, with too little overlap to be
+        # combined (as when Step 5 pads a cell that starts too early).
+        rnd = self.rnd
+        composite = monthly_series(rnd, 10, 0.1)
+        new = [MISSING] * 108 + monthly_series(rnd, 3, 0.1)
+        python, numpy = self.both('combine', composite,
+          [1.0] * len(composite), new, 1.0, 4)
+        self.assertEqual(python, numpy)
+
+    def test_monthly_anomalies(self):
+        rnd = self.rnd
+        for i in range(300):
+            years = rnd.randint(1, 60)
+            data = monthly_series(rnd, years, rnd.random())
+            base_year = 1880
+            reference_period = rnd.choice([None, (1900, 1910),
+              (1951, 1980), (1870, 1885), (2100, 2110)])
+            python, numpy = self.both('monthly_anomalies', data,
+              reference_period, base_year)
+            self.assertEqual(python[0], numpy[0])
+            self.assertEqual(python[1], numpy[1])
+
+    def test_anomalize(self):
+        rnd = self.rnd
+        for i in range(200):
+            data = monthly_series(rnd, rnd.randint(1, 60), rnd.random())
+            python, numpy = self.both('anomalize', data, (1951, 1980),
+              1940)
+            self.assertEqual(python[1][0], numpy[1][0])
+
+    def test_monthly_annual(self):
+        rnd = self.rnd
+        for i in range(300):
+            data = monthly_series(rnd, rnd.randint(1, 60), rnd.random())
+            python, numpy = self.both('monthly_annual', data)
+            self.assertEqual(python[0], numpy[0])
+            self.assertEqual(python[1], numpy[1])
+
+    def test_all_missing(self):
+        for years in [1, 3]:
+            data = [MISSING] * (12 * years)
+            python, numpy = self.both('monthly_annual', data)
+            self.assertEqual(python[0], numpy[0])
+            self.assertEqual(python[1], numpy[1])
+            python, numpy = self.both('combine', data, [0.0]*len(data),
+              data, 1.0, 1)
+            self.assertEqual(python, numpy)
+
+    def test_valid_mean(self):
+        rnd = self.rnd
+        for i in range(300):
+            data = monthly_series(rnd, rnd.randint(1, 10), rnd.random())
+            self.assertEqual(series.valid_mean(data),
+              series.numpy_valid_mean(series.numpy.array(data)))
+            rows = [monthly_series(rnd, 2, rnd.random()) for j in range(3)]
+            min = rnd.randint(1, 3)
+            self.assertEqual(
+              [series.valid_mean(column, min) for column in zip(*rows)],
+              series.numpy_valid_mean_rows(
+                [series.numpy.array(row) for row in rows], min).tolist())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# test_step3.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""Tests of step3.py: `sort` puts items in exactly the order of the
+selection sort of to.SBBXgrid.f.
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.4.4/lib/module-random.html
+import random
+# http://docs.python.org/release/2.4.4/lib/module-unittest.html
+import unittest
+
+# Clear Climate Code
+import extend_path
+import parameters
+from code import steplog
+# Leave the logs of the last run alone.
+steplog.directory = None
+from code import step3
+
+def selection_sort(l, cmp):
+    """The sort of to.SBBXgrid.f (lines 605 and following), as step3.py
+    used to run it."""
+
+    for n in range(len(l)-1):
+        nlmax = n
+        for nn in range(n+1, len(l)):
+            if cmp(l[nn], l[nlmax]) < 0:
+                nlmax = nn
+        # swap items at n and nlmax
+        t = l[nlmax]
+        l[nlmax] = l[n]
+        l[n] = t
+
+class Item(object):
+    """An item with a *key*; items with the same key are still
+    distinct (so the order of equal items is checked)."""
+
+    def __init__(self, key):
+        self.key = key
+
+def by_key(x, y):
+    return cmp(x.key, y.key)
+
+def descending(x, y):
+    # As Step 3 orders station records by their good_count.
+    return y.key - x.key
+
+class FortranSort(unittest.TestCase):
+    def setUp(self):
+        self.saved = parameters.stable_sort
+        parameters.stable_sort = False
+
+    def tearDown(self):
+        parameters.stable_sort = self.saved
+
+    def test_ties(self):
+        rnd = random.Random(2)
+        for i in range(2000):
+            n = rnd.randint(0, 60)
+            # Few distinct keys, so that there are many ties.
+            keys = rnd.randint(1, max(1, n//2))
+            items = [Item(rnd.randint(0, keys)) for j in range(n)]
+            for order in [by_key, descending]:
+                expected = list(items)
+                selection_sort(expected, order)
+                l = list(items)
+                step3.sort(l, order)
+                self.assertEqual([id(x) for x in l],
+                  [id(x) for x in expected])
+
+    def test_stable(self):
+        rnd = random.Random(3)
+        items = [Item(rnd.randint(0, 5)) for j in range(100)]
+        parameters.stable_sort = True
+        l = list(items)
+        step3.sort(l, descending)
+        self.assertEqual([id(x) for x in l],
+          [id(x) for x in sorted(items, descending)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# test_step5.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""Tests of step5.py: the NumPy versions of `subbox_to_box`, `zonav`,
+and the annual means of `annzon` give exactly the same results as the
+pure Python versions.
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.4.4/lib/module-random.html
+import random
+# http://docs.python.org/release/2.4.4/lib/module-unittest.html
+import unittest
+
+# Clear Climate Code
+import extend_path
+import parameters
+from code import steplog
+# Leave the logs of the last run alone.
+steplog.directory = None
+from code import eqarea
+from code import giss_data
+from code import series
+from code import step5
+from code.giss_data import MISSING
+
+YRBEG = 1940
+YEARS = 60
+
+def metadata(yrbeg=YRBEG, monm=12*YEARS):
+    return giss_data.SubboxMetaData(mo1=1, kq=1, mavg=6, monm=monm,
+      monm4=monm + 7, yrbeg=yrbeg, missing_flag=9999,
+      precipitation_flag=9999, title='Test'.ljust(80))
+
+def cell_data(rnd, months):
+    """*months* months of synthetic anomalies, with runs of missing
+    data (so that the number of valid data, on which the cells are
+    sorted, is often above and below *parameters.subbox_min_valid*,
+    and sometimes the same for several cells)."""
+
+    data = [round(rnd.gauss(0, 1), 2) for m in range(months)]
+    for i in range(rnd.randint(0, 3)):
+        first = rnd.randrange(months)
+        last = min(months, first + rnd.choice([12, 120, 240]))
+        data[first:last] = [MISSING] * (last - first)
+    return data
+
+def cells(rnd, empty_boxes=0, early=False):
+    """Some of the subboxes of each box (in the order of
+    `eqarea.gridsub`), with synthetic data.  The cells of the first
+    *empty_boxes* boxes have no valid data.  When *early* is True, one
+    cell starts before *YRBEG*."""
+
+    result = []
+    for i,(box, subboxes) in enumerate(eqarea.gridsub()):
+        subboxes = list(subboxes)
+        for subbox in rnd.sample(subboxes, rnd.randint(1, 5)):
+            first_year = YRBEG + rnd.choice([0, 0, 5, 30])
+            months = rnd.randint(1, YRBEG + YEARS - first_year) * 12
+            if i < empty_boxes:
+                data = [MISSING] * months
+            else:
+                data = cell_data(rnd, months)
+            cell = giss_data.Series(box=list(subbox))
+            cell.set_series(first_year*12 + 1, data)
+            result.append(cell)
+    if early:
+        # Combined into its box (it has more than
+        # *parameters.subbox_min_valid* valid data), but not first.
+        result[-1].set_series((YRBEG - 2)*12 + 1, [0.5] * (12*YEARS//2))
+    return result
+
+@unittest.skipIf(series.numpy is None, "NumPy is not installed.")
+class NumPyEquivalence(unittest.TestCase):
+    """The NumPy versions of the functions of Step 5 give the same
+    results as the Python versions."""
+
+    def setUp(self):
+        self.saved = series.implementation
+        self.rnd = random.Random(5)
+
+    def tearDown(self):
+        series.use(self.saved)
+
+    def boxes(self, meta, cells):
+        """The boxes made from *cells* by each implementation."""
+
+        result = []
+        for implementation in ['python', 'numpy']:
+            series.use(implementation)
+            result.append(list(step5.subbox_to_box(meta, cells)))
+        self.assertEqual(result[0], result[1])
+        return result[0]
+
+    def zonal(self, meta, boxes):
+        """The zonal means of *boxes*, and the annual means of them,
+        made by each implementation."""
+
+        result = []
+        for implementation in ['python', 'numpy']:
+            series.use(implementation)
+            zoned = list(step5.zonav(meta, iter(boxes)))
+            _, data, wt, ann, _ = step5.annzon(meta, iter(zoned))
+            result.append((zoned, data, wt, ann))
+        self.assertEqual(result[0], result[1])
+        return result[0]
+
+    def test_grid(self):
+        for i in range(3):
+            meta = metadata()
+            boxes = self.boxes(meta, cells(self.rnd))
+            self.zonal(meta, boxes)
+
+    def test_empty_band(self):
+        # The 4 boxes of the northernmost band.
+        meta = metadata()
+        boxes = self.boxes(meta, cells(self.rnd, empty_boxes=4))
+        zoned, data, wt, ann = self.zonal(meta, boxes)
+        self.assertEqual(zoned[0][0], [MISSING] * meta.monm)
+
+    def test_fallback(self):
+        # A cell that starts before the first year.
+        self.boxes(metadata(), cells(self.rnd, early=True))
+
+    def test_annual_means(self):
+        rnd = self.rnd
+        data = []
+        for zone in range(16):
+            monthly = cell_data(rnd, 12*YEARS)
+            # Years with few valid months.
+            for year in rnd.sample(range(YEARS), 10):
+                for m in rnd.sample(range(12), rnd.randint(0, 12)):
+                    monthly[12*year + m] = MISSING
+            data.append(zip(*[iter(monthly)]*12))
+        python = []
+        for zone in data:
+            python.append([])
+            for year in zone:
+                valid = [v for v in year if v != MISSING]
+                python[-1].append(MISSING)
+                if len(valid) >= parameters.zone_annual_min_months:
+                    anniy = 0.
+                    for v in valid:
+                        anniy += v
+                    python[-1][-1] = float(anniy)/len(valid)
+        self.assertEqual(step5.numpy_annual_means(data, YEARS), python)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# test_stepcache.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""Tests of stepcache.py: the source code, and the parameters, that
+the key of each step depends on are those of the parts of the code
+that the step uses.
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.4.4/lib/module-os.html
+import os
+# http://docs.python.org/release/2.4.4/lib/module-unittest.html
+import unittest
+
+# Clear Climate Code
+import extend_path
+import stepcache
+
+STEPS = ['0', '1', '2', '3', '3c', '4', '5']
+
+MODULE = '''"""A module."""
+import os
+
+X = 1
+
+def f(a):
+    """A docstring, with a line
+at the start of a line."""
+    return g(a) + X
+
+def g(a):
+    return parameters.g_only
+
+class C(object):
+    def h(self):
+        return parameters.h_only
+
+if __name__ == '__main__':
+    f(1)
+'''
+
+class Definitions(unittest.TestCase):
+    def test_definitions(self):
+        named, rest = stepcache.definitions(MODULE)
+        self.assertEqual(sorted(named), ['C', 'X', 'f', 'g'])
+        self.assertTrue(named['f'].endswith('return g(a) + X\n\n'))
+        # Every line is in one of the statements.
+        self.assertEqual(len(''.join(rest)) +
+          sum([len(v) for v in named.values()]), len(MODULE))
+
+    def test_used(self):
+        named, rest = stepcache.definitions(MODULE)
+        self.assertEqual(sorted(stepcache.used(['f'], named)),
+          ['X', 'f', 'g'])
+        self.assertEqual(sorted(stepcache.used(['C'], named)), ['C'])
+
+class StepSources(unittest.TestCase):
+    def setUp(self):
+        # The paths in stepcache are relative to the root directory.
+        self.cwd = os.getcwd()
+        os.chdir(os.path.dirname(os.path.dirname(
+          os.path.abspath(__file__))))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+
+    def test_steps(self):
+        for step in STEPS:
+            paths = stepcache.source_files(step)
+            for other in STEPS:
+                if other not in (step, '3c'):
+                    self.assertEqual(
+                      'code/step%s.py' % other in paths,
+                      (step, other) == ('5', '3'), (step, other))
+
+    def test_parameters(self):
+        parameters = dict((step, stepcache.step_parameters(step))
+          for step in STEPS)
+        # Read by gio.step5_input.
+        self.assertEqual([step for step in STEPS
+          if 'step5_mask' in parameters[step]], ['5'])
+        # Used in gio.py only by StationRecordWriter, which no step
+        # uses.
+        self.assertEqual([step for step in STEPS
+          if 'rural_designator' in parameters[step]], ['2'])
+        # Read by gio.choose_writer and gio.generic_input_step.
+        self.assertEqual([step for step in STEPS
+          if 'work_file_format' in parameters[step]], ['0', '1', '2', '3'])
+        self.assertEqual([step for step in STEPS
+          if 'data_sources' in parameters[step]], ['0'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -55,7 +55,7 @@ def zone_series(f):
     """
 
     bos = '>'                   # Byte order and size (for struct.{un,}pack).
-    f = fort.File(f, bos)
+    f = fort.MappedFile(f, bos)
 
     # The first record is a header
     l = f.readline()
@@ -81,7 +81,7 @@ def box_series(f):
     the corresponding pair is absent from the stream.
     """
     bos = '>'                   # Byte order and size (for struct.{un,}pack).
-    f = fort.File(f, bos)
+    f = fort.MappedFile(f, bos)
 
     # The first record of the file is a header (see step5.SBBXtoBX).
     l = f.readline()
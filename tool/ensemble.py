@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# ensemble.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""ensemble.py [options]
+
+Estimates the uncertainty of the zonal means that comes from the
+sampling of the stations, by making an ensemble of analyses: Steps 3
+and 5 are redone for many resamplings of the station records made by
+Step 2 (in work/), and the percentiles of the members are written for
+the monthly and annual series of each zone.  Run it after a run of
+Steps 0 to 2 (and Step 4, for the land-ocean analysis; with no ocean
+data in result/SBBX.HadR2 only the land analysis is made).
+
+The stations of each member are drawn by one of these methods:
+
+  bootstrap  Drawn at random, with replacement, as many times as
+             there are stations.
+  drop       All but --drop stations, chosen at random.
+  region     The stations of regions (the 80 boxes of the grid), drawn
+             at random, with replacement.
+
+A station drawn more than once counts for that many stations in the
+subboxes it contributes to.  Step 2's adjustment of the urban stations
+is not redone for each member; nor are the ocean data resampled.  The
+parameters used are those of parameters/ (as for a run).
+
+The results are written to result/, two files for each analysis (land
+and mixed):
+
+  ANALYSISEns.Ann.txt  For each zone, the percentiles of the annual
+                       mean of each year.
+  ANALYSISEns.Mon.txt  For each zone, the percentiles of each month of
+                       each year.
+
+Anomalies are in .01 C, as in Step 5's text results.  NumPy is
+required.
+
+Options:
+   --help              Print this text.
+   --members N         The number of members (default 100).
+   --method M          The method of drawing the stations (default
+                       bootstrap).
+   --drop K            The number of stations that the drop method
+                       leaves out (default a tenth of them).
+   --seed S            The seed for the random numbers (default 1).
+   --percentiles P[,P] The percentiles to write (default 2.5,50,97.5).
+   --batch B           The number of members computed together
+                       (default 32).
+   -j, --jobs N        The number of worker processes (default 1).
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.4.4/lib/module-getopt.html
+import getopt
+# http://docs.python.org/release/2.4.4/lib/module-math.html
+import math
+# http://docs.python.org/release/2.4.4/lib/module-os.html
+import os
+# http://docs.python.org/release/2.4.4/lib/module-sys.html
+import sys
+# http://docs.python.org/release/2.4.4/lib/module-time.html
+import time
+
+# Clear Climate Code
+import extend_path
+import gio
+import parameters
+from code import steplog
+
+# The step modules are used without running the steps, so the logs of
+# the last run are left alone.
+steplog.directory = None
+from code import ensemble
+from code import step3
+
+class Usage(Exception):
+    pass
+
+def read_mask():
+    """The land weight of each subbox, from *parameters.step5_mask* (as
+    Step 5 reads it), or None when there is no mask."""
+
+    if not parameters.step5_mask:
+        return None
+    try:
+        f = open(parameters.step5_mask)
+    except IOError:
+        return None
+    print "Using mask from", parameters.step5_mask
+    mask = [float(row[16:21]) for row in f]
+    f.close()
+    return mask
+
+def read_ocean():
+    """The ocean subboxes, as a (*meta*, *cells*) pair, or None when
+    there are none.  *cells* is an iterator, so that each subbox can be
+    dropped once the ensemble has copied it."""
+
+    try:
+        f = open(os.path.join('result', 'SBBX.HadR2'), 'rb')
+    except IOError:
+        return None
+    cells = iter(gio.SubboxReader(f))
+    meta = cells.next()
+    return meta, cells
+
+def hundredths(x):
+    """*x* (degrees, or MISSING) as a string of 5 characters, in .01 C
+    (as Step 5 writes its text results)."""
+
+    if x == ensemble.MISSING:
+        return '*****'
+    s = '%5d' % int(math.floor(100*x + 0.5))
+    if len(s) > 5:
+        return '*****'
+    return s
+
+def write_percentiles(analysis, yrbeg, q, data, ann, description):
+    """Write the percentiles *q* of the members of *analysis*: *data*
+    and *ann* are the monthly and annual series of the members (see
+    `ensemble.annzon_members`)."""
+
+    titles = gio.step5_zone_titles()
+    monthly = ensemble.percentiles(data, q)
+    annual = ensemble.percentiles(ann, q)
+    labels = ['%5s' % ('P%g' % p) for p in q]
+
+    out = open(os.path.join('result', analysis + 'Ens.Ann.txt'), 'w')
+    print >> out, 'Annual Temperature Anomalies (.01 C), %s' % description
+    for z,title in enumerate(titles):
+        print >> out
+        print >> out, title.strip()
+        print >> out, 'Year ' + ' '.join(labels)
+        for iy in range(annual.shape[2]):
+            print >> out, '%4d ' % (yrbeg + iy) + ' '.join(
+              [hundredths(x) for x in annual[:,z,iy]])
+    out.close()
+
+    out = open(os.path.join('result', analysis + 'Ens.Mon.txt'), 'w')
+    print >> out, 'Monthly Temperature Anomalies (.01 C), %s' % description
+    for z,title in enumerate(titles):
+        print >> out
+        print >> out, title.strip()
+        print >> out, 'Year  Pct   Jan   Feb   Mar   Apr   May   Jun' \
+          '   Jul   Aug   Sep   Oct   Nov   Dec'
+        for iy in range(monthly.shape[2]):
+            for i,label in enumerate(labels):
+                print >> out, '%4d %s ' % (yrbeg + iy, label) + ' '.join(
+                  [hundredths(x) for x in monthly[i,z,iy]])
+    out.close()
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    members = 100
+    method = 'bootstrap'
+    drop = None
+    seed = 1
+    q = [2.5, 50, 97.5]
+    batch = 32
+    jobs = 1
+    try:
+        opts, args = getopt.getopt(argv[1:], 'j:',
+          ['help', 'members=', 'method=', 'drop=', 'seed=',
+           'percentiles=', 'batch=', 'jobs='])
+        for o,a in opts:
+            if o == '--help':
+                print __doc__
+                return 0
+            if o == '--members':
+                members = int(a)
+                if members < 1:
+                    raise Usage("--members must be at least 1")
+            elif o == '--method':
+                if a not in ensemble.METHODS:
+                    raise Usage("--method must be one of %s" %
+                      ', '.join(ensemble.METHODS))
+                method = a
+            elif o == '--drop':
+                drop = int(a)
+            elif o == '--seed':
+                seed = int(a)
+            elif o == '--percentiles':
+                q = [float(p) for p in a.split(',')]
+                if [p for p in q if not 0 <= p <= 100]:
+                    raise Usage("Percentiles must be from 0 to 100")
+            elif o == '--batch':
+                batch = int(a)
+                if batch < 1:
+                    raise Usage("--batch must be at least 1")
+            elif o in ('-j', '--jobs'):
+                jobs = int(a)
+                if jobs < 1:
+                    raise Usage("--jobs must be at least 1")
+        if args:
+            raise Usage("Unexpected arguments")
+        if not ensemble.numpy:
+            raise Usage("NumPy is not installed.")
+    except (getopt.GetoptError, ValueError, Usage), e:
+        sys.stderr.write('%s\n' % e)
+        sys.stderr.write(__doc__)
+        return 2
+
+    rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if os.getcwd() != rootdir:
+        sys.stderr.write("Run ensemble.py from the root directory of the"
+          " project, %s\n" % rootdir)
+        return 2
+
+    records = list(gio.step3_input())
+    if drop is None:
+        drop = len(records) // 10
+    try:
+        multiplicity = ensemble.sample(method, records, members, seed,
+          drop=drop)
+    except ValueError, e:
+        sys.stderr.write('%s\n' % e)
+        return 2
+    meta = step3.subbox_metadata(parameters.gridding_radius)
+    start = time.time()
+    e = ensemble.Ensemble(records, multiplicity, meta, ocean=read_ocean(),
+      mask=read_mask())
+    print "%d stations, %d members (%s); set up in %.1f seconds" % (
+      len(records), members, method, time.time() - start)
+
+    results = dict((analysis, ([], [])) for analysis in e.analyses())
+    done = 0
+    for out in e.run(batch=batch, jobs=jobs):
+        for analysis in out:
+            data, ann = out[analysis]
+            results[analysis][0].append(data)
+            results[analysis][1].append(ann)
+        done += len(data)
+        print "%d of %d members done in %.1f seconds" % (done, members,
+          time.time() - start)
+
+    description = '%d members, %s, seed %d' % (members, method, seed)
+    if method == 'drop':
+        description = '%d members, %s %d stations, seed %d' % (members,
+          method, drop, seed)
+    for analysis in e.analyses():
+        data, ann = results[analysis]
+        if analysis == 'land':
+            yrbeg = e.yrbeg
+        else:
+            yrbeg = e.mixed_yrbeg
+        write_percentiles(analysis, yrbeg, q,
+          ensemble.numpy.concatenate(data), ensemble.numpy.concatenate(ann),
+          description)
+        print "Percentiles written to result/%sEns.*.txt" % analysis
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,10 +5,23 @@
 """Handle (binary) Fortran files in Python.  A binary Fortran file can
 be opened using the open method of this module; a File object is
 returned that supports a writeline method (for writing records), a readline
-method (for reading records) and the iterator protocol (for reading)."""
+method (for reading records) and the iterator protocol (for reading).
 
+A file that is only to be read can instead be opened as a MappedFile,
+which maps the file into memory and finds all its records up front;
+its records can then be read in any order, and without copying."""
+
+# http://docs.python.org/release/2.4.4/lib/module-bisect.html
+import bisect
+# http://docs.python.org/release/2.4.4/lib/module-mmap.html
+import mmap
 import struct
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class Error(Exception):
     """An Exception."""
     pass
@@ -158,13 +171,166 @@ class File :
       raise StopIteration
     return r
 
-def open(name, mode='rb') :
+class MappedFile(File):
+    """A Fortran file object for reading only, whose contents are
+    mapped into memory.  The records are found when the file is opened,
+    so the file can be read by record number as well as in order: ``f[n]``
+    is record *n* (counting from 0) as a string; ``len(f)`` is the number
+    of records.  `record` and `array` return views of a record that do
+    not copy it.
+
+    The readline, seek, and iterator methods behave as they do for a
+    `File`; and they all start from the record after the last one read,
+    so a MappedFile can be used where a File is used.
+    """
+
+    def __init__(self, fd, bos='@'):
+        """As for `File`.  Unless *fd* is a builtin file object (for
+        example, a gzip file), its contents are read into memory
+        instead of being mapped.
+        """
+
+        File.__init__(self, fd, bos)
+        assert self.w == 4
+        self.map = None
+        if isinstance(fd, file):
+            try:
+                self.map = mmap.mmap(fd.fileno(), 0,
+                  access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError):
+                # An empty file can't be mapped.
+                pass
+        if self.map is None:
+            self.map = fd.read()
+        self._index()
+        # Number of the next record to be read by readline.
+        self.i = 0
+
+    def _index(self):
+        """Find the records in the file; *self.starts[n]* is the offset
+        of the first byte of record *n* (after its length prefix),
+        *self.lengths[n]* is its length in bytes."""
+
+        self.starts = []
+        self.lengths = []
+        m = self.map
+        size = len(m)
+        at = 0
+        fmt = self.bos + 'i'
+        while at < size:
+            if at + 2*self.w > size:
+                raise FormatError(
+                  "Truncated record starting at %d." % at)
+            l, = struct.unpack(fmt, m[at:at+self.w])
+            end = at + self.w + l
+            if l < 0 or end + self.w > size:
+                raise FormatError(
+                  "Record prefix %d runs beyond the end of the file;"
+                  " record starting at %d." % (l, at))
+            check, = struct.unpack(fmt, m[end:end+self.w])
+            if check != l:
+                raise FormatError(
+                  "Record prefix %d does not match suffix %r;"
+                  " record starting at %d." % (l, check, at))
+            self.starts.append(at + self.w)
+            self.lengths.append(l)
+            at = end + self.w
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, n):
+        """Record *n* as a string."""
+
+        start = self.starts[n]
+        return self.map[start:start+self.lengths[n]]
+
+    def record(self, n):
+        """Record *n* as a read-only buffer, which refers to the
+        mapped file rather than copying the record."""
+
+        return buffer(self.map, self.starts[n], self.lengths[n])
+
+    def array(self, n, type, offset=0, count=-1):
+        """Record *n* as a numpy array (which refers to the mapped file,
+        and is read-only).  *type* is the type of each item as a
+        numpy or struct type code (for example, 'f' or 'i4'); the byte
+        order of the file is used.  The array starts *offset* bytes
+        into the record, and has *count* items (all the rest, if
+        *count* is -1).  The numpy module is required.
+        """
+
+        order = self.bos
+        if order == '@':
+            order = '='
+        elif order == '!':
+            order = '>'
+        dtype = numpy.dtype(order + type)
+        length = self.lengths[n] - offset
+        if count < 0:
+            count = length // dtype.itemsize
+        elif count * dtype.itemsize > length:
+            raise FormatError(
+              "Record %d is too short for %d items." % (n, count))
+        return numpy.frombuffer(self.map, dtype, count,
+          self.starts[n] + offset)
+
+    def seek_record(self, n):
+        """Make record *n* the next one read by readline."""
+
+        self.i = n
+
+    def seek(self, offset, whence=0):
+        """Make the record that starts at *offset* (the offset of its
+        length prefix) the next one read by readline.  *offset* is
+        relative to the beginning of the file (*whence* is 0), the start
+        of the next record (*whence* is 1), or the end of the file
+        (*whence* is 2).
+        """
+
+        if whence == 1:
+            offset += self.tell()
+        elif whence == 2:
+            offset += len(self.map)
+        self.i = bisect.bisect_left(self.starts, offset + self.w)
+        if self.tell() != offset:
+            raise FormatError("No record starts at %d." % offset)
+
+    def tell(self):
+        """The offset of the next record to be read by readline."""
+
+        if self.i < len(self.starts):
+            return self.starts[self.i] - self.w
+        return len(self.map)
+
+    def close(self):
+        """Close the underlying file.  The mapping remains until any
+        views of it (returned by `record` or `array`) are gone.
+        """
+
+        self.map = None
+        return self.fd.close()
+
+    def readline(self):
+        """As `File.readline`, but the record comes from the mapped
+        file."""
+
+        if self.i >= len(self.starts):
+            return None
+        r = self[self.i]
+        self.i += 1
+        return r
+
+
+def open(name, mode='rb', mapped=False) :
   """Open the binary Fortran file called name.  mode is a mode string as
   per the builtin open function; for this version of this module it must
-  be 'rb'."""
+  be 'rb'.  If *mapped* is true, a MappedFile is returned."""
 
   assert 'b' in mode
 
+  if mapped:
+    return MappedFile(file(name, mode))
   return File(file(name, mode))
 
 
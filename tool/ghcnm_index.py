@@ -10,9 +10,15 @@
 Create an index of a file in GHCN-M format (typically either
 input/ghcnm.tavg.qca.dat (GHCN-M v3) or input/v2.mean (GHCN-M
 v2)).  This allows other programs to have faster random access.
+
+The index is kept in a file next to the GHCN-M file (with '.index'
+appended to its name).  It starts with a line that records the size
+and modification time of the GHCN-M file; `File` rebuilds the index
+when they no longer match.
 """
 
 import itertools
+import os
 import sys
 
 class Error(Exception):
@@ -31,8 +37,17 @@ def build(inp, out):
     if index is None:
         raise Error("Can't tell if input is GHCN-M v2 or v3")
 
+    out.write(stamp(inp.name))
     out.writelines(index(inp))
 
+def stamp(name):
+    """The first line of an index of the file called `name`; it
+    records the size and modification time of the file, so that an
+    index that is out of date can be detected."""
+
+    st = os.stat(name)
+    return "# %d %d\n" % (st.st_size, int(st.st_mtime))
+
 def v2_index(inp):
     return index_grouping(inp, lambda line: line[:12])
 
@@ -83,9 +98,16 @@ class File:
             self.file = open(self.name)
         self.index_name = self.name + '.index'
         try:
-            self.index = index(open(self.index_name))
+            f = open(self.index_name)
         except IOError:
             self.build()
+        else:
+            if f.readline() != stamp(self.name):
+                # The file has changed since the index was built.
+                f.close()
+                self.build()
+            else:
+                self.index = index(f)
 
     def build(self):
         """
@@ -108,7 +130,7 @@ class File:
 
         assert 12 == len(id12)
 
-        return get_single_id(self, id12)
+        return self.get_single_id(id12)
 
     def get_single_id(self, id):
         """
@@ -174,6 +196,20 @@ class File:
         for pair in self.get_many_id(id):
             yield pair
 
+    def lines(self, select):
+        """
+        Yield the lines of every record whose 11-digit station
+        identifier satisfies the predicate `select`, in the order
+        they appear in the file.  Only those records are read.
+        """
+
+        entries = [i for i in self.index.values()
+          if isinstance(i, Index) and select(i.id[:11])]
+        entries.sort(key=lambda i: i.whence)
+        for i in entries:
+            for line in self.get_single_id(i.id):
+                yield line
+
 def index(f):
     """Read the index file `f` and return a dictionary that maps from
     id to an Index object, and also for GHCN-M v2 files that
@@ -183,6 +219,9 @@ def index(f):
 
     d = {}
     for line in f:
+        if line.startswith('#'):
+            # The stamp.
+            continue
         i = Index(line)
         d[i.id] = i
         if len(i.id) > 11:
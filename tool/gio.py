@@ -17,19 +17,27 @@ used by other bodies (such as NOAA's v2.mean format).
 __docformat__ = "restructuredtext"
 
 
+import array
 import copy
 import glob
 import itertools
 import math
+import mmap
 import os
 import re
 import struct
+import sys
 import warnings
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 # Clear Climate Code
 import extend_path
 import fort
+import ghcnm_index
 import code.giss_data
 import parameters
 
@@ -304,14 +312,92 @@ class StationReader(object):
             yield station
 
 
+class SubboxRecord(code.giss_data.Series):
+    """A subbox series, as read from a subbox file by `SubboxReader`.
+
+    The record is kept as it is in the file (the string *rec*, with
+    byte order *bos*) and its fields are only decoded when they are
+    first used: the box fields (`box`, `stations`, `d`, and so on, and
+    the `uid`) together, and the series separately.  `good_count` is
+    counted directly from the record when numpy is available.
+    Otherwise a SubboxRecord is exactly the same as the `Series` that
+    would be made from the same fields.
+    """
+
+    # The attributes that are decoded from the part of the record
+    # before the series.
+    _header = ['lat_S', 'lat_N', 'lon_W', 'lon_E',
+      'stations', 'station_months', 'd', 'box', 'uid']
+
+    def __init__(self, rec, bos, celltype):
+        self._rec = rec
+        self._bos = bos
+        self.celltype = celltype
+        self.ann_anoms = []
+
+    def __getattr__(self, name):
+        # Only called when *name* is not (yet) an attribute.
+        if name.startswith('__') or '_rec' not in self.__dict__:
+            raise AttributeError(name)
+        if name in self._header:
+            self._decode_header()
+        elif name in ('_series', '_first_month'):
+            self._decode_series()
+        elif name == '_good_count':
+            if numpy:
+                order = {'@': '=', '!': '>'}.get(self._bos, self._bos)
+                data = numpy.frombuffer(self._rec, order + 'f4',
+                  offset=32)
+                self._good_count = int(
+                  (data != code.giss_data.MISSING).sum())
+            else:
+                self._good_count = None
+        else:
+            raise AttributeError(name)
+        return self.__dict__[name]
+
+    def _decode_header(self):
+        fields = list(struct.unpack(self._bos + 'iiiiiiif',
+          self._rec[:32]))
+        # The box boundaries are fields[1:5], but we need to scale
+        # them to fractional degrees first:
+        for i in range(1,5):
+            fields[i] /= 100.0
+        self.__dict__.update(zip(
+          ['lat_S', 'lat_N', 'lon_W', 'lon_E',
+          'stations', 'station_months', 'd'],
+          fields[1:8]))
+        self.box = fields[1:5]
+        if 'uid' not in self.__dict__:
+            self.uid = code.giss_data.boxuid(self.box,
+              celltype=self.celltype)
+
+    def _decode_series(self):
+        if 'box' not in self.__dict__:
+            self._decode_header()
+        rec = self._rec
+        series = struct.unpack(self._bos + '%df' % ((len(rec) - 32)//4),
+          rec[32:])
+        self.set_series(code.giss_data.BASE_YEAR*12+1, series)
+        # Everything has been decoded now; the good_count (if it has
+        # not been counted yet) is counted from the series.
+        if '_good_count' not in self.__dict__:
+            self._good_count = None
+        del self._rec
+
+
 class SubboxReader(object):
     """Reads GISS subbox files (SBBX).  These files are output by Step
     3, and consumed by Step 5.  Step 4 both reads and writes a subbox
     file.
+
+    The records are `SubboxRecord` instances, which are decoded
+    lazily.  `month` gets a single month from every record, without
+    decoding them.
     """
     def __init__(self, rawfile, bos='>', celltype=None):
         self.bos = bos
-        self.f = fort.File(rawfile, bos=self.bos)
+        self.f = fort.MappedFile(rawfile, bos=self.bos)
         rec = self.f.readline()
         (self.mo1, kq, mavg, monm, monm4, yrbeg, missing_flag,
                 precipitation_flag,
@@ -349,24 +435,36 @@ class SubboxReader(object):
         yield self.meta
 
         for rec in self.f:
-            mo1 = self.mo1
-            fmt = "iiiiiiif%df" % mo1
-            fields = list(struct.unpack(self.bos + fmt, rec))
-            series = fields[8:]
-            self.mo1 = fields[0]
-            # Make an attributes dictionary.
-            # The box boundaries are fields[1:5], but we need to scale
-            # them to fractional degrees first:
-            for i in range(1,5):
-                fields[i] /= 100.0
-            attr = dict(zip(
-              ['lat_S', 'lat_N', 'lon_W', 'lon_E',
-              'stations', 'station_months', 'd'],
-              fields[1:8]))
-            attr['box'] = fields[1:5]
-            subbox = code.giss_data.Series(series=series,
-              celltype=self.celltype, **attr)
-            yield subbox
+            # The length of each record is given by the first field of
+            # the record before it.
+            if len(rec) != 4*(8 + self.mo1):
+                raise fort.FormatError(
+                  "Subbox record has length %d, expected %d." %
+                  (len(rec), 4*(8 + self.mo1)))
+            self.mo1 = struct.unpack(self.bos + 'i', rec[:4])[0]
+            yield SubboxRecord(rec, self.bos, self.celltype)
+
+    def month(self, i):
+        """Return a list with the value of the series of each subbox
+        (in file order) at index *i* (the month 12*(*y*-1880) + *m*, for
+        the month with index *m* of year *y*).  A value is MISSING when
+        the series is not that long.  The records are not decoded, nor
+        are those already read by iterating over this reader
+        affected.
+        """
+
+        f = self.f
+        # Offset of the value in each record.
+        at = 32 + 4*i
+        fmt = self.bos + 'f'
+        result = []
+        for n in range(1, len(f)):
+            if at + 4 > f.lengths[n]:
+                result.append(code.giss_data.MISSING)
+            else:
+                start = f.starts[n] + at
+                result.append(struct.unpack(fmt, f.map[start:start+4])[0])
+        return result
 
     def __getattr__(self, name):
         return getattr(self.meta, name)
@@ -428,6 +526,112 @@ class StationTsWriter(object):
     def close(self):
         self.f.close()
 
+# The layout of a line of a GHCN-M file (v3 and v2): the position of
+# the year, of the first datum, the distance between the data, and the
+# length of the line (not counting the newline).  Each datum is 5
+# characters; in v3 it is followed by 3 flags.
+GHCNM_LAYOUT = dict(v3=(11, 19, 8, 115), v2=(12, 16, 5, 76))
+
+def ghcnm_rows(lines, format, scale, reject='',
+  missing=code.giss_data.MISSING):
+    """Decode the *lines* of a file in GHCN-M format (*format* is 'v3'
+    or 'v2'), and yield a (*line*, *year*, *values*) triple for each
+    line.  *values* is a list of the 12 monthly data, each multiplied by
+    *scale*; a datum of -9999, or (for v3) one whose quality-control
+    flag is one of the characters in *reject*, is *missing*.  *scale* is
+    either a number, or a function that is called with each line and
+    returns the scale for that line.
+
+    The lines are decoded in blocks.  When numpy is available all the
+    data of a block are converted at once; the values are exactly the
+    same as those produced by converting each datum with ``int``.
+    """
+
+    lines = iter(lines)
+    while True:
+        block = list(itertools.islice(lines, 4096))
+        if not block:
+            break
+        if callable(scale):
+            scales = map(scale, block)
+        else:
+            scales = [scale] * len(block)
+        rows = None
+        if numpy:
+            rows = _ghcnm_block(block, format, scales, reject, missing)
+        if rows is None:
+            rows = _ghcnm_lines(block, format, scales, reject, missing)
+        for row in rows:
+            yield row
+
+def _ghcnm_lines(block, format, scales, reject, missing):
+    """Decode a *block* of lines a line at a time, for `ghcnm_rows`."""
+
+    year_at, first, step, width = GHCNM_LAYOUT[format]
+    # The year, and then each datum and its quality-control flag.
+    fmt = '%dx4s%dx' % (year_at, first - year_at - 4)
+    if format == 'v3':
+        fmt += '5sx1sx' * 12
+    else:
+        fmt += '5s' * 12
+    result = []
+    for line,scale in zip(block, scales):
+        fields = struct.unpack(fmt, line[:width])
+        if format == 'v3':
+            data = map(int, fields[1::2])
+            flags = fields[2::2]
+        else:
+            # As GHCNV2Reader always has, accept any number.
+            data = map(float, fields[1:])
+            flags = ''
+        values = [v * scale for v in data]
+        if reject or -9999 in data:
+            for i,v in enumerate(data):
+                if v == -9999 or (reject and flags[i] in reject):
+                    values[i] = missing
+        result.append((line, int(fields[0]), values))
+    return result
+
+def _ghcnm_block(block, format, scales, reject, missing):
+    """Decode a *block* of lines using numpy, for `ghcnm_rows`.  None
+    is returned if any line is not in the expected layout (so that it
+    can be decoded, or the error reported, a line at a time).
+    """
+
+    year_at, first, step, width = GHCNM_LAYOUT[format]
+    for line in block:
+        if len(line) < width:
+            return None
+    a = numpy.frombuffer(''.join([line[:width] for line in block]),
+      numpy.uint8).reshape(len(block), width)
+    # The characters of the data, indexed by [line, month, character].
+    starts = first + step*numpy.arange(12)
+    c = a[:, starts[:,numpy.newaxis] + numpy.arange(5)]
+    digit = (c >= ord('0')) & (c <= ord('9'))
+    space = c == ord(' ')
+    # int() accepts spaces, then an optional minus sign, then digits.
+    started = numpy.logical_or.accumulate(~space, axis=2)
+    sign = started & ~numpy.concatenate(
+      [numpy.zeros_like(started[:,:,:1]), started[:,:,:-1]], axis=2)
+    minus = sign & (c == ord('-'))
+    if not numpy.where(started, digit | minus, space).all():
+        return None
+    if not (digit.any(axis=2)).all():
+        return None
+    d = numpy.where(digit, c - ord('0'), 0).astype(numpy.int64)
+    v = numpy.dot(d, 10 ** numpy.arange(4, -1, -1, dtype=numpy.int64))
+    v = numpy.where(minus.any(axis=2), -v, v)
+    bad = v == -9999
+    if reject:
+        table = numpy.zeros(256, bool)
+        table[[ord(x) for x in reject]] = True
+        bad |= table[a[:, starts + 6]]
+    values = (v * numpy.array(scales)[:,numpy.newaxis]).astype(object)
+    values[bad] = missing
+    values = values.tolist()
+    return [(line, int(line[year_at:year_at+4]), row)
+      for line,row in zip(block, values)]
+
 def GHCNV3Reader(path=None, file=None, meta=None, year_min=None, scale=None):
     """Reads a file in GHCN V3 .dat format and yields each station
     record (as a giss_data.Series instance).  For now, this treats
@@ -460,7 +664,6 @@ def GHCNV3Reader(path=None, file=None, meta=None, year_min=None, scale=None):
         """Extract the 11-digit station identifier."""
         return l[:11]
 
-    noted_element = False
     def note_element(element):
         """Print the meteorological element we are reading."""
         friendly = dict(TAVG='average temperature',
@@ -474,43 +677,31 @@ def GHCNV3Reader(path=None, file=None, meta=None, year_min=None, scale=None):
     # we shouldn't actually see any of these flags.
     reject = 'DKOSTW'
 
-    def convert(s):
-        """Convert single value. *s* is the 8 character string: 5
-        characters for value, 3 for flags."""
-
-        # This function captures *multiplier* which can, in principle,
-        # change for each line.
+    # Whether the element has been noted (a list, so that it can be
+    # changed by *multiplier*).
+    noted = [False]
+    def multiplier(line):
+        """The scale for the data of *line*."""
 
-        v = int(s[:5])
-        # Flags for Measurement (missing days), Quality, and
-        # Source.
-        m,q,s = s[5:8]
-        if q in reject or v == -9999:
-            v = MISSING
-        else:
-            v *= multiplier
-        return v
+        element = line[15:19]
+        if not noted[0]:
+            note_element(element)
+            noted[0] = True
+        if scale:
+            return scale
+        return element_scale[element]
 
     all_missing = [MISSING]*12
 
-    for id,lines in itertools.groupby(inp, id11):
+    rows = ghcnm_rows(inp, 'v3', multiplier, reject, MISSING)
+    for id,rows in itertools.groupby(rows, lambda row: id11(row[0])):
         key = dict(uid=id+'0',
                    first_year=year_min,
                    )
         if meta and meta.get(id):
             key['station'] = meta[id]
         record = code.giss_data.Series(**key)
-        for line in lines:
-            year = int(line[11:15])
-            element = line[15:19]
-            if not noted_element:
-                note_element(element)
-                noted_element = True
-            if scale:
-                multiplier = scale
-            else:
-                multiplier = element_scale[element]
-            values = [convert(line[i:i+8]) for i in range(19,115,8)]
+        for line,year,values in rows:
             if values != all_missing:
                 record.add_year(year, values)
         if len(record) != 0:
@@ -597,25 +788,15 @@ def GHCNV2Reader(path=None, file=None, meta=None, year_min=None):
         """Extract the 12-digit station record identifier."""
         return l[:12]
 
-    def v2_float(s):
-        """Convert a single datum from string to float; converts missing
-        values from their V2 representation, "-9999", to internal
-        representation, giss_data.MISSING; scales temperatures to
-        convert them from integer tenths to fractional degrees C.
-        """
-
-        if "-9999" == s:
-            return code.giss_data.MISSING
-        else:
-            return float(s) * 0.1
-
     # The Series.add_year protocol assumes that the years are in
     # increasing sequence.  This is so in the v2.mean file but does not
     # seem to be documented (it seems unlikely to change either).
 
     # Group the input file into blocks of lines, all of which share the
-    # same 12-digit ID.
-    for (id, lines) in itertools.groupby(f, id12):
+    # same 12-digit ID.  The data are scaled to convert them from
+    # integer tenths to fractional degrees C.
+    rows = ghcnm_rows(f, 'v2', 0.1)
+    for (id, rows) in itertools.groupby(rows, lambda row: id12(row[0])):
         key = dict(uid=id, first_year=year_min)
         # 11-digit station ID.
         stid = id[:11]
@@ -623,10 +804,8 @@ def GHCNV2Reader(path=None, file=None, meta=None, year_min=None):
             key['station'] = meta[stid]
         record = code.giss_data.Series(**key)
         prev_line = None
-        for line in lines:
+        for line,year,temps in rows:
             if line != prev_line:
-                year = int(line[12:16])
-                temps = [v2_float(line[a:a+5]) for a in range(16, 16+12*5, 5)]
                 record.add_year(year, temps)
                 prev_line = line
             else:
@@ -673,6 +852,136 @@ class GHCNV2Writer(object):
     def close(self):
         self.f.close()
 
+# The binary work file format.  The file starts with BINARY_MAGIC, and
+# is followed by a block of data (the data of all the records, one
+# after the other) and an index.  It ends with a trailer,
+# BINARY_TRAILER, giving the position of the index, the length of the
+# uid column, the number of records, and the scale of the data.  The
+# index is in columns: the uids (separated by newlines), then the
+# first year, number of years, and position in the data block (in
+# values) of each record.  The data are integers (of the same value as
+# would be written to a GHCN v2 file) stored as little-endian 16-bit
+# ints.
+BINARY_MAGIC = 'CCCWORK1'
+BINARY_TRAILER = '<qqid'
+
+class BinaryWriter(object):
+    """Write a file in the binary work file format (see BINARY_MAGIC).
+    See also BinaryReader.  Like the GHCN v2 format, each record is
+    stored from its first to its last year with data; unlike GHCN v2,
+    years in between with no data are stored (as MISSING).
+    """
+
+    def __init__(self, path=None, file=None, scale=0.1, **k):
+        if path is not None:
+            self.f = open(path, "wb")
+        else:
+            self.f = file
+        self.scale = scale
+        self.f.write(BINARY_MAGIC)
+        self.uids = []
+        self.first_years = array.array('i')
+        self.year_counts = array.array('i')
+        self.offsets = array.array('i')
+        self.n = 0
+
+    def write(self, record):
+        """Write an entire record out."""
+
+        years = [year
+          for year in range(record.first_year, record.last_year + 1)
+          if record.has_data_for_year(year)]
+        if not years:
+            return
+        first, last = years[0], years[-1]
+        data = array.array('h')
+        for temps in record.get_set_of_years(first, last):
+            data.extend(internal_to_external(temps, scale=self.scale))
+        if sys.byteorder == 'big':
+            data.byteswap()
+        self.f.write(data.tostring())
+        self.uids.append(record.uid)
+        self.first_years.append(first)
+        self.year_counts.append(last - first + 1)
+        self.offsets.append(self.n)
+        self.n += len(data)
+
+    def close(self):
+        index = self.f.tell()
+        uids = '\n'.join(self.uids)
+        self.f.write(uids)
+        for column in [self.first_years, self.year_counts, self.offsets]:
+            column = array.array('i', column)
+            if sys.byteorder == 'big':
+                column.byteswap()
+            self.f.write(column.tostring())
+        self.f.write(struct.pack(BINARY_TRAILER,
+          index, len(uids), len(self.uids), self.scale))
+        self.f.close()
+
+def BinaryReader(path, meta=None, year_min=None):
+    """Reads a file in the binary work file format (see BinaryWriter)
+    and yields each station record.  The file is memory mapped, so
+    there is no text to parse.
+
+    The *meta* and *year_min* arguments are as for `GHCNV2Reader`, and
+    the records are exactly the same as those that `GHCNV2Reader`
+    would produce from the equivalent GHCN v2 file.
+    """
+
+    f = open(path, 'rb')
+    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if m[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise ValueError, "%s is not a binary work file." % path
+    trailer_size = struct.calcsize(BINARY_TRAILER)
+    index, uid_size, count, scale = struct.unpack(BINARY_TRAILER,
+      m[-trailer_size:])
+    uids = m[index:index+uid_size].split('\n')
+    columns = []
+    at = index + uid_size
+    for _ in range(3):
+        column = array.array('i')
+        column.fromstring(m[at:at+4*count])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        columns.append(column)
+        at += 4*count
+    first_years, year_counts, offsets = columns
+
+    internal_missing = code.giss_data.MISSING
+    for uid,first_year,year_count,offset in itertools.izip(
+      uids, first_years, year_counts, offsets):
+        start = len(BINARY_MAGIC) + 2*offset
+        data = array.array('h')
+        data.fromstring(m[start:start+2*12*year_count])
+        if sys.byteorder == 'big':
+            data.byteswap()
+        series = [internal_missing] * len(data)
+        for i,v in enumerate(data):
+            if v != MISSING:
+                series[i] = v * scale
+        if year_min is not None:
+            # As GHCNV2Reader does, drop the years before *year_min*,
+            # or start the record at *year_min*.
+            if first_year < year_min:
+                series = series[12*(year_min - first_year):]
+            else:
+                series = ([internal_missing] * 12*(first_year - year_min) +
+                  series)
+            first_year = year_min
+        if not series:
+            continue
+        key = dict(uid=uid)
+        stid = uid[:11]
+        if meta and meta.get(stid):
+            key['station'] = meta[stid]
+        record = code.giss_data.Series(**key)
+        record.set_series(first_year*12 + 1, series)
+        yield record
+
+    m.close()
+    f.close()
+
 def DecimalReader(path, year_min=-9999):
     """Reads a file in Decimal format and yields each station.
     
@@ -892,7 +1201,6 @@ def read_USHCN(path, meta={}):
         """The 6 digit USHCN identifier."""
         return l[0:6]
 
-    noted_element = False
     def note_element(element):
         """Print the meteorological element we are reading."""
         # See ftp://ftp.ncdc.noaa.gov/pub/data/ushcn/v2/monthly/readme.txt
@@ -1362,17 +1670,94 @@ def maskboxes(inp, grid):
         v = float(row[16:21])
         yield v, box
 
+class StationSelection(object):
+    """A selection of stations, for running the analysis on part of
+    the input.  An instance is a predicate: it is called with an
+    11-digit station identifier and returns True for a selected
+    station.
+
+    A station is selected when its identifier is one of *ids* or
+    starts with one of *prefixes* (the first 3 digits of a GHCN-M v3
+    identifier are the country code); and when it lies within *bbox*, a
+    (south, north, west, east) tuple in degrees, according to the
+    station metadata (v3.inv).  A *west* greater than *east* specifies a
+    box that crosses the 180 meridian.  Any of the criteria can be
+    omitted.
+    """
+
+    def __init__(self, ids=(), prefixes=(), bbox=None):
+        self.ids = set(ids)
+        self.prefixes = list(prefixes)
+        self.bbox = bbox
+
+    def __call__(self, id11):
+        if self.ids or self.prefixes:
+            if (id11 not in self.ids and
+              not [p for p in self.prefixes if id11.startswith(p)]):
+                return False
+        if self.bbox:
+            station = v3meta().get(id11)
+            if station is None:
+                return False
+            s,n,w,e = self.bbox
+            if not s <= station.lat <= n:
+                return False
+            if w <= e:
+                return w <= station.lon <= e
+            return station.lon >= w or station.lon <= e
+        return True
+
+    def __str__(self):
+        parts = []
+        if self.ids:
+            parts.append('stations=%s' % ','.join(sorted(self.ids)))
+        if self.prefixes:
+            parts.append('country=%s' % ','.join(self.prefixes))
+        if self.bbox:
+            parts.append('bbox=%s' % ','.join(map(str, self.bbox)))
+        return ' '.join(parts)
+
 class Input:
     """Generally one instance is created: the result of
-    step0_input()."""
+    step0_input().  If *select* (a `StationSelection`) is given then
+    only the records of the selected stations are read; the GHCN-M
+    files are read using an index (see ghcnm_index.py), so that the
+    other records are skipped.
+    """
 
-    def __init__(self):
+    def __init__(self, select=None):
         self.sources = parameters.data_sources.split()
+        self.select = select
 
     def open(self_, source):
         """Open the source (specified as a string), and return an
         iterator."""
 
+        records = self_.open_all(source)
+        if self_.select:
+            records = itertools.ifilter(
+              lambda record: self_.select(record.uid[:11]), records)
+        return records
+
+    def is_sorted(self_, source):
+        """True when the records of *source* are in order of uid (as
+        the GHCN-M files are)."""
+
+        return (source in ('ghcn', 'ghcn.v2') or
+          bool(re.match('ghcnm.(tavg|tmax|tmin)', source)))
+
+    def lines(self_, path):
+        """Return the lines of the GHCN-M file *path*: all of them, or
+        only those of the selected stations."""
+
+        if self_.select:
+            return ghcnm_index.File(path).lines(self_.select)
+        return open(path)
+
+    def open_all(self_, source):
+        """Open the source (specified as a string), and return an
+        iterator of all its records."""
+
         if source == 'ushcn' or source.endswith('.ushcnv2'):
             if parameters.USHCN_convert_id:
                 ushcn_map = read_USHCN_stations('input/ushcn2.tbl',
@@ -1389,11 +1774,11 @@ class Input:
             else:
                 ghcn3file = os.path.join('input', source+'.qca.dat')
             invfile = 'input/v3.inv'
-            return GHCNV3Reader(file=open(ghcn3file),
+            return GHCNV3Reader(file=self_.lines(ghcn3file),
               meta=augmented_station_metadata(invfile, format='v3'),
               year_min=code.giss_data.BASE_YEAR)
         if source == 'ghcn.v2':
-            return GHCNV2Reader("input/v2.mean",
+            return GHCNV2Reader(file=self_.lines("input/v2.mean"),
                 meta=v3meta(),
                 year_min=code.giss_data.BASE_YEAR)
         if source == 'scar':
@@ -1420,8 +1805,8 @@ class Input:
 # Each of the stepN_output functions below is effectively a "tee" that
 # writes the data to a file; they each take a data object (an
 # iterator), write each item to a file, and yield each item.
-def step0_input():
-    input = Input()
+def step0_input(select=None):
+    input = Input(select)
 
     return input
 
@@ -1435,6 +1820,8 @@ def choose_writer():
         writer = GHCNV2Writer
     elif format == 'v3':
         writer = GHCNV3Writer
+    elif format == 'bin':
+        writer = BinaryWriter
     return writer,format
 
 def generic_output_step(n):
@@ -1448,24 +1835,34 @@ def generic_output_step(n):
             out.write(thing)
             yield thing
         print "Step %d: closing output file." % n
+        out.close()
     return output
 
+def generic_input_step(n, **k):
+    """Return a reader for the output of step *n* (as written by the
+    output routine made by `generic_output_step`).  Keyword arguments
+    are passed to the reader."""
+
+    if parameters.work_file_format == 'bin':
+        return BinaryReader(os.path.join('work', 'step%d.bin' % n),
+          meta=v3meta(), **k)
+    return GHCNV2Reader(os.path.join('work', 'step%d.v2' % n),
+      meta=v3meta(), **k)
+
 step0_output = generic_output_step(0)
 
 def step1_input():
-    return GHCNV2Reader("work/step0.v2",
-        meta=v3meta(),
-        year_min=code.giss_data.BASE_YEAR)
+    return generic_input_step(0, year_min=code.giss_data.BASE_YEAR)
 
 step1_output = generic_output_step(1)
 
 def step2_input():
-    return GHCNV2Reader("work/step1.v2", meta=v3meta())
+    return generic_input_step(1)
 
 step2_output = generic_output_step(2)
 
 def step3_input():
-    return GHCNV2Reader("work/step2.v2", meta=v3meta())
+    return generic_input_step(2)
 
 STEP3_OUT = os.path.join('result', 'SBBX1880.Ts.GHCN.CL.PA.1200')
 
@@ -1522,6 +1919,14 @@ def step4_find_monthlies(latest_year, latest_month):
     return l
 
 def step4_load_sst_monthlies(latest_year, latest_month):
+    """Load the monthly sea-surface temperature files that are more
+    recent than *latest_year*, *latest_month*.  Returns a pair (*sst*,
+    *dates*), or None if there are no such files.  *sst* is an array
+    indexed as ``sst[long][lat][month]``: a NumPy array, if NumPy is
+    available, or else a list-of-lists-of-lists (see
+    `make_3d_array`).
+    """
+
     files = step4_find_monthlies(latest_year, latest_month)
     if not files:
         print "No more recent sea-surface data files.\n"
@@ -1532,7 +1937,10 @@ def step4_load_sst_monthlies(latest_year, latest_month):
     n_years = last_year - first_year + 1
 
     # Read in the SST data for recent years
-    sst = make_3d_array(360, 180, 12 * n_years)
+    if numpy:
+        sst = numpy.zeros((360, 180, 12 * n_years))
+    else:
+        sst = make_3d_array(360, 180, 12 * n_years)
 
     dates = []
     for (date, file) in files:
@@ -1540,35 +1948,51 @@ def step4_load_sst_monthlies(latest_year, latest_month):
         (year, month) = date
         f = open_or_uncompress(file)
         print "reading", file
-        f = fort.File(f, bos = ">")
-        f.readline() # discard first record
-        data = f.readline()
-        f.close()
+        f = fort.MappedFile(f, bos = ">")
         month = 12 * (year - first_year) + month - 1
-        p = 0
-        for lat in range(180):
-            for long in range(360):
-                v, = struct.unpack(">f", data[p:p+4])
-                p += 4
-                sst[long][lat][month] = v
+        # The grid is the second record (the first is discarded), stored
+        # by latitude then longitude.
+        if numpy:
+            grid = f.array(1, 'f4', count=180*360).reshape(180, 360)
+            sst[:,:,month] = grid.T
+        else:
+            grid = struct.unpack(">%df" % (180*360), f[1][:4*180*360])
+            p = 0
+            for lat in range(180):
+                for long in range(360):
+                    sst[long][lat][month] = grid[p]
+                    p += 1
+        f.close()
 
     return sst, dates
 
 def step4_load_clim():
+    """Load the sea-surface temperature climatology.  The result is an
+    array indexed as ``clim[long][lat][month]``, like the *sst* array
+    returned by `step4_load_sst_monthlies`.
+    """
+
     f = open_or_uncompress("input/oisstv2_mod4.clim")
-    f = fort.File(f, bos='>')
-    data = f.readline()
+    f = fort.MappedFile(f, bos='>')
+
+    # The record starts with an 80 character title; then the grids,
+    # stored by month, latitude, then longitude.
+    n = 12*180*360
+    if numpy:
+        grid = f.array(0, 'f4', 80, n).reshape(12, 180, 360)
+        clim = grid.transpose(2, 1, 0).astype(float)
+        f.close()
+        return clim
+    data = f[0]
     f.close()
-
-    clim_title = data[:80]
+    grid = struct.unpack(">%df" % n, data[80:80+4*n])
     clim = make_3d_array(360, 180, 12)
     p = 0
     for month in range(12):
         for lat in range(180):
             for long in range(360):
-                v, = struct.unpack(">f", data[p+80:p+84])
-                p += 4
-                clim[long][lat][month] = v
+                clim[long][lat][month] = grid[p]
+                p += 1
     return clim
 
 # This is used to extract the end month/year from the title of the SBBX file.
@@ -1614,12 +2038,14 @@ def step5_input(data):
     else:
         data = ensure_landocean(data)
     # Add optional mask.
-    try:
-        p = os.path.join('input', 'step5mask')
-        mask = open(p)
-        print "Using mask from", p
-    except IOError:
-        mask = None
+    mask = None
+    p = parameters.step5_mask
+    if p:
+        try:
+            mask = open(p)
+            print "Using mask from", p
+        except IOError:
+            pass
     meta = data.next()
     if mask is None:
         yield (None,) + tuple(meta)
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# microbench.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""microbench.py [options]
+
+Measures the inner kernels of the GISTEMP algorithm in isolation: the
+functions that combine, average, and fit series, and that find the
+stations near a subbox, where most of the time of a run goes.
+
+Each kernel is called on the same inputs every time: station records
+of 140 years of monthly data, with gaps like those of GHCN records (a
+late start, runs of missing years, and scattered missing months),
+made from a fixed seed.  A kernel is called repeatedly for at least
+--time seconds, and for each one the result reports the rate (calls
+per second, from the median time of a call), the best and median
+time of a call, and the allocations per call (the net number of
+objects tracked by the garbage collector, such as lists and tuples,
+that a call leaves allocated; floats are not counted, so this
+measures the containers that a kernel makes).
+
+Each kernel is measured with each of the implementations of the
+series functions (see `series.use`).  The kernels whose inputs are
+stored as selected by *parameters.series_storage* (see
+`STORAGE_KERNELS`) are also measured with each storage of the series
+data, so that they can be compared side by side; the others are given
+lists whatever the storage, so they are measured once, with a storage
+of null.  The results are written as JSON.
+
+Options:
+   --help              Print this text.
+   --kernels K[,K]     The kernels to measure (default all of them).
+   --implementations I[,I]
+                       The series implementations (default python and,
+                       if it is installed, numpy).
+   --storage S[,S]     The series storage, for the kernels that
+                       depend on it (default list,array).
+   --time T            The minimum time, in seconds, to spend on each
+                       kernel (default 0.5).
+   --seed S            The seed for the random inputs (default 1).
+   -o FILE             Write the JSON to FILE (and a table to stdout),
+                       instead of writing the JSON to stdout.
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.4.4/lib/module-gc.html
+import gc
+# http://docs.python.org/release/2.4.4/lib/module-getopt.html
+import getopt
+# http://docs.python.org/release/2.6.8/library/json.html
+import json
+# http://docs.python.org/release/2.4.4/lib/module-math.html
+import math
+# http://docs.python.org/release/2.4.4/lib/module-random.html
+import random
+# http://docs.python.org/release/2.4.4/lib/module-sys.html
+import sys
+# http://docs.python.org/release/2.4.4/lib/module-timeit.html
+import timeit
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Clear Climate Code
+import extend_path
+import parameters
+from code import earth
+from code import giss_data
+from code import linefit
+from code import series
+from code import steplog
+from code.giss_data import MISSING, valid
+from extension import step1
+
+# The step modules are used without running the steps, so the logs of
+# the last run are left alone.
+steplog.directory = None
+from code import step2
+from code import step3
+
+# The years of the monthly series.
+FIRST_YEAR = 1880
+YEARS = 140
+
+class Usage(Exception):
+    pass
+
+def monthly_series(rnd):
+    """A list of *YEARS* years of synthetic monthly temperatures, in
+    degrees Celsius, with gaps like those of a GHCN record: a late
+    start, a couple of runs of missing years, and about 3% of the
+    other months missing."""
+
+    base = rnd.uniform(-5, 25)
+    amplitude = rnd.uniform(2, 15)
+    data = []
+    for year in range(YEARS):
+        level = base + 0.008 * year + rnd.gauss(0, 0.4)
+        for m in range(12):
+            data.append(round(level +
+              amplitude * math.cos(math.pi * (m - 6) / 6.0) +
+              rnd.gauss(0, 1.0), 1))
+    start = rnd.randint(0, 20)
+    data[:12 * start] = [MISSING] * (12 * start)
+    for _ in range(2):
+        first = rnd.randint(start, YEARS - 1)
+        last = min(YEARS, first + rnd.randint(1, 8))
+        data[12 * first:12 * last] = [MISSING] * (12 * (last - first))
+    for i in range(len(data)):
+        if rnd.random() < 0.03:
+            data[i] = MISSING
+    return data
+
+def station_record(data):
+    """A station record of the monthly series *data*."""
+
+    return giss_data.Series(series=data, first_year=FIRST_YEAR)
+
+
+# Each kernel is set up by a function that takes a random.Random
+# instance and returns a pair (*fn*, *args*): *fn* is the function to
+# call, and *args* is a function that returns the arguments for a
+# call (copies of them, for a kernel that modifies its arguments).
+# Station records, and the series taken from them, are stored as
+# selected by *parameters.series_storage* (see `STORAGE_KERNELS`); the
+# series that Steps 3 and 5 combine and anomalize, and the annual
+# anomalies of Step 2, are always lists, as they are here.
+
+def setup_combine(rnd):
+    composite = monthly_series(rnd)
+    weight = [float(valid(v)) for v in composite]
+    new = monthly_series(rnd)
+    def args():
+        return (list(composite), list(weight), new, 0.8,
+          parameters.gridding_min_overlap)
+    return series.combine, args
+
+def setup_anomalize(rnd):
+    data = monthly_series(rnd)
+    return series.anomalize, lambda: (list(data), (1951, 1980), FIRST_YEAR)
+
+def setup_monthly_annual(rnd):
+    data = giss_data.new_storage(monthly_series(rnd))
+    return series.monthly_annual, lambda: (data,)
+
+def setup_annual_anomaly(rnd):
+    record = station_record(monthly_series(rnd))
+    return step2.annual_anomaly, lambda: (record,)
+
+def annual_anomalies(rnd):
+    """The annual anomalies (from `step2.annual_anomaly`) of a
+    synthetic record; at the start of a record they are missing."""
+
+    while True:
+        anomalies = step2.annual_anomaly(station_record(monthly_series(rnd)))
+        if anomalies is not None:
+            return anomalies
+
+def setup_cmbine(rnd):
+    combined = annual_anomalies(rnd)
+    weights = [float(valid(v)) for v in combined]
+    counts = [int(valid(v)) for v in combined]
+    data = annual_anomalies(rnd)
+    def args():
+        return list(combined), list(weights), list(counts), data, 0.8
+    return step2.cmbine, args
+
+def setup_trend2(rnd):
+    urban = annual_anomalies(rnd)
+    rural = annual_anomalies(rnd)
+    points = []
+    for i,(u,r) in enumerate(zip(urban, rural)):
+        if valid(u) and valid(r):
+            points.append((FIRST_YEAR + i, u - r))
+        else:
+            points.append((FIRST_YEAR + i, MISSING))
+    return linefit.trend2, lambda: (points, 1950, 2)
+
+def setup_incircle(rnd):
+    # As many stations as there are in a GHCN-M v3 file, scattered
+    # uniformly over the globe.
+    records = []
+    for i in range(7280):
+        record = step2.Struct()
+        record.station = giss_data.Station(
+          lat=math.degrees(math.asin(rnd.uniform(-1, 1))),
+          lon=rnd.uniform(-180, 180))
+        records.append(record)
+    arc = parameters.gridding_radius / earth.radius
+    def incircle(*args):
+        # It is a generator; the work is done when it is consumed.
+        for _ in step3.incircle(*args):
+            pass
+    return incircle, lambda: (records, arc, 45.0, 10.0)
+
+def setup_get_longest_overlap(rnd):
+    target = giss_data.new_storage(monthly_series(rnd))
+    records = []
+    for i in range(4):
+        record = station_record(monthly_series(rnd))
+        record.uid = '9%010d%d' % (0, i)
+        record.ann_mean, ann_anoms = series.monthly_annual(record.series)
+        record.set_ann_anoms(ann_anoms)
+        records.append(record)
+    return step1.get_longest_overlap, lambda: (target, FIRST_YEAR, records)
+
+#: The kernels, in order, and the functions that set them up.
+KERNELS = [
+    ('series.combine', setup_combine),
+    ('series.anomalize', setup_anomalize),
+    ('series.monthly_annual', setup_monthly_annual),
+    ('step2.annual_anomaly', setup_annual_anomaly),
+    ('step2.cmbine', setup_cmbine),
+    ('linefit.trend2', setup_trend2),
+    ('step3.incircle', setup_incircle),
+    ('step1.get_longest_overlap', setup_get_longest_overlap),
+]
+
+#: The kernels whose inputs are made by `giss_data.new_storage`, or are
+#: station records, and so depend on *parameters.series_storage*.
+STORAGE_KERNELS = set([
+    'series.monthly_annual',
+    'step2.annual_anomaly',
+    'step1.get_longest_overlap',
+])
+
+def allocations(fn, args):
+    """The allocations made by a call of *fn* with *args* (see the
+    module docstring)."""
+
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.get_count()[0]
+        fn(*args)
+        return gc.get_count()[0] - before
+    finally:
+        gc.enable()
+
+def measure(fn, args, min_time):
+    """Measure calls of *fn*, each with the arguments returned by
+    *args*, for at least *min_time* seconds.  Returns a dict."""
+
+    times = []
+    total = 0.0
+    while total < min_time or len(times) < 5:
+        a = args()
+        started = timeit.default_timer()
+        fn(*a)
+        t = timeit.default_timer() - started
+        times.append(t)
+        total += t
+    times.sort()
+    median = times[len(times) // 2]
+    return dict(calls=len(times), best=times[0], median=median,
+      ops_per_sec=1.0 / median, allocations=allocations(fn, args()))
+
+def run(kernels, implementations, storages, min_time, seed):
+    """Measure each of *kernels* (names from `KERNELS`) with each of
+    *implementations*, and (for those in `STORAGE_KERNELS`) each of
+    *storages*.  Returns a list of dicts, one for each measurement;
+    the storage of a kernel that does not depend on it is None."""
+
+    setups = dict(KERNELS)
+    saved = series.implementation, parameters.series_storage
+    results = []
+    try:
+        for implementation in implementations:
+            series.use(implementation)
+            for name in kernels:
+                if name in STORAGE_KERNELS:
+                    kernel_storages = storages
+                else:
+                    kernel_storages = [None]
+                for storage in kernel_storages:
+                    parameters.series_storage = storage or saved[1]
+                    fn, args = setups[name](random.Random(seed))
+                    result = dict(kernel=name, implementation=implementation,
+                      storage=storage)
+                    result.update(measure(fn, args, min_time))
+                    results.append(result)
+    finally:
+        series.use(saved[0])
+        parameters.series_storage = saved[1]
+    return results
+
+def table(results, out):
+    """Write *results* (from `run`) to *out*, as a table."""
+
+    out.write("%-26s %-6s %-6s %12s %12s %8s\n" % ('kernel', 'impl',
+      'store', 'ops/sec', 'median(us)', 'allocs'))
+    for r in results:
+        out.write("%-26s %-6s %-6s %12.1f %12.1f %8d\n" % (r['kernel'],
+          r['implementation'], r['storage'] or '-', r['ops_per_sec'],
+          r['median'] * 1e6, r['allocations']))
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    kernels = [name for name,_ in KERNELS]
+    implementations = ['python']
+    if numpy is not None:
+        implementations.append('numpy')
+    storages = ['list', 'array']
+    min_time = 0.5
+    seed = 1
+    output = None
+    try:
+        opts, args = getopt.getopt(argv[1:], 'o:',
+          ['help', 'kernels=', 'implementations=', 'storage=', 'time=',
+           'seed='])
+        for o,a in opts:
+            if o == '--help':
+                print __doc__
+                return 0
+            if o == '--kernels':
+                kernels = a.split(',')
+                unknown = set(kernels) - set(dict(KERNELS))
+                if unknown:
+                    raise Usage("Unknown kernels: %s" %
+                      ', '.join(sorted(unknown)))
+            elif o == '--implementations':
+                implementations = a.split(',')
+                for name in implementations:
+                    if name not in series.implementations:
+                        raise Usage("Unknown implementation: %s" % name)
+                    if name == 'numpy' and numpy is None:
+                        raise Usage("NumPy is not installed.")
+            elif o == '--storage':
+                storages = a.split(',')
+                for name in storages:
+                    if name not in ('list', 'array'):
+                        raise Usage("Unknown storage: %s" % name)
+            elif o == '--time':
+                min_time = float(a)
+            elif o == '--seed':
+                seed = int(a)
+            elif o == '-o':
+                output = a
+        if args:
+            raise Usage("Unexpected arguments")
+    except (getopt.GetoptError, ValueError, Usage), e:
+        sys.stderr.write('%s\n' % e)
+        sys.stderr.write(__doc__)
+        return 2
+
+    results = run(kernels, implementations, storages, min_time, seed)
+    numpy_version = None
+    if numpy is not None:
+        numpy_version = numpy.__version__
+    report = dict(python=sys.version.split()[0], numpy=numpy_version,
+      seed=seed, years=YEARS, min_time=min_time, results=results)
+    if output:
+        f = open(output, 'w')
+        table(results, sys.stdout)
+    else:
+        f = sys.stdout
+    json.dump(report, f, indent=2, sort_keys=True)
+    f.write('\n')
+    if output:
+        f.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
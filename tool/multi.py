@@ -29,6 +29,7 @@ import urllib
 # Clear Climate Code
 import extend_path
 import gio
+from code import steplog
 from code.giss_data import valid, MISSING
 
 class Fatal(Exception):
@@ -108,7 +109,7 @@ def counts(out, dir='.', mask=None):
     step2 = os.path.join(dir, 'work', 'step2.v2')
 
     for row in stations_logged(mask, log=log):
-        stations = json.loads(row[2])
+        stations = row[2]
         for station,weight,months in stations:
             stationmonths[station] = monthset(months) | stationmonths.get(
               station, set())
@@ -234,16 +235,15 @@ def stations_logged(mask=None, log='log/step3.log'):
     *log* specifies the name of the log file to examine.
 
     Each log record is yielded as a triple (cellid, 'stations',
-    JSONstring).  *JSONstring* is a string suitable for passing to
-    json.loads().
+    *stations*), where *stations* is the list of [station, weight,
+    months] items.  The log can be in any of the formats described in
+    code/steplog.py.
     """
 
-    log = open(log)
     if mask:
         cells = cellsofmask(open(mask))
 
-    for row in log:
-        row = row.split(' ', 2)
+    for row in steplog.read(log):
         if row[1] != 'stations':
             continue
         if not mask or row[0] in cells:
@@ -256,7 +256,7 @@ def stations(out, log='log/step3.log', mask=None):
     station_months = dict()
     cellcount = 0
     for row in stations_logged(log=log, mask=mask):
-        stations = json.loads(row[2])
+        stations = row[2]
         for item in stations:
             station,weight,months = item[:3]
             if weight:
@@ -344,8 +344,8 @@ def cmpcontributors(arg):
     different log files.
     """
 
-    fs = map(open, arg[1:3])
-    stations = map(celldict, fs)
+    names = arg[1:3]
+    stations = map(celldict, names)
     if set(stations[0]) != set(stations[1]):
         print "Sets of cells differ"
     common = set(stations[0]) & set(stations[1])
@@ -364,8 +364,8 @@ def cmpcontributors(arg):
         if stationsa != stationsb:
             ina = seta - setb
             inb = setb - seta
-            reportinonelist(cell, fs[0].name, ina, dicta)
-            reportinonelist(cell, fs[1].name, inb, dicta)
+            reportinonelist(cell, names[0], ina, dicta)
+            reportinonelist(cell, names[1], inb, dicta)
             commonstations = seta & setb
             for station in commonstations:
                 if dicta[station] != dictb[station]:
@@ -388,20 +388,19 @@ def cmpcontributors(arg):
                   cell)
 
 
-def celldict(f):
-    """From the (open) step3.log file *f* return a dict that maps
+def celldict(path):
+    """From the step3.log file *path* return a dict that maps
     from box identifier (12 characters) to a list of (station,weight)
     pairs.
     """
 
     result = {}
-    for row in f:
-        row = row.split(' ', 2)
+    for row in steplog.read(path):
         # The 2nd item is 'stations' for step3.log and 'cells' for
         # step5.log.
         if row[1] not in ['stations', 'cells']:
             continue
-        stations = json.loads(row[2])
+        stations = row[2]
         pairs = [(t[0],t[1]) for t in stations]
         result[row[0]] = pairs
     return result
@@ -13,6 +13,25 @@ Options:
                   numbers from 0 to 5.  For example, --steps=2,3,5
                   The steps are run in the order you specify.
                   If this option is omitted, run all steps in order.
+   --cache        Reuse stored results of steps whose inputs have not
+                  changed (see stepcache.py).
+   --profile      Measure each step, and write the measurements to
+                  log/profile.json (see stepmetrics.py).
+   --cprofile     As --profile, and also profile each step with
+                  cProfile (saved in log/profile.stepN.pstats).
+   --corrections  For a re-run after corrections to a few station
+                  records: reuse the subboxes of the previous run's
+                  Step 3 whose stations have not changed (see
+                  corrections.py).  Not for a monthly update, which
+                  changes almost every subbox.
+   --corrections-check
+                  As --corrections, but recompute everything and check
+                  that it is the same as the reused results.
+   --stations=ID[,ID...], --country=CCC[,CCC...], --bbox=S,N,W,E
+                  Run on a selection of the stations only (Step 0 reads
+                  just their records, using an index of the GHCN-M
+                  input).  For example, --bbox=64,90,-180,180 for the
+                  Arctic.
 """
 
 # http://www.python.org/doc/2.4.4/lib/module-getopt.html
@@ -50,18 +69,19 @@ def mkdir(path):
 # Each of the run_stepN functions below takes a data object, its input,
 # and produces a data object, its output.  Ordinarily the data objects
 # are iterators, either produced from the previous step, or an iterator
-# that feeds from a file.
-def run_step0(data):
+# that feeds from a file.  They are also passed the command line
+# options.
+def run_step0(data, options):
     from code import step0
     import extension.step0
     if data is None:
-        data = gio.step0_input()
+        data = gio.step0_input(options.select)
     pre = extension.step0.pre_step0(data)
     result = step0.step0(pre)
     post = extension.step0.post_step0(result)
-    return gio.step0_output(post)
+    return gio.step0_output(computed(options, '0', post))
 
-def run_step1(data):
+def run_step1(data, options):
     from code import step1
     import extension.step1
     if data is None:
@@ -69,23 +89,29 @@ def run_step1(data):
     pre = extension.step1.pre_step1(data)
     result = step1.step1(pre)
     post = extension.step1.post_step1(result)
-    return gio.step1_output(post)
+    return gio.step1_output(computed(options, '1', post))
 
-def run_step2(data):
+def run_step2(data, options):
     from code import step2
     if data is None:
         data = gio.step2_input()
-    result = step2.step2(data)
-    return gio.step2_output(result)
+    result = step2.step2(data, jobs=options.jobs)
+    return gio.step2_output(computed(options, '2', result))
 
-def run_step3(data):
+def run_step3(data, options):
     from code import step3
     if data is None:
         data = gio.step3_input()
-    result = step3.step3(data)
-    return gio.step3_output(result)
-
-def run_step3c(data):
+    memo = None
+    if options.corrections:
+        import corrections
+        memo = corrections.Memo('step3', check=options.corrections_check)
+    result = step3.step3(data, jobs=options.jobs, memo=memo)
+    if memo:
+        result = save_memo(memo, result)
+    return gio.step3_output(computed(options, '3', result))
+
+def run_step3c(data, options):
     """An alternative to Step 3 that reads (copies) the output file
     created by the ordinary Step 3.  Effectively using the data produced
     by Step 3 without re-running it."""
@@ -93,24 +119,48 @@ def run_step3c(data):
         raise Fatal("Expect to run 3c first in pipeline.")
     return gio.step3c_input()
 
-def run_step4(data):
+def run_step4(data, options):
     from code import step4
     # Unlike earlier steps, Step 4 always gets input data, ocean
     # temperatures, from disk; data from earlier stages is land data and
     # is zipped up.
     data = gio.step4_input(data) 
     result = step4.step4(data)
-    return gio.step4_output(result)
+    return gio.step4_output(computed(options, '4', result))
 
-def run_step5(data):
+def run_step5(data, options):
     from code import step5
     # Step 5 takes a land mask as optional input, this is all handled in
     # the step5_input() function.
     data = gio.step5_input(data)
-    result = step5.step5(data)
+    if options.metrics:
+        # Step 5 computes all its results before they are written.
+        result = options.metrics.compute('5').call(step5.step5, data,
+          jobs=options.jobs)
+    else:
+        result = step5.step5(data, jobs=options.jobs)
     gio.step5_output(result)
     return vischeck(result)
 
+def computed(options, step, data):
+    """Return *data*, the records computed by *step* before they are
+    written; when profiling they are metered (see stepmetrics.py)."""
+
+    if options.metrics:
+        return options.metrics.compute(step).wrap(data)
+    return data
+
+def save_memo(memo, data):
+    """Pass on *data*, and then save *memo* (see corrections.py)."""
+
+    for item in data:
+        yield item
+    log("... corrections %s" % memo.summary())
+    if memo.mismatches:
+        raise Fatal("Reused results differ from a full run, for %s"
+          " %s." % (memo.name, ', '.join(memo.mismatches[:10])))
+    memo.save()
+
 def vischeck(data):
     # Suck data through pipeline.
     for _ in data:
@@ -163,13 +213,80 @@ def parse_options(arglist):
     parser.add_option("--no-work_files", "--suppress-work-files",
             action="store_false", default=True, dest="save_work",
             help="Do not save intermediate files in the work sub-directory")
+    parser.add_option("--cache", action="store_true", default=False,
+            help="Reuse the results of steps whose inputs, code, and "
+              "parameters are unchanged (stored in work/cache)")
+    parser.add_option("--profile", action="store_true", default=False,
+            help="Measure the time, records, memory, and I/O of each step"
+              " (written to log/profile.json)")
+    parser.add_option("--cprofile", action="store_true", default=False,
+            help="As --profile, and also profile each step with cProfile")
+    parser.add_option("--corrections", action="store_true", default=False,
+            help="After corrections to a few station records, reuse the"
+              " Step 3 subboxes whose stations are unchanged since the"
+              " previous run (stored in work/corrections); not for a"
+              " monthly update")
+    parser.add_option("--corrections-check", action="store_true",
+            default=False,
+            help="As --corrections, but check the reused results against"
+              " a full run")
+    parser.add_option("-j", "--jobs", action="store", type="int", default=1,
+            metavar="N",
+            help="Use N worker processes in Steps 2, 3, and 5")
+    parser.add_option("--stations", action="store", default="",
+            metavar="ID[,ID]",
+            help="Select stations by 11-digit identifier "
+              "(or @FILE, to read the identifiers from FILE)")
+    parser.add_option("--country", action="store", default="",
+            metavar="CCC[,CCC]",
+            help="Select stations by country code (identifier prefix)")
+    parser.add_option("--bbox", action="store", default="",
+            metavar="S,N,W,E",
+            help="Select stations within a latitude/longitude box")
     options, args = parser.parse_args(arglist)
     if len(args) != 0:
         parser.error("Unexpected arguments")
 
+    if options.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if options.corrections_check:
+        options.corrections = True
+    options.metrics = None
+    if options.profile or options.cprofile:
+        import stepmetrics
+        options.metrics = stepmetrics.Metrics(profile=options.cprofile)
+    options.select = parse_selection(options, parser)
     options.steps = parse_steps(options.steps)
     return options, args
 
+def parse_selection(options, parser):
+    """Parse the --stations, --country, and --bbox options.  Produces
+    a gio.StationSelection, or None when there is no selection."""
+
+    if not (options.stations or options.country or options.bbox):
+        return None
+    ids = options.stations
+    if ids.startswith('@'):
+        try:
+            ids = open(ids[1:]).read().split()
+        except IOError, e:
+            parser.error("Can't read station list: %s" % e)
+    else:
+        ids = [id for id in ids.split(',') if id]
+    for id in ids:
+        if not re.match(r'^\d{11}$', id):
+            parser.error("Station identifier %r is not 11 digits" % id)
+    prefixes = [p for p in options.country.split(',') if p]
+    bbox = None
+    if options.bbox:
+        try:
+            bbox = tuple(map(float, options.bbox.split(',')))
+        except ValueError:
+            bbox = ()
+        if len(bbox) != 4:
+            parser.error("--bbox must be 4 numbers: S,N,W,E")
+    return gio.StationSelection(ids, prefixes, bbox)
+
 def update_parameters(parm):
     """Take a parameter string from the command line and update the
     parameters module."""
@@ -248,6 +365,9 @@ def main(argv=None):
         cannot = [s for s in step_list if not step_fn.has_key(s)]
         if cannot:
             raise Fatal("Can't run steps %s" % str(cannot))
+        if options.select and '0' not in step_list:
+            raise Fatal("A selection of stations is only used by Step 0,"
+              " which is not being run.")
 
         # Create a message for stdout.
         if len(step_list) == 1:
@@ -263,18 +383,49 @@ def main(argv=None):
             else:
                 logit = "STEPS %s" % ', '.join(step_list)
         log("====> %s  ====" % logit)
+        cache = None
+        if options.cache:
+            import stepcache
+            cache = stepcache.StepCache(extra=str(options.select or ''))
         data = None
+        key = None
+        # True while all the steps so far have been found in the cache.
+        cached = bool(cache)
         for step in step_list:
-            data = step_fn[step](data)
+            if cache:
+                key = cache.key(step, key)
+                cached = cached and cache.has(key)
+            meter = None
+            if options.metrics:
+                meter = options.metrics.step(step, cached=cached)
+            if cached:
+                log("... using cached result of STEP %s" % step)
+                data = cache.replay(key)
+            else:
+                if meter:
+                    data = meter.call(step_fn[step], data, options)
+                else:
+                    data = step_fn[step](data, options)
+                if cache:
+                    data = cache.record(step, key, data)
+            if meter:
+                data = meter.wrap(data)
         # Consume the data in whatever the last step was, in order to
         # write its output, and hence suck data through the whole
         # pipeline.
-        for _ in data:
-            pass
+        if not cached:
+            for _ in data:
+                pass
+        if cache:
+            cache.commit()
 
         end_time = time.time()
         log("====> Timing Summary ====")
         log("Run took %.1f seconds" % (end_time - start_time))
+        if options.metrics:
+            path = os.path.join('log', 'profile.json')
+            options.metrics.write(path)
+            log("Measurements of each step written to %s" % path)
 
         return 0
     except Fatal, err:
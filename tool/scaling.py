@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# scaling.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""scaling.py [options]
+
+Measures how the time taken by each step of the GISTEMP algorithm
+scales with the number of stations, using synthetic input data (see
+`synthetic.py`), so it needs no network access.
+
+For each size a scratch tree is made (in ``work/scaling/N``) that
+links to the code of this tree, with its own ``input`` directory of
+synthetic data.  Steps 0 to 5 are run there, by `run.py` (with its
+--profile option) in a separate process, and the wall time, CPU time,
+and peak memory of each step are collected.  The measurements of all
+the sizes are written to ``work/scaling/scaling.json``, and compared
+with a stored baseline (``config/scaling_baseline.json``): for each
+step, the ratio of its time to the baseline's, and the exponent of its
+growth from one size to the next (1 is linear).  Any step that is
+slower than the baseline by more than the tolerance is reported, and
+makes the exit status 1.  Times depend on the machine, so the stored
+baseline is only a guide; store a baseline for your own machine with
+--save-baseline before changing the code.
+
+Options:
+   --help            Print this text.
+   --sizes N[,N]     The numbers of stations (default 1000,10000).
+   --years A-B       The range of years of the station data (default
+                     1880-2020).
+   --missing F       The fraction of missing monthly values (default
+                     0.1).
+   --format F        Either "v3" (the default) or "v2", for the generic
+                     ".v2" source path.
+   -p, --parameter P Parameters for run.py (as for its -p option).
+   -j, --jobs N      Worker processes for run.py (as for its -j option).
+   --baseline FILE   The baseline (default config/scaling_baseline.json).
+   --save-baseline   Store the measurements as the baseline.
+   --tolerance F     The fraction by which a step can be slower than
+                     the baseline (default 0.25).
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.4.4/lib/module-getopt.html
+import getopt
+# http://docs.python.org/release/2.6.8/library/json.html
+import json
+# http://docs.python.org/release/2.4.4/lib/module-math.html
+import math
+# http://docs.python.org/release/2.4.4/lib/module-os.html
+import os
+# http://docs.python.org/release/2.4.4/lib/module-shutil.html
+import shutil
+# http://docs.python.org/release/2.4.4/lib/module-subprocess.html
+import subprocess
+# http://docs.python.org/release/2.4.4/lib/module-sys.html
+import sys
+# http://docs.python.org/release/2.4.4/lib/module-time.html
+import time
+
+# Clear Climate Code
+import extend_path
+import synthetic
+
+SCALING_DIR = os.path.join('work', 'scaling')
+BASELINE = os.path.join('config', 'scaling_baseline.json')
+
+# The default range of years of the station data; it is fixed, so that
+# measurements stay comparable with the baseline.
+YEARS = (1880, 2020)
+
+# The directories of this tree that the scratch trees link to.
+LINKED = ['code', 'extension', 'parameters', 'tool']
+
+class Usage(Exception):
+    pass
+
+def make_tree(dir):
+    """Make a scratch tree in *dir*: it links to the code of this
+    tree, and has a ``config`` directory that fetches nothing."""
+
+    if os.path.isdir(dir):
+        shutil.rmtree(dir)
+    os.makedirs(os.path.join(dir, 'config'))
+    for name in LINKED:
+        os.symlink(os.path.abspath(name), os.path.join(dir, name))
+    os.symlink(os.path.abspath(os.path.join('config', 'step1_adjust')),
+      os.path.join(dir, 'config', 'step1_adjust'))
+    f = open(os.path.join(dir, 'config', 'sources'), 'w')
+    f.write("# Written by tool/scaling.py; the input is synthetic.\n")
+    f.close()
+
+def measure(stations, years, missing, format, parameter, jobs):
+    """Run Steps 0 to 5 on synthetic data for *stations* stations.
+    Returns a dict of the measurements."""
+
+    dir = os.path.join(SCALING_DIR, str(stations))
+    make_tree(dir)
+    started = time.time()
+    source = synthetic.generate(dir, stations=stations,
+      first_year=years[0], last_year=years[1], missing=missing,
+      format=format)
+    generated = time.time() - started
+    parameter = ';'.join(['data_sources=%s' % source] +
+      [p for p in parameter.split(';') if p])
+    out = open(os.path.join(dir, 'run.out'), 'w')
+    status = subprocess.call([sys.executable, os.path.join('tool', 'run.py'),
+      '--profile', '-j', str(jobs), '-p', parameter],
+      cwd=dir, stdout=out, stderr=subprocess.STDOUT)
+    out.close()
+    if status != 0:
+        raise Exception("run.py failed for %d stations; see %s" %
+          (stations, out.name))
+    report = json.load(open(os.path.join(dir, 'log', 'profile.json')))
+    steps = {}
+    for step in report['steps']:
+        steps[step['step']] = dict(wall=step['wall'], cpu=step['cpu'],
+          peak_rss_kb=step['peak_rss_kb'], records_out=step['records_out'])
+    return dict(stations=stations, generate_wall=generated,
+      wall=report['wall'], steps=steps)
+
+def exponent(small, large, step):
+    """The exponent *k* of the growth of the time of *step* from the
+    size *small* to the size *large* (both are measurements, as
+    returned by `measure`), on the assumption that time is
+    proportional to size**k.  None if it cannot be computed."""
+
+    if step not in small['steps']:
+        return None
+    t0 = small['steps'][step]['wall']
+    t1 = large['steps'][step]['wall']
+    if t0 <= 0 or t1 <= 0:
+        return None
+    return math.log(t1 / t0) / math.log(
+      float(large['stations']) / small['stations'])
+
+def compare(results, baseline, tolerance):
+    """Print a table of *results* (a list of measurements, as returned
+    by `measure`) compared with *baseline* (another such list, or
+    None).  Returns a list of the (*stations*, *step*) pairs that are
+    slower than the baseline by more than *tolerance*."""
+
+    old = {}
+    for m in baseline or []:
+        old[m['stations']] = m
+    slower = []
+    previous = None
+    print "%8s %4s %9s %9s %9s %8s %8s" % ('stations', 'step', 'wall',
+      'cpu', 'rss(MB)', 'baseline', 'exponent')
+    for m in results:
+        for step in sorted(m['steps']):
+            s = m['steps'][step]
+            rss = '-'
+            if s['peak_rss_kb'] is not None:
+                rss = '%.1f' % (s['peak_rss_kb'] / 1024.0)
+            ratio = '-'
+            if m['stations'] in old and step in old[m['stations']]['steps']:
+                t = old[m['stations']]['steps'][step]['wall']
+                if t > 0:
+                    ratio = '%.2f' % (s['wall'] / t)
+                    if s['wall'] / t > 1 + tolerance:
+                        slower.append((m['stations'], step))
+            growth = '-'
+            if previous:
+                k = exponent(previous, m, step)
+                if k is not None:
+                    growth = '%.2f' % k
+            print "%8d %4s %9.2f %9.2f %9s %8s %8s" % (m['stations'], step,
+              s['wall'], s['cpu'], rss, ratio, growth)
+        previous = m
+    return slower
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    sizes = [1000, 10000]
+    years = YEARS
+    missing = 0.1
+    format = 'v3'
+    parameter = ''
+    jobs = 1
+    baseline_path = BASELINE
+    save = False
+    tolerance = 0.25
+    try:
+        opts, args = getopt.getopt(argv[1:], 'p:j:',
+          ['help', 'sizes=', 'years=', 'missing=', 'format=', 'parameter=',
+           'jobs=', 'baseline=', 'save-baseline', 'tolerance='])
+        for o,a in opts:
+            if o == '--help':
+                print __doc__
+                return 0
+            if o == '--sizes':
+                sizes = map(int, a.split(','))
+            elif o == '--years':
+                years = synthetic.parse_years(a)
+            elif o == '--missing':
+                missing = float(a)
+            elif o == '--format':
+                if a not in ('v2', 'v3'):
+                    raise Usage("--format must be v2 or v3")
+                format = a
+            elif o in ('-p', '--parameter'):
+                parameter = a
+            elif o in ('-j', '--jobs'):
+                jobs = int(a)
+            elif o == '--baseline':
+                baseline_path = a
+            elif o == '--save-baseline':
+                save = True
+            elif o == '--tolerance':
+                tolerance = float(a)
+        if args:
+            raise Usage("Unexpected arguments")
+    except (getopt.GetoptError, ValueError, synthetic.Usage, Usage), e:
+        sys.stderr.write('%s\n' % e)
+        sys.stderr.write(__doc__)
+        return 2
+
+    rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if os.getcwd() != rootdir:
+        sys.stderr.write("Run scaling.py from the root directory of the"
+          " project, %s\n" % rootdir)
+        return 2
+
+    results = []
+    for stations in sorted(sizes):
+        print "Measuring %d stations..." % stations
+        results.append(measure(stations, years, missing, format,
+          parameter, jobs))
+    report = dict(python=sys.version.split()[0], years=list(years),
+      missing=missing, format=format, parameter=parameter, jobs=jobs,
+      sizes=results)
+    path = os.path.join(SCALING_DIR, 'scaling.json')
+    f = open(path, 'w')
+    json.dump(report, f, indent=2, sort_keys=True)
+    f.write('\n')
+    f.close()
+    print "Measurements written to %s" % path
+
+    baseline = None
+    if save:
+        shutil.copyfile(path, baseline_path)
+        print "Baseline written to %s" % baseline_path
+    elif os.path.exists(baseline_path):
+        baseline = json.load(open(baseline_path))
+        if (baseline['years'] != list(years) or
+          baseline['missing'] != missing or baseline['format'] != format):
+            print "The baseline (%s) is for different data;" \
+              " not comparing" % baseline_path
+            baseline = None
+        else:
+            baseline = baseline['sizes']
+    slower = compare(results, baseline, tolerance)
+    if slower:
+        for stations, step in slower:
+            print "Step %s is slower than the baseline for %d stations" % (
+              step, stations)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
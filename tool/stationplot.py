@@ -698,18 +698,24 @@ def from_lines(lines, scale=None):
     translated in the data arrays to BAD.
     """
 
+    # Clear Climate Code, tool directory
+    import gio
+
+    lines = list(lines)
+    if lines and len(lines[0]) == 116:
+        format = 'v3'
+        default_scale = 0.01
+    else:
+        format = 'v2'
+        default_scale = 0.1
+
     years = []
     # Year from previous line.
     prev = None
     # The previous line itself.
     prevline = None
-    for line in lines:
-        if len(line) == 116:
-            # GHCN-M v3
-            year = int(line[11:15])
-        else:
-            # GHCN-M v2
-            year = int(line[12:16])
+    for line,year,temps in gio.ghcnm_rows(lines, format,
+      scale or default_scale, missing=BAD):
         if prev == year:
             # There is one case where there are multiple lines for the
             # same year for a particular station.  Some versions
@@ -726,22 +732,6 @@ def from_lines(lines, scale=None):
 
         prev = year
         prevline = line
-        temps = []
-        for m in range(12):
-            if len(line) == 116:
-                # GHCN-M v3
-                datum = int(line[19+8*m:24+8*m])
-                default_scale = 0.01
-            else:
-                # GHCN-M v2
-                datum = int(line[16+5*m:21+5*m])
-                default_scale = 0.1
-            if datum == -9999:
-                datum = BAD
-            else:
-                # Convert to floating point and degrees C.
-                datum *= scale or default_scale
-            temps.append(datum)
         years.append((year, temps))
     return from_years(years)
 
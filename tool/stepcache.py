@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# stepcache.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""A cache of the results of the steps of the GISTEMP algorithm, used
+by `run.py`.
+
+The result of a step is stored under a key that is a hash of
+everything that the result depends on: the key of the step before it
+(or the contents of the files that it reads its input from, when it
+is the first step run); the contents of the ``input`` directory; the
+source code of the step and of the modules that it uses; and the values
+of the parameters used by the parts of that code that the step uses
+(see `step_sources`).  A result
+comprises the data that the step produces (which is passed to the next
+step) and the files that it writes (in the ``work``, ``log``, and
+``result`` directories).
+
+When a step is found in the cache it is not run.  Instead its files
+are restored from the cache, and its data are replayed into the next
+step.  The data are stored exactly (pickled), so the results are the
+same as those of a run without the cache.
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.4.4/lib/module-cPickle.html
+import cPickle
+# http://docs.python.org/release/2.4.4/lib/module-glob.html
+import glob
+# http://docs.python.org/release/2.4.4/lib/module-os.html
+import os
+# http://docs.python.org/release/2.4.4/lib/module-re.html
+import re
+# http://docs.python.org/release/2.4.4/lib/module-shutil.html
+import shutil
+# http://docs.python.org/release/2.4.4/lib/module-sys.html
+import sys
+# http://docs.python.org/release/2.4.4/lib/module-time.html
+import time
+# http://docs.python.org/release/2.4.4/lib/module-tokenize.html
+import tokenize
+try:
+    # http://docs.python.org/release/2.5.4/lib/module-hashlib.html
+    from hashlib import sha1
+except ImportError:
+    # Python 2.4
+    from sha import new as sha1
+
+# Clear Climate Code
+import extend_path
+import gio
+import parameters
+from code import steplog
+
+CACHE_DIR = os.path.join('work', 'cache')
+
+# The files (as glob patterns) written by each step.  %(ext)s is
+# replaced by the extension for parameters.work_file_format.
+STEP_FILES = {
+    '0': ['work/step0.%(ext)s', 'log/step0.log'],
+    '1': ['work/step1.%(ext)s', 'log/comb.log', 'log/pieces.log'],
+    '2': ['work/step2.%(ext)s', 'log/step2.log'],
+    '3': [gio.STEP3_OUT, 'work/step3.%(ext)s', 'log/step3.log'],
+    '3c': [],
+    '4': ['result/SBBX.HadR2'],
+    '5': ['result/*[a-z]BX.*', 'result/*ZON.*', 'result/*.txt',
+          'result/google-chart.url', 'work/step5mask', 'log/step5.log'],
+}
+
+# The files that each step reads its input from, when it is the first
+# step run.  See the stepN_input functions in gio.py.
+STEP_INPUTS = {
+    '0': [],
+    '1': ['work/step0.v2', 'work/step0.bin'],
+    '2': ['work/step1.v2', 'work/step1.bin'],
+    '3': ['work/step2.v2', 'work/step2.bin'],
+    '3c': [gio.STEP3_OUT],
+    '4': [gio.STEP3_OUT],
+    '5': [gio.STEP3_OUT, 'result/SBBX.HadR2'],
+}
+
+# The modules that the steps may import (in addition to tool/gio.py and
+# tool/run.py, which every step uses).
+MODULES = ['code/*.py', 'extension/*.py', 'tool/fort.py',
+  'tool/ghcnm_index.py', 'tool/vischeck.py']
+
+# Parameters whose value is the name of a file that is read: the
+# contents of the file, as well as its name, are part of the key.
+FILE_PARAMETERS = ['step5_mask']
+
+def digest_file(h, path):
+    """Update the hash object *h* with the contents of the file
+    *path* (and its name); a file that does not exist is hashed as
+    such."""
+
+    h.update('%r\n' % path)
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        h.update('missing\n')
+        return
+    while True:
+        block = f.read(1 << 20)
+        if not block:
+            break
+        h.update(block)
+    f.close()
+
+def definitions(text):
+    """Split *text*, the source of a module, into its top-level
+    statements.  Returns a pair (*named*, *rest*): *named* maps the
+    name of each function, class, and variable defined at the top level
+    to the text of its definition; *rest* is a list of the text of the
+    other statements (imports, for example)."""
+
+    lines = text.splitlines(True)
+    # The line number of the first line of each top-level statement.
+    starts = []
+    depth = 0
+    statement = True
+    for kind, string, (row, col), end, line in tokenize.generate_tokens(
+      iter(lines).next):
+        if kind == tokenize.INDENT:
+            depth += 1
+        elif kind == tokenize.DEDENT:
+            depth -= 1
+        elif kind == tokenize.NEWLINE:
+            statement = True
+        elif kind in (tokenize.COMMENT, tokenize.NL, tokenize.ENDMARKER):
+            pass
+        elif statement:
+            statement = False
+            if depth == 0:
+                starts.append(row - 1)
+    named = {}
+    rest = [''.join(lines[:starts[0]])]
+    for start, end in zip(starts, starts[1:] + [len(lines)]):
+        statement = ''.join(lines[start:end])
+        m = re.match(r'(?:def|class)\s+(\w+)|(\w+)\s*=[^=]', statement)
+        if m:
+            named[m.group(1) or m.group(2)] = statement
+        else:
+            rest.append(statement)
+    return named, rest
+
+def used(names, named):
+    """The names of the definitions in *named* (see `definitions`) that
+    are used, directly or indirectly, by code that uses *names*."""
+
+    result = set()
+    todo = [name for name in names if name in named]
+    while todo:
+        name = todo.pop()
+        if name in result:
+            continue
+        result.add(name)
+        todo.extend([n for n in re.findall(r'\w+', named[name])
+          if n in named])
+    return result
+
+def imported(text, paths):
+    """The modules, of the source files *paths*, that the source code
+    *text* imports, directly or through each other.  Returns a list of
+    (*path*, *text*) pairs."""
+
+    result = []
+    paths = list(paths)
+    while True:
+        statements = re.findall(r'^\s*(?:from|import)\s.*$', text, re.M)
+        names = set(re.findall(r'\w+', ' '.join(statements)))
+        new = [path for path in paths
+          if os.path.basename(path)[:-3] in names]
+        if not new:
+            return result
+        for path in new:
+            paths.remove(path)
+            module = open(path).read()
+            result.append((path, module))
+            text += module
+
+def step_sources(step):
+    """The source code that the result of *step* depends on.  Returns
+    a pair (*paths*, *text*): the source files, and the text of the
+    parts of them that the step uses.
+
+    Starting from the run_stepN function of tool/run.py for *step* (and
+    the rest of run.py, but not the functions for the other steps),
+    these are the modules that are imported and, of tool/gio.py, the
+    definitions that are used.
+    """
+
+    named, rest = definitions(open('tool/run.py').read())
+    for name in list(named):
+        if re.match(r'run_step', name) and name != 'run_step' + step:
+            del named[name]
+    text = ''.join(rest)
+    text += ''.join([named[name]
+      for name in sorted(used(re.findall(r'\w+', text), named))])
+
+    gio_named, rest = definitions(open('tool/gio.py').read())
+    text += ''.join(rest)
+
+    paths = []
+    for pattern in MODULES:
+        paths.extend(sorted(glob.glob(pattern)))
+    modules = imported(text, paths)
+    text += ''.join([module for path,module in modules])
+
+    uses = ''.join([gio_named[name] for name in
+      sorted(used(re.findall(r'\bgio\.(\w+)', text), gio_named))])
+    more = imported(uses, [path for path in paths
+      if path not in dict(modules)])
+    modules += more
+    text += uses + ''.join([module for path,module in more])
+
+    paths = ['tool/gio.py', 'tool/run.py'] + [path for path,_ in modules]
+    paths.sort()
+    return paths, text
+
+def source_files(step):
+    """The source files that the result of *step* depends on."""
+
+    return step_sources(step)[0]
+
+def parameter_names(text):
+    """The names of the parameters that are used in the source code
+    *text* (that is, any name of the form ``parameters.name``)."""
+
+    names = set(re.findall(r'parameters\.(\w+)', text))
+    return [name for name in sorted(names) if hasattr(parameters, name)]
+
+def step_parameters(step):
+    """The names of the parameters that the result of *step* depends
+    on: those used in the parts of the source that it uses (see
+    `step_sources`)."""
+
+    return parameter_names(step_sources(step)[1])
+
+def flush_logs():
+    """Flush the log files of the step modules, so that they can be
+    copied."""
+
+    steplog.flush_all()
+    for name,module in sys.modules.items():
+        if not re.search(r'(^|\.)step\d$', name) or module is None:
+            continue
+        for value in vars(module).values():
+            if isinstance(value, file) and not value.closed:
+                value.flush()
+
+
+class StepCache(object):
+    """The cache of step results, in the directory *dir*.
+
+    `key` computes the key for a step.  A result is replayed with
+    `replay`, and recorded with `record`.  `commit` restores the files
+    of the replayed results and writes the recorded results to the
+    cache; it should only be called once the whole run has completed.
+    """
+
+    def __init__(self, dir=CACHE_DIR, extra=''):
+        self.dir = dir
+        # Included in every key; describes anything else (such as a
+        # selection of stations) that the results depend on.
+        self.extra = extra
+        if not os.path.isdir(dir):
+            os.makedirs(dir)
+        # Files modified after this time were written by this run.
+        self.start = time.time() - 1
+        self._input_digest = None
+        # A list of (step, key) pairs for results being recorded.
+        self.pending = []
+        # A list of the keys of results that have been replayed.
+        self.replayed = []
+
+    def input_digest(self):
+        """A digest of the contents of the ``input`` directory (not
+        counting the indexes made by ghcnm_index.py)."""
+
+        if self._input_digest is None:
+            h = sha1()
+            for dirpath, dirnames, filenames in os.walk('input'):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.endswith('.index'):
+                        continue
+                    digest_file(h, os.path.join(dirpath, name))
+            self._input_digest = h.hexdigest()
+        return self._input_digest
+
+    def key(self, step, upstream):
+        """The key for the result of *step*.  *upstream* is the key of
+        the step before it, or None if it is the first step run."""
+
+        h = sha1()
+        h.update('step %s\n' % step)
+        if upstream is None:
+            for path in STEP_INPUTS[step]:
+                digest_file(h, path)
+        else:
+            h.update('upstream %s\n' % upstream)
+        h.update('input %s\n' % self.input_digest())
+        h.update('extra %s\n' % self.extra)
+        for path in source_files(step):
+            digest_file(h, path)
+        for name in step_parameters(step):
+            value = getattr(parameters, name)
+            h.update('%s=%r\n' % (name, value))
+            if name in FILE_PARAMETERS and value:
+                digest_file(h, value)
+        return h.hexdigest()
+
+    def path(self, key, *rest):
+        return os.path.join(self.dir, key, *rest)
+
+    def has(self, key):
+        return os.path.isdir(self.path(key))
+
+    def replay(self, key):
+        """Return an iterator of the data of the result stored under
+        *key*.  Its files are restored by `commit`.
+        """
+
+        self.replayed.append(key)
+        return self._load(key)
+
+    def _load(self, key):
+        f = open(self.path(key, 'data'), 'rb')
+        unpickler = cPickle.Unpickler(f)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                break
+        f.close()
+
+    def record(self, step, key, data):
+        """Record the result of *step* under *key*: *data* is the
+        iterator of its data, which is returned (as a fresh iterator
+        that stores each item as it goes by)."""
+
+        tmp = self.path(key + '.tmp')
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        self.pending.append((step, key))
+        return self._store(tmp, data)
+
+    def _store(self, tmp, data):
+        f = open(os.path.join(tmp, 'data'), 'wb')
+        pickler = cPickle.Pickler(f, 2)
+        for item in data:
+            pickler.dump(item)
+            # Each item is stored independently; otherwise the pickler
+            # keeps every item alive.
+            pickler.clear_memo()
+            yield item
+        f.close()
+
+    def commit(self):
+        """Restore the files of the results that have been replayed,
+        and write the results that have been recorded to the cache.
+
+        The files are restored last of all because the steps that were
+        run may have overwritten them; for example, importing a step
+        module truncates its log file.
+        """
+
+        for key in self.replayed:
+            files = self.path(key, 'files')
+            for dirpath, dirnames, filenames in os.walk(files):
+                for name in filenames:
+                    src = os.path.join(dirpath, name)
+                    dst = src[len(files)+1:]
+                    if not os.path.isdir(os.path.dirname(dst)):
+                        os.makedirs(os.path.dirname(dst))
+                    shutil.copyfile(src, dst)
+        self.replayed = []
+
+        flush_logs()
+        ext = gio.choose_writer()[1]
+        for step, key in self.pending:
+            tmp = self.path(key + '.tmp')
+            if self.has(key):
+                shutil.rmtree(tmp)
+                continue
+            for pattern in STEP_FILES[step]:
+                for src in glob.glob(pattern % dict(ext=ext)):
+                    if os.path.getmtime(src) < self.start:
+                        # Not written by this run.
+                        continue
+                    dst = os.path.join(tmp, 'files', src)
+                    if not os.path.isdir(os.path.dirname(dst)):
+                        os.makedirs(os.path.dirname(dst))
+                    shutil.copyfile(src, dst)
+            os.rename(tmp, self.path(key))
+        self.pending = []
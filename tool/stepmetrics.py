@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# stepmetrics.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""Metrics for the steps of the GISTEMP algorithm, used by `run.py`
+(with its --profile option).
+
+The steps are chained generators, so the work of a step is done
+whenever the next step asks it for a record.  A `Meter` measures an
+iterator by timing each call of its next method; that includes the
+work of every earlier step that it asks for a record.  So each step
+is measured twice: the `Meter` for the step measures the iterator that
+the step returns (which includes writing its output, with the
+writers in gio.py), and its "compute" `Meter` measures the records it
+computes, before they are written.  The time for the step alone is the
+time of its `Meter` less the time of the previous step's `Meter`; the
+time for its output is the time of its `Meter` less the time of its
+compute `Meter`.
+
+`Metrics.report` returns the measurements for each step (wall and CPU
+time, counts of records in and out, a histogram of the time taken
+for each record, peak resident set size, and bytes read and
+written), which `Metrics.write` writes as JSON.  Optionally, each step
+is profiled with cProfile, and the profile is saved by
+`Metrics.write`; the profile of a step excludes the earlier steps.
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.6.8/library/cprofile.html
+import cProfile
+# http://docs.python.org/release/2.6.8/library/json.html
+import json
+# http://docs.python.org/release/2.4.4/lib/module-os.html
+import os
+# http://docs.python.org/release/2.4.4/lib/module-sys.html
+import sys
+# http://docs.python.org/release/2.4.4/lib/module-time.html
+import time
+try:
+    # http://docs.python.org/release/2.4.4/lib/module-resource.html
+    import resource
+except ImportError:
+    # Not Unix.
+    resource = None
+
+# The upper bounds, in seconds, of the buckets of the histogram of the
+# time taken for each record.  The last bucket has no upper bound.
+BUCKETS = [1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0]
+
+def usage():
+    """A pair of (*cpu*, *maxrss*): the CPU time (user and system, of
+    this process and its finished child processes), and the peak
+    resident set size in kilobytes (None when it is not known)."""
+
+    if resource is None:
+        t = os.times()
+        return t[0] + t[1] + t[2] + t[3], None
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    maxrss = own.ru_maxrss
+    if sys.platform == 'darwin':
+        # In bytes, not kilobytes.
+        maxrss //= 1024
+    return cpu, maxrss
+
+
+class IOCounter(object):
+    """Counts of the bytes read and written by this process, from
+    ``/proc/self/io`` (on Linux); elsewhere the counts are None."""
+
+    def __init__(self):
+        try:
+            self.f = open('/proc/self/io')
+        except IOError:
+            self.f = None
+        # The size of the last read of the counts, which is itself
+        # counted as bytes read.
+        self.own = 0
+
+    def sample(self):
+        """A pair of (*read*, *written*) byte counts."""
+
+        if self.f is None:
+            return None, None
+        self.f.seek(0)
+        text = self.f.read()
+        counts = dict(line.split(':') for line in text.splitlines())
+        read = int(counts['rchar']) - self.own
+        self.own += len(text)
+        return read, int(counts['wchar'])
+
+
+class Meter(object):
+    """Measures the work done by an iterator (see `wrap`), or a
+    function (see `call`).  The measurements accumulate in *wall*,
+    *cpu*, *read*, *written*, *items* (the number of items produced),
+    *histogram* (a count for each of the `BUCKETS`), and *maxrss* (the
+    peak resident set size when last measured).
+
+    If *profile* is True the work is also profiled with cProfile
+    (excluding the work of any other profiled `Meter` that it calls).
+    """
+
+    def __init__(self, name, io, profile=False):
+        self.name = name
+        self.io = io
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.read = 0
+        self.written = 0
+        self.items = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+        self.maxrss = None
+        self.profile = None
+        if profile:
+            self.profile = cProfile.Profile()
+
+    def start(self):
+        if self.profile:
+            if Meter.profiling:
+                Meter.profiling[-1].disable()
+            Meter.profiling.append(self.profile)
+            self.profile.enable()
+        cpu, _ = usage()
+        read, written = self.io.sample()
+        return time.time(), cpu, read, written
+
+    def stop(self, started):
+        """Accumulate the work done since `start` returned *started*;
+        returns the wall time taken."""
+
+        now = time.time()
+        cpu, maxrss = usage()
+        read, written = self.io.sample()
+        if self.profile:
+            self.profile.disable()
+            Meter.profiling.pop()
+            if Meter.profiling:
+                Meter.profiling[-1].enable()
+        wall = now - started[0]
+        self.wall += wall
+        self.cpu += cpu - started[1]
+        if read is not None:
+            self.read += read - started[2]
+            self.written += written - started[3]
+        else:
+            self.read = self.written = None
+        self.maxrss = maxrss
+        return wall
+
+    def wrap(self, iterable):
+        """An iterator of the items of *iterable*, measuring the
+        production of each one."""
+
+        iterator = iter(iterable)
+        while True:
+            started = self.start()
+            try:
+                item = iterator.next()
+            except StopIteration:
+                self.stop(started)
+                return
+            wall = self.stop(started)
+            self.items += 1
+            for i,bound in enumerate(BUCKETS):
+                if wall <= bound:
+                    break
+            else:
+                i = len(BUCKETS)
+            self.histogram[i] += 1
+            yield item
+
+    def call(self, fn, *args, **kwargs):
+        """Call *fn*, measuring the work it does."""
+
+        started = self.start()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.stop(started)
+
+# The stack of profiles that are enabled; only the last is actually
+# enabled (see `Meter.start`).
+Meter.profiling = []
+
+
+class Metrics(object):
+    """The meters for the steps of a run.  If *profile* is True, each
+    step is also profiled with cProfile.
+    """
+
+    def __init__(self, profile=False):
+        self.io = IOCounter()
+        self.profile = profile
+        # A list of (step, meter, compute) triples, in order; compute
+        # is a list of the step's compute meter (if it has one).
+        self.steps = []
+        self.started = time.time()
+
+    def step(self, step, cached=False):
+        """The meter for *step*; it should be used for the call of the
+        step's function, and the iterator that it returns."""
+
+        meter = Meter(step, self.io, profile=self.profile)
+        meter.cached = cached
+        self.steps.append((step, meter, []))
+        return meter
+
+    def compute(self, step):
+        """The compute meter for *step* (which should be the step most
+        recently metered); it should be used for the records that
+        *step* computes, before they are written."""
+
+        assert self.steps[-1][0] == step
+        meter = Meter(step + ' compute', self.io)
+        self.steps[-1][2].append(meter)
+        return meter
+
+    def report(self):
+        """The measurements, as a dict (that can be converted to
+        JSON)."""
+
+        result = []
+        previous = None
+        for step, meter, compute in self.steps:
+            d = dict(step=step, cached=meter.cached,
+              wall=meter.wall, cpu=meter.cpu,
+              read=meter.read, written=meter.written,
+              records_out=meter.items,
+              peak_rss_kb=meter.maxrss,
+              latency_histogram=[[bound, count] for bound,count in
+                zip(BUCKETS + [None], meter.histogram)])
+            if previous:
+                d['records_in'] = previous.items
+                d['wall'] -= previous.wall
+                d['cpu'] -= previous.cpu
+                if meter.read is not None:
+                    d['read'] -= previous.read
+                    d['written'] -= previous.written
+            else:
+                d['records_in'] = None
+            if compute:
+                compute, = compute
+                d['output_wall'] = meter.wall - compute.wall
+                d['output_cpu'] = meter.cpu - compute.cpu
+            result.append(d)
+            previous = meter
+
+        cpu, maxrss = usage()
+        return dict(argv=sys.argv, python=sys.version.split()[0],
+          started=time.strftime('%Y-%m-%dT%H:%M:%S',
+            time.localtime(self.started)),
+          wall=time.time() - self.started, cpu=cpu, peak_rss_kb=maxrss,
+          steps=result)
+
+    def write(self, path):
+        """Write the report to *path*, as JSON; and, if the steps were
+        profiled, each step's profile to *path* with the extension
+        replaced by ``.stepN.pstats``."""
+
+        f = open(path, 'w')
+        json.dump(self.report(), f, indent=2, sort_keys=True)
+        f.write('\n')
+        f.close()
+        base = os.path.splitext(path)[0]
+        for step, meter, _ in self.steps:
+            if meter and meter.profile:
+                meter.profile.dump_stats('%s.step%s.pstats' % (base, step))
@@ -47,8 +47,8 @@ def cmp(a, b, dt=1e-4, dd=0.5, output=sys.stdout, error=sys.stderr):
     # Width of a float
     wf = len(struct.pack('f', 0.0))
 
-    a = fort.File(a)
-    b = fort.File(b)
+    a = fort.MappedFile(a)
+    b = fort.MappedFile(b)
 
     ra = a.readline()
     rb = b.readline()
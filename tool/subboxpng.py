@@ -36,7 +36,7 @@ import png
 # Clear Climate Code
 import extend_path
 from code import eqarea
-from code.giss_data import MISSING
+from code.giss_data import BASE_YEAR, MISSING
 import gio
 
 def topng(inp, date=None):
@@ -107,17 +107,13 @@ def extractdate(inp, cells, date):
 
     year,month = map(int, date.split('-'))
 
-    records = iter(gio.SubboxReader(inp))
-    meta = records.next()
-    base_year = meta.yrbeg
+    reader = gio.SubboxReader(inp)
+    base_year = reader.meta.yrbeg
+    # The series read from a subbox file all start in BASE_YEAR.
+    assert base_year == BASE_YEAR
     # Index of required month in the record series.
     i = (year - base_year)*12 + month - 1
-    for record,box in itertools.izip(records, cells):
-        assert record.first_year == base_year
-        if i >= len(record.series):
-            yield MISSING, box
-        else:
-            yield record.series[i], box
+    return itertools.izip(reader.month(i), cells)
 
 def colourscale(v):
     """Convert value *v* to a colour scale."""
@@ -102,7 +102,7 @@ def totext(file, output=sys.stdout, log=sys.stderr, metaonly=False,
     # replaced.
     fmt = '%%0%dx' % (2*w)
 
-    f = fort.File(file, bos=bos)
+    f = fort.MappedFile(file, bos=bos)
 
     r = f.readline()
 
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# sweep.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""sweep.py [options]
+
+Runs the GISTEMP algorithm for every combination of some alternative
+values of the parameters (a *sweep*), doing the work that the variants
+have in common only once.
+
+Each --axis gives alternatives for some of the parameters, separated
+by "|"; each alternative is written as for the -p option of run.py (an
+empty alternative leaves the parameters alone).  The variants are all
+the combinations of one alternative from each axis.  For example:
+
+  tool/sweep.py --axis "gridding_radius=250|gridding_radius=1200" \\
+    --axis "step5_mask=|step5_mask=input/step5mask"
+
+runs 4 variants.
+
+The result of a step depends only on some of the parameters (see
+stepcache.py); for example, the results of Steps 0, 1, and 2 do not
+depend on gridding_radius, so the variants above all have the same
+results for those steps.  For each variant, the key of the result of
+each step in the step cache is worked out (without running anything),
+and the variants whose first steps have the same keys share the
+results of those steps.  This makes a tree: each result that is
+shared by several variants is computed once, by a run of run.py (with
+--cache) that stops after the last step that they share, and the runs
+for the variants (or for the next results shared by some of them)
+replay it from the cache.  Runs that do not depend on each other are
+run at the same time, in separate processes.  A shared result that is
+already in the cache is not computed again.
+
+Each variant is run in its own directory, work/sweep/NAME (by
+default), which links to the code, configuration, and input of this
+tree; its result and log directories are its own.  The variants are
+listed, with their parameters, in work/sweep/sweep.json.
+
+Options:
+   --help             Print this text.
+   --axis A           Alternatives for some parameters (see above); it
+                      can be given more than once.
+   -p, --parameter P  Parameters for every variant (as for run.py -p).
+   -s, --steps S      The steps to run (as for run.py -s; default 0 to
+                      5).
+   -j, --jobs N       The number of runs to run at once (default 1).
+   --dir D            The directory of the variants (default
+                      work/sweep).
+   -n, --dry-run      Print the runs, but do not run them.
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.4.4/lib/module-getopt.html
+import getopt
+# http://docs.python.org/release/2.6.8/library/json.html
+import json
+# http://docs.python.org/release/2.4.4/lib/module-os.html
+import os
+# http://docs.python.org/release/2.4.4/lib/module-shutil.html
+import shutil
+# http://docs.python.org/release/2.4.4/lib/module-subprocess.html
+import subprocess
+# http://docs.python.org/release/2.4.4/lib/module-sys.html
+import sys
+# http://docs.python.org/release/2.4.4/lib/module-time.html
+import time
+
+# Clear Climate Code
+import extend_path
+import parameters
+import run
+import stepcache
+
+SWEEP_DIR = os.path.join('work', 'sweep')
+
+# The directories of this tree that the directory of a run links to.
+LINKED = ['code', 'config', 'extension', 'input', 'parameters', 'tool']
+
+class Usage(Exception):
+    pass
+
+def parse_axis(s):
+    """Parse an --axis option.  Returns a list of the alternatives (each
+    a string, in the syntax of run.py's -p option)."""
+
+    alternatives = s.split('|')
+    for alternative in alternatives:
+        for p in alternative.split(';'):
+            if not p:
+                continue
+            if '=' not in p:
+                raise Usage("Can't understand parameter %r in --axis" % p)
+            name = p.split('=', 1)[0]
+            if not hasattr(parameters, name):
+                raise Usage("Unknown parameter %r in --axis" % name)
+    return alternatives
+
+def join(*parameter):
+    """Join parameter strings (as for run.py's -p option)."""
+
+    return ';'.join([p for p in parameter if p])
+
+def make_variants(axes, common):
+    """The variants for the list *axes* (each a list of alternatives),
+    with the parameters *common*.  Returns a list of (*name*,
+    *parameter*) pairs: the name is "v" followed by the index of each
+    alternative."""
+
+    variants = [('v', common)]
+    for i,alternatives in enumerate(axes):
+        if i:
+            sep = '-'
+        else:
+            sep = ''
+        variants = [(name + sep + str(j), join(parameter, alternative))
+          for name,parameter in variants
+          for j,alternative in enumerate(alternatives)]
+    return variants
+
+def step_keys(cache, steps, parameter):
+    """The keys, in *cache* (a stepcache.StepCache), of the results of
+    *steps* when run with *parameter*."""
+
+    saved = vars(parameters).copy()
+    try:
+        run.update_parameters(parameter)
+        keys = []
+        key = None
+        for step in steps:
+            key = cache.key(step, key)
+            keys.append(key)
+        return keys
+    finally:
+        vars(parameters).update(saved)
+
+def plan(variants, keys, steps, cache, dir):
+    """Plan the runs for *variants* (see `make_variants`); *keys* is a
+    dict that maps the name of each variant to the keys of its
+    results (see `step_keys`).  Returns a list of runs, each one
+    after the run that it depends on (if any).  A run is a dict, of: 'name';
+    'dir', its directory; 'parameter'; 'steps', the steps it runs;
+    'after', the name of the run that it depends on (or None); and
+    'variants', the names of the variants that use its results.
+    """
+
+    n = len(steps)
+    # The number of variants that have each sequence of leading
+    # results (a tuple of keys).
+    count = {}
+    for name,_ in variants:
+        for i in range(n):
+            prefix = tuple(keys[name][:i+1])
+            count[prefix] = count.get(prefix, 0) + 1
+    runs = []
+    # Maps each sequence of leading results that is computed by a
+    # shared run to the run (None when it is already in the cache).
+    shared = {}
+    for name,parameter in variants:
+        after = None
+        for i in range(n):
+            prefix = tuple(keys[name][:i+1])
+            if i < n-1:
+                following = count[tuple(keys[name][:i+2])]
+            else:
+                following = 0
+            # Compute a result once if it is shared by some variants,
+            # and it is the last result that some of them share.
+            if count[prefix] < 2 or count[prefix] == following:
+                continue
+            if prefix not in shared:
+                shared[prefix] = None
+                if not cache.has(prefix[-1]):
+                    label = 'step%s-%s' % (steps[i], prefix[-1][:10])
+                    shared[prefix] = dict(name=label,
+                      dir=os.path.join(dir, 'shared', label),
+                      parameter=parameter, steps=steps[:i+1], after=after,
+                      variants=[])
+                    runs.append(shared[prefix])
+            if shared[prefix]:
+                shared[prefix]['variants'].append(name)
+                after = shared[prefix]['name']
+        runs.append(dict(name=name, dir=os.path.join(dir, name),
+          parameter=parameter, steps=steps, after=after, variants=[name]))
+    return runs
+
+def make_tree(dir, first):
+    """Make the directory *dir* for a run: it links to this tree, and
+    to its step cache, and has copies of the files that step *first*
+    reads its input from."""
+
+    if os.path.isdir(dir):
+        shutil.rmtree(dir)
+    os.makedirs(os.path.join(dir, 'work'))
+    for name in LINKED:
+        os.symlink(os.path.abspath(name), os.path.join(dir, name))
+    os.symlink(os.path.abspath(stepcache.CACHE_DIR),
+      os.path.join(dir, stepcache.CACHE_DIR))
+    for path in stepcache.STEP_INPUTS[first]:
+        if os.path.exists(path):
+            dst = os.path.join(dir, path)
+            if not os.path.isdir(os.path.dirname(dst)):
+                os.makedirs(os.path.dirname(dst))
+            shutil.copyfile(path, dst)
+
+def start(r):
+    """Start the run *r* (see `plan`).  Returns the subprocess.Popen
+    instance."""
+
+    make_tree(r['dir'], r['steps'][0])
+    out = open(os.path.join(r['dir'], 'run.out'), 'w')
+    args = [sys.executable, os.path.join('tool', 'run.py'), '--cache',
+      '-s', ','.join(r['steps'])]
+    if r['parameter']:
+        args.extend(['-p', r['parameter']])
+    try:
+        return subprocess.Popen(args, cwd=r['dir'], stdout=out,
+          stderr=subprocess.STDOUT)
+    finally:
+        out.close()
+
+def execute(runs, jobs):
+    """Do the *runs* (see `plan`), *jobs* of them at a time, each as
+    soon as the run that it depends on has finished.  The status and
+    wall time of each run are stored in it ('status' is None for a run
+    that was not done because the run it depends on failed).  Returns
+    True if all the runs succeeded."""
+
+    pending = list(runs)
+    running = []
+    status = {None: 0}
+    while pending or running:
+        for r in list(pending):
+            if r['after'] not in status:
+                continue
+            if status[r['after']] != 0:
+                pending.remove(r)
+                r['status'] = status[r['name']] = None
+                print "%s: not run, because %s failed" % (r['name'],
+                  r['after'])
+            elif len(running) < jobs:
+                pending.remove(r)
+                print "%s: running steps %s" % (r['name'],
+                  ','.join(r['steps']))
+                r['started'] = time.time()
+                running.append((r, start(r)))
+        for item in list(running):
+            r, process = item
+            code = process.poll()
+            if code is None:
+                continue
+            running.remove(item)
+            r['wall'] = time.time() - r['started']
+            r['status'] = status[r['name']] = code
+            if code:
+                print "%s: failed; see %s" % (r['name'],
+                  os.path.join(r['dir'], 'run.out'))
+            else:
+                print "%s: done in %.1f seconds" % (r['name'], r['wall'])
+        time.sleep(0.1)
+    return not [r for r in runs if r['status'] != 0]
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    axes = []
+    common = ''
+    steps = ''
+    jobs = 1
+    dir = SWEEP_DIR
+    dry_run = False
+    try:
+        opts, args = getopt.getopt(argv[1:], 'p:s:j:n',
+          ['help', 'axis=', 'parameter=', 'steps=', 'jobs=', 'dir=',
+           'dry-run'])
+        for o,a in opts:
+            if o == '--help':
+                print __doc__
+                return 0
+            if o == '--axis':
+                axes.append(parse_axis(a))
+            elif o in ('-p', '--parameter'):
+                common = join(common, a)
+            elif o in ('-s', '--steps'):
+                steps = a
+            elif o in ('-j', '--jobs'):
+                jobs = int(a)
+                if jobs < 1:
+                    raise Usage("--jobs must be at least 1")
+            elif o == '--dir':
+                dir = a
+            elif o in ('-n', '--dry-run'):
+                dry_run = True
+        if args:
+            raise Usage("Unexpected arguments")
+        if not axes:
+            raise Usage("Give at least one --axis")
+        steps = run.parse_steps(steps)
+    except (getopt.GetoptError, ValueError, Usage, run.Fatal), e:
+        sys.stderr.write('%s\n' % e)
+        sys.stderr.write(__doc__)
+        return 2
+
+    rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if os.getcwd() != rootdir:
+        sys.stderr.write("Run sweep.py from the root directory of the"
+          " project, %s\n" % rootdir)
+        return 2
+
+    # Fetch the input once, here, rather than in every run.
+    import fetch
+    fetch.Fetcher().fetch()
+
+    variants = make_variants(axes, common)
+    cache = stepcache.StepCache()
+    keys = {}
+    try:
+        for name,parameter in variants:
+            keys[name] = step_keys(cache, steps, parameter)
+    except run.Fatal, e:
+        sys.stderr.write('%s\n' % e)
+        return 2
+    runs = plan(variants, keys, steps, cache, dir)
+    shared = len(runs) - len(variants)
+    print "%d variants, %d shared runs" % (len(variants), shared)
+    for r in runs:
+        after = ''
+        if r['after']:
+            after = ' after %s' % r['after']
+        print "%s: steps %s%s; %s" % (r['name'], ','.join(r['steps']),
+          after, r['parameter'] or 'default parameters')
+    if dry_run:
+        return 0
+
+    if not os.path.isdir(dir):
+        os.makedirs(dir)
+    ok = execute(runs, jobs)
+    report = dict(parameter=common, steps=steps,
+      variants=[dict(name=name, parameter=parameter,
+        dir=os.path.join(dir, name), keys=keys[name])
+        for name,parameter in variants],
+      runs=[dict(name=r['name'], steps=r['steps'], after=r['after'],
+        status=r['status'], wall=r.get('wall'))
+        for r in runs])
+    path = os.path.join(dir, 'sweep.json')
+    f = open(path, 'w')
+    json.dump(report, f, indent=2, sort_keys=True)
+    f.write('\n')
+    f.close()
+    print "Variants listed in %s" % path
+    if not ok:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# $URL$
+# $Rev$
+#
+# synthetic.py
+#
+# Clear Climate Code, 2026-10-17
+
+"""synthetic.py [options] DIRECTORY
+
+Writes a synthetic set of input files, for benchmarking the GISTEMP
+algorithm (see `scaling.py`), to the ``input`` directory under
+DIRECTORY.  The files are: a GHCN-M v3 ``ghcnm.tavg.qca.dat`` and
+``v3.inv`` (or, with --format v2, a generic source ``synth.v2.mean``
+and ``synth.v2.inv``); an ocean subbox file ``SBBX.HadR2``, which
+ends a year before the station data; the ``oiv2mon.YYYYMM`` files for
+the months of that last year; the climatology
+``oisstv2_mod4.clim``; and an empty ``Ts.strange.v3.list.IN_full``.
+
+The stations are scattered uniformly over the globe, with records of
+varying length, and the data are a seasonal cycle plus a trend plus
+noise.  The data are not realistic, but they are generated from
+*--seed*, so the same options always write the same files.
+
+Options:
+   --help            Print this text.
+   --stations N      The number of stations (default 1000).
+   --years A-B       The range of years of the station data (default
+                     1880 to last year).
+   --missing F       The fraction of monthly values that are missing
+                     (default 0.1).
+   --format F        Either "v3" (the default) or "v2".
+   --seed S          The seed for the random numbers (default 1).
+"""
+__docformat__ = "restructuredtext"
+
+# http://docs.python.org/release/2.4.4/lib/module-getopt.html
+import getopt
+# http://docs.python.org/release/2.4.4/lib/module-math.html
+import math
+# http://docs.python.org/release/2.4.4/lib/module-os.html
+import os
+# http://docs.python.org/release/2.4.4/lib/module-random.html
+import random
+# http://docs.python.org/release/2.4.4/lib/module-struct.html
+import struct
+# http://docs.python.org/release/2.4.4/lib/module-sys.html
+import sys
+# http://docs.python.org/release/2.4.4/lib/module-time.html
+import time
+
+# Clear Climate Code
+import extend_path
+import fort
+import gio
+from code import eqarea
+from code import giss_data
+
+# The name of the generic source written by --format v2.
+V2_SOURCE = 'synth.v2'
+
+class Usage(Exception):
+    pass
+
+def default_last_year():
+    """The last complete year."""
+
+    return time.localtime().tm_year - 1
+
+def make_stations(n, first_year, last_year, rnd):
+    """A list of *n* synthetic stations, as (*id11*, *lat*, *lon*,
+    *light*, *first*, *last*) tuples: *light* is the night-time
+    brightness (roughly a third of the stations are rural, having a
+    brightness of 10 or less), and *first* and *last* are the years of
+    the station's record."""
+
+    result = []
+    for i in range(n):
+        # The 11-digit identifiers start with 9, so that they do not
+        # match the GHCN stations that have special treatment in
+        # Steps 0 and 1.
+        id11 = '9%010d' % i
+        # Uniform over the sphere.
+        lat = math.degrees(math.asin(rnd.uniform(-1, 1)))
+        lon = rnd.uniform(-180, 180)
+        light = rnd.choice([rnd.randint(0, 10), rnd.randint(11, 200)])
+        if rnd.random() < 0.4:
+            first = first_year
+        else:
+            first = rnd.randint(first_year, last_year)
+        if rnd.random() < 0.7:
+            last = last_year
+        else:
+            last = rnd.randint(first, last_year)
+        result.append((id11, lat, lon, light, first, last))
+    return result
+
+def inv_line(station, format):
+    """The line for *station* (see `make_stations`) in a v3.inv file,
+    or a v2.inv file if *format* is 'v2'."""
+
+    id11, lat, lon, light = station[:4]
+    if light <= 10:
+        popcls = 'R'
+    else:
+        popcls = 'U'
+    line = '%s %-30s %6.2f %7.2f %4d%5d%s%5dFLxxno10A10%-16sA' % (
+      id11, 'SYNTHETIC ' + id11, lat, lon, 100, 100, popcls, 0, 'WARM')
+    if format == 'v2':
+        if light <= 10:
+            us_light = 'A'
+        else:
+            us_light = 'C'
+        return line + '%s%4d' % (us_light, light)
+    return line + '%5d' % light
+
+def station_years(station, missing, rnd):
+    """Generate the data of *station* (see `make_stations`) as (*year*,
+    *values*) pairs; the values are in hundredths of a degree, with
+    None for a missing value.  A fraction *missing* of the values are
+    missing (some of them as entire years, which are not
+    generated)."""
+
+    id11, lat, lon, light, first, last = station
+    base = 27.0 - 0.45 * abs(lat)
+    amplitude = 0.25 * lat
+    trend = rnd.gauss(0.008, 0.004)
+    cycle = [amplitude * math.cos(math.pi * (m - 6) / 6.0) for m in range(12)]
+    for year in range(first, last + 1):
+        if rnd.random() < missing / 4:
+            continue
+        level = base + trend * (year - first) + rnd.gauss(0, 0.5)
+        values = []
+        for m in range(12):
+            if rnd.random() < missing * 0.75:
+                values.append(None)
+            else:
+                values.append(int(round(100 *
+                  (level + cycle[m] + rnd.gauss(0, 1.0)))))
+        yield year, values
+
+def write_v3(stations, dat, inv, missing, rnd):
+    """Write the data of *stations* to the file *dat*, in GHCN-M v3
+    format, and their metadata to the file *inv*."""
+
+    for station in stations:
+        inv.write(inv_line(station, 'v3') + '\n')
+        id11 = station[0]
+        for year, values in station_years(station, missing, rnd):
+            fields = []
+            for v in values:
+                if v is None:
+                    fields.append('-9999   ')
+                else:
+                    fields.append('%5d  G' % v)
+            dat.write('%s%04dTAVG%s\n' % (id11, year, ''.join(fields)))
+
+def write_v2(stations, mean, inv, missing, rnd):
+    """Write the data of *stations* to the file *mean*, in GHCN v2
+    format (in tenths of a degree), and their metadata to the file
+    *inv*."""
+
+    for station in stations:
+        inv.write(inv_line(station, 'v2') + '\n')
+        id12 = station[0] + '0'
+        for year, values in station_years(station, missing, rnd):
+            fields = []
+            for v in values:
+                if v is None:
+                    fields.append('-9999')
+                else:
+                    fields.append('%5d' % int(round(v / 10.0)))
+            mean.write('%s%04d%s\n' % (id12, year, ''.join(fields)))
+
+def sst_climatology(lat, month):
+    """The synthetic sea-surface temperature for *lat* and *month*
+    (0 to 11); polar water is colder than the cutoff for ice."""
+
+    return (29.0 * math.cos(math.radians(lat)) - 3.0 +
+      0.05 * lat * math.cos(math.pi * (month - 7) / 6.0))
+
+def write_ocean(path, last_year, rnd):
+    """Write the subbox file *path*, of sea-surface temperature
+    anomalies from 1880 to the end of *last_year*, in the form of the
+    GISS ``SBBX.HadR2`` file."""
+
+    monm = 12 * (last_year - giss_data.BASE_YEAR + 1)
+    title = ('%-40s Had: 1880-11/1981, oi2: 12/1981-%2d/%04d' %
+      ('Monthly Sea Surface Temperature anom (C)', 12, last_year))
+    meta = giss_data.SubboxMetaData(mo1=None, kq=1, mavg=6, monm=monm,
+      monm4=monm + 8, yrbeg=giss_data.BASE_YEAR, missing_flag=9999,
+      precipitation_flag=-9999, title=title.ljust(80))
+    # Every box has the same anomalies, scaled and offset; generating
+    # a separate series for each of the 8000 boxes takes a long time.
+    anomalies = []
+    v = 0.0
+    for m in range(monm):
+        v = 0.8 * v + rnd.gauss(0, 0.2)
+        anomalies.append(v)
+    out = gio.SubboxWriter(open(path, 'wb'))
+    out.write(meta)
+    for box in eqarea.grid8k():
+        if abs(eqarea.centre(box)[0]) > 75:
+            series = [giss_data.MISSING] * monm
+        else:
+            scale = rnd.uniform(0.5, 1.5)
+            offset = rnd.gauss(0, 0.1)
+            series = [offset + scale * a for a in anomalies]
+        out.write(giss_data.Series(series=series, box=list(box),
+          stations=1, station_months=monm, d=giss_data.MISSING))
+    out.close()
+
+def write_clim(path):
+    """Write the sea-surface temperature climatology file *path*, as
+    read by `gio.step4_load_clim`."""
+
+    values = []
+    for month in range(12):
+        for j in range(180):
+            t = sst_climatology(j - 89.5, month)
+            values.extend([t] * 360)
+    f = fort.File(open(path, 'wb'), bos='>')
+    f.writeline('Synthetic SST climatology'.ljust(80) +
+      struct.pack('>%df' % len(values), *values))
+    f.close()
+
+def write_monthlies(dir, year, rnd):
+    """Write the ``oiv2mon.YYYYMM`` sea-surface temperature files for
+    the months of *year* to the directory *dir*."""
+
+    for month in range(1, 13):
+        values = []
+        for j in range(180):
+            t = sst_climatology(j - 89.5, month - 1)
+            for i in range(360):
+                values.append(t + rnd.gauss(0, 0.3))
+        f = fort.File(open(os.path.join(dir, 'oiv2mon.%04d%02d' %
+          (year, month)), 'wb'), bos='>')
+        f.writeline(struct.pack('>3i', year, month, 1))
+        f.writeline(struct.pack('>%df' % len(values), *values))
+        f.close()
+
+def generate(dir, stations=1000, first_year=giss_data.BASE_YEAR,
+  last_year=None, missing=0.1, format='v3', seed=1):
+    """Write the synthetic input files to the ``input`` directory
+    under *dir*.  Returns the value of *parameters.data_sources* to
+    use for them."""
+
+    if last_year is None:
+        last_year = default_last_year()
+    input = os.path.join(dir, 'input')
+    if not os.path.isdir(input):
+        os.makedirs(input)
+    rnd = random.Random(seed)
+    network = make_stations(stations, first_year, last_year, rnd)
+    if format == 'v2':
+        open(os.path.join(input, 'v3.inv'), 'w').close()
+        mean = open(os.path.join(input, V2_SOURCE + '.mean'), 'w')
+        inv = open(os.path.join(input, V2_SOURCE + '.inv'), 'w')
+        write_v2(network, mean, inv, missing, rnd)
+        source = V2_SOURCE
+    else:
+        dat = open(os.path.join(input, 'ghcnm.tavg.qca.dat'), 'w')
+        inv = open(os.path.join(input, 'v3.inv'), 'w')
+        write_v3(network, dat, inv, missing, rnd)
+        mean = dat
+        source = 'ghcn'
+    mean.close()
+    inv.close()
+    write_ocean(os.path.join(input, 'SBBX.HadR2'), last_year - 1, rnd)
+    write_clim(os.path.join(input, 'oisstv2_mod4.clim'))
+    write_monthlies(input, last_year, rnd)
+    open(os.path.join(input, 'Ts.strange.v3.list.IN_full'), 'w').close()
+    return source
+
+def parse_years(s):
+    """Parse a range of years, "A-B"."""
+
+    try:
+        first, last = map(int, s.split('-'))
+    except ValueError:
+        raise Usage("--years must be a range of years, A-B")
+    if not giss_data.BASE_YEAR <= first <= last:
+        raise Usage("--years must be a range of years from %d"
+          % giss_data.BASE_YEAR)
+    return first, last
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    try:
+        opts, args = getopt.getopt(argv[1:], '',
+          ['help', 'stations=', 'years=', 'missing=', 'format=', 'seed='])
+        options = dict(first_year=giss_data.BASE_YEAR,
+          last_year=default_last_year())
+        for o,a in opts:
+            if o == '--help':
+                print __doc__
+                return 0
+            if o == '--stations':
+                options['stations'] = int(a)
+            elif o == '--years':
+                options['first_year'], options['last_year'] = parse_years(a)
+            elif o == '--missing':
+                options['missing'] = float(a)
+            elif o == '--format':
+                if a not in ('v2', 'v3'):
+                    raise Usage("--format must be v2 or v3")
+                options['format'] = a
+            elif o == '--seed':
+                options['seed'] = int(a)
+        if len(args) != 1:
+            raise Usage("Expected a single DIRECTORY argument")
+    except (getopt.GetoptError, ValueError, Usage), e:
+        sys.stderr.write('%s\n' % e)
+        sys.stderr.write(__doc__)
+        return 2
+    source = generate(args[0], **options)
+    print "Wrote input for data_sources=%s" % source
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
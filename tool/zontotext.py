@@ -37,7 +37,7 @@ def totext(inp, output=sys.stdout, log=sys.stderr, metaonly=False,
     # The width of a standard word according to Python's struct module...
     w = len(struct.pack('=I', 0))
 
-    f = fort.File(inp, bos=bos)
+    f = fort.MappedFile(inp, bos=bos)
     r = f.readline()
 
     # Number of words in header, preceding title.